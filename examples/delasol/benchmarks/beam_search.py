@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Compare the beam search with the exact parse on a large custom gamut.
+
+The gamut contains the hexachords numbered `--lowest` to `--highest` (see
+`HEXACHORD_TONICS`), the continental mutations, and extra mutations between all nodes
+of overlapping hexachords with the same pitch. Random melodies are parsed exactly and
+with several beam widths. For every beam width the script reports the approximation
+gap, i.e. how much heavier the best path found by the beam is than the exact best path,
+the fraction of melodies where the beam finds a path of optimal weight, and the size
+and build time of the parse graphs. Finally, it checks that updating a beam-built
+parse graph after an edit gives the same graph as building it again. Usage:
+
+    python benchmarks/beam_search.py --beam-widths 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+import numpy as np
+from music21.pitch import Pitch
+from delasol.gamut_graph import (
+    GamutGraph,
+    HexachordGraph,
+    HEXACHORD_TONICS,
+    CONTINENTAL_MUTATIONS,
+)
+from delasol.parse_graph import GamutParseGraph
+from melodies import random_melody
+
+
+def wide_gamut(lowest: int = -3, highest: int = 12, mutation_weight: float = 2.5):
+    """A gamut with many hexachords and extra mutations between all overlapping nodes
+    with the same pitch."""
+    hexachords = [
+        HexachordGraph(tonic)
+        for tonic, number in HEXACHORD_TONICS.items()
+        if lowest <= number <= highest
+    ]
+    gamut = GamutGraph(hexachords=hexachords, mutations=CONTINENTAL_MUTATIONS)
+    edges = []
+    for hexachord in gamut.hexachords.values():
+        for neighbor in gamut.overlapping_hexachords[hexachord]:
+            for pitch in hexachord.pitches:
+                for other in neighbor.pitches:
+                    source, target = (hexachord.number, pitch), (neighbor.number, other)
+                    if pitch == other and not gamut.has_edge(source, target):
+                        names = (gamut.nodes[source]["name"], gamut.nodes[target]["name"])
+                        edges.append(names)
+    gamut.add_edges_by_names(edges, weight=mutation_weight)
+    return gamut
+
+
+def compare(
+    gamut: GamutGraph,
+    beam_widths: list[int],
+    num_melodies: int = 50,
+    length: int = 20,
+    mismatch_penalty: float = 2,
+) -> dict:
+    """Parse random melodies exactly and with a beam, and summarize the results."""
+    results = {width: dict(gaps=[], times=[], nodes=[]) for width in [None] + beam_widths}
+    for seed in range(num_melodies):
+        pitches = [Pitch(name) for name in random_melody(length, seed=seed)]
+        for width in [None] + beam_widths:
+            start = time.perf_counter()
+            parse = GamutParseGraph(
+                gamut, pitches, mismatch_penalty=mismatch_penalty, beam_width=width
+            )
+            weight = parse.best_weight
+            results[width]["times"].append(time.perf_counter() - start)
+            results[width]["nodes"].append(parse.num_nodes)
+            results[width]["gaps"].append(weight)
+        exact = results[None]["gaps"][-1]
+        for width in [None] + beam_widths:
+            results[width]["gaps"][-1] -= exact
+
+    summary = {}
+    for width, result in results.items():
+        gaps = np.array(result["gaps"])
+        summary["exact" if width is None else f"beam {width}"] = dict(
+            mean_gap=gaps.mean(),
+            max_gap=gaps.max(),
+            optimal=(gaps <= 1e-9).mean(),
+            mean_nodes=np.mean(result["nodes"]),
+            mean_time=np.mean(result["times"]),
+        )
+    return summary
+
+
+def check_updates(
+    gamut: GamutGraph,
+    beam_widths: list[int],
+    num_melodies: int = 20,
+    length: int = 20,
+    num_edits: int = 5,
+) -> list[str]:
+    """Edit random melodies, update their beam-built parse graphs (see
+    `ParseGraph.update`) and compare them with graphs built from scratch. Returns a
+    list of problems; every anchor must also be a node of the graph."""
+    problems = []
+    for seed in range(num_melodies):
+        rng = np.random.default_rng(seed)
+        melody = random_melody(length, seed=seed)
+        for width in beam_widths:
+            pitches = [Pitch(name) for name in melody]
+            parse = GamutParseGraph(gamut, pitches, beam_width=width)
+            for edit in range(num_edits):
+                start = int(rng.integers(0, len(pitches)))
+                stop = min(start + int(rng.integers(0, 3)), len(pitches))
+                new = random_melody(int(rng.integers(1, 3)), seed=seed * 100 + edit)
+                new = [Pitch(name) for name in new]
+                edited = pitches[:start] + new + pitches[stop:]
+                # Chromatic steps (such as B-flat to B) cannot be parsed; skip those
+                if any(
+                    a.diatonicNoteNum == b.diatonicNoteNum and a.alter != b.alter
+                    for a, b in zip(edited[:-1], edited[1:])
+                ):
+                    continue
+                pitches = edited
+                parse.update(pitches, start, stop)
+                fresh = GamutParseGraph(gamut, pitches, beam_width=width)
+                name = f"melody {seed}, beam {width}, edit {edit}"
+                if sorted(parse.nodes) != sorted(fresh.nodes):
+                    problems.append(f"{name}: nodes differ from a fresh build")
+                if list(parse.iter_best_path()) != list(fresh.iter_best_path()):
+                    problems.append(f"{name}: best path differs from a fresh build")
+                if parse.anchors != fresh.anchors:
+                    problems.append(f"{name}: anchors differ from a fresh build")
+                for index, code in parse.anchors.items():
+                    if (parse.input_positions[index], code) not in parse:
+                        problems.append(f"{name}: anchor {index} is not in the graph")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--beam-widths", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--num-melodies", type=int, default=50)
+    parser.add_argument("--length", type=int, default=20)
+    parser.add_argument("--lowest", type=int, default=-3)
+    parser.add_argument("--highest", type=int, default=12)
+    args = parser.parse_args()
+
+    gamut = wide_gamut(args.lowest, args.highest)
+    print(f"Gamut with {len(gamut.hexachords)} hexachords and {len(gamut)} nodes")
+    summary = compare(gamut, args.beam_widths, args.num_melodies, args.length)
+    print(f"{'':>8} {'mean gap':>9} {'max gap':>8} {'optimal':>8} {'nodes':>7} {'time':>8}")
+    for name, row in summary.items():
+        print(
+            f"{name:>8} {row['mean_gap']:9.3f} {row['max_gap']:8.2f} "
+            f"{row['optimal']:8.0%} {row['mean_nodes']:7.0f} "
+            f"{row['mean_time'] * 1000:6.1f}ms"
+        )
+
+    problems = check_updates(gamut, args.beam_widths, args.num_melodies, args.length)
+    for problem in problems:
+        print(f"UPDATE: {problem}")
+    print(f"Updates of beam-built graphs: {len(problems)} problems")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""A stand-in for the MuseScore executable, to test the conversion of corpora without
+MuseScore. It supports the two ways in which `Corpus` calls MuseScore:
+
+    fake_mscore.py -o target source
+    fake_mscore.py -j job.json
+
+and 'converts' a file by copying it to the target. Sources whose contents contain the
+word FAIL are not converted, and the script then exits with an error, like MuseScore.
+Every conversion sleeps for `FAKE_MSCORE_DELAY` seconds (default 0.1), and every start
+of the script for `FAKE_MSCORE_STARTUP` seconds (default 0.5). Every call is appended to
+the file `FAKE_MSCORE_LOG`, if set. Use it as:
+
+    command = [sys.executable, "benchmarks/fake_mscore.py"]
+    corpus = Corpus(..., mscore_executable=command)
+"""
+import json
+import os
+import shutil
+import sys
+import time
+
+DELAY = float(os.environ.get("FAKE_MSCORE_DELAY", 0.1))
+STARTUP = float(os.environ.get("FAKE_MSCORE_STARTUP", 0.5))
+LOG = os.environ.get("FAKE_MSCORE_LOG")
+
+
+def convert(source: str, target: str) -> bool:
+    time.sleep(DELAY)
+    with open(source, "r") as file:
+        if "FAIL" in file.read():
+            print(f"Cannot convert {source}", file=sys.stderr)
+            return False
+    shutil.copyfile(source, target)
+    return True
+
+
+if __name__ == "__main__":
+    time.sleep(STARTUP)
+    if LOG is not None:
+        with open(LOG, "a") as file:
+            file.write(json.dumps(sys.argv[1:]) + "\n")
+
+    if sys.argv[1] == "-o":
+        target, source = sys.argv[2:4]
+        success = convert(source, target)
+    elif sys.argv[1] == "-j":
+        with open(sys.argv[2], "r") as file:
+            jobs = json.load(file)
+        success = True
+        for job in jobs:
+            targets = job["out"] if isinstance(job["out"], list) else [job["out"]]
+            for target in targets:
+                success = convert(job["in"], target) and success
+    else:
+        print(f"Unsupported arguments: {sys.argv[1:]}", file=sys.stderr)
+        success = False
+    sys.exit(0 if success else 1)
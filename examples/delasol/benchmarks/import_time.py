@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Check that importing delasol stays within an import-time budget.
+
+The script imports delasol in a fresh interpreter using `python -X importtime`, and
+fails if the delasol modules themselves take longer than the budget, or if any of the
+plotting or corpus dependencies are imported. Bytecode is cached (even if
+PYTHONDONTWRITEBYTECODE is set) and a first import warms the cache, so that the
+compilation of the modules is not counted. The fastest of `--repeat` imports is used.
+
+The check is part of the tests (tests/test_import_time.py). This script runs it from
+the command line, for example with another budget:
+
+    python benchmarks/import_time.py --budget 10
+"""
+import argparse
+import math
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Budget for the delasol modules in milliseconds. Without compilation, they took about
+# 4ms when the budget was introduced and 5ms after the cache, MusicXML loader, streaming
+# solmizer and process pool were deferred to first use.
+IMPORT_BUDGET = 10
+
+# Modules that should only be imported when plotting or working with a corpus
+DEFERRED_MODULES = ["matplotlib", "pandas", "seaborn", "yaml", "tqdm"]
+
+
+def measure_import_time(module: str = "delasol") -> tuple[dict, list[str]]:
+    """Import a module in a fresh interpreter and return the self and cumulative
+    import times (in microseconds) of all modules that were imported."""
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    )
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_time), int(cumulative))
+    imported = [m for m in result.stdout.strip().split(",") if m]
+    return times, imported
+
+
+def check_import_time(
+    budget: float = IMPORT_BUDGET, total_budget: float = None, repeat: int = 3
+) -> list[str]:
+    """Return a list of problems; the list is empty if the budget is met. The budget
+    (in milliseconds) applies to the time spent in delasol modules only, the optional
+    total budget to the cumulative time of `import delasol`. Times are the minimum
+    over `repeat` imports, after one import to warm the bytecode cache."""
+    measure_import_time("delasol")
+    own_time = total_time = math.inf
+    for _ in range(repeat):
+        times, imported = measure_import_time("delasol")
+        own = sum(t for name, (t, _) in times.items() if name.startswith("delasol"))
+        own_time = min(own_time, own)
+        total_time = min(total_time, times["delasol"][1])
+    problems = []
+    if own_time / 1000 > budget:
+        problems.append(
+            f"delasol modules took {own_time / 1000:.0f}ms to import (budget: {budget:.0f}ms)"
+        )
+    if total_budget is not None and total_time / 1000 > total_budget:
+        problems.append(
+            f"import delasol took {total_time / 1000:.0f}ms (budget: {total_budget:.0f}ms)"
+        )
+    for module in imported:
+        problems.append(f"{module} should not be imported by 'import delasol'")
+    print(
+        f"import delasol: {total_time / 1000:.0f}ms total, "
+        f"{own_time / 1000:.0f}ms in delasol modules"
+    )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=float(os.environ.get("DELASOL_IMPORT_BUDGET", IMPORT_BUDGET)),
+        help="Maximum import time of the delasol modules in milliseconds",
+    )
+    parser.add_argument(
+        "--total-budget",
+        type=float,
+        default=None,
+        help="Maximum cumulative time of 'import delasol' in milliseconds",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    problems = check_import_time(
+        budget=args.budget, total_budget=args.total_budget, repeat=args.repeat
+    )
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    sys.exit(1 if problems else 0)
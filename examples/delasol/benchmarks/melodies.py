@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Synthetic melodies for benchmarking."""
+import random
+
+STEPS = ["C", "D", "E", "F", "G", "A", "B"]
+
+
+def random_melody(
+    length: int, seed: int = 0, lowest: int = 23, highest: int = 33
+) -> list[str]:
+    """A random walk over the diatonic note numbers between `lowest` and `highest`
+    (G3 to C5 by default), with occasional B-flats. Returns a list of pitch names."""
+    rng = random.Random(seed)
+    diatonic = (lowest + highest) // 2
+    melody = []
+    for _ in range(length):
+        step = STEPS[(diatonic - 1) % 7]
+        flat = "-" if step == "B" and rng.random() < 0.3 else ""
+        melody.append(f"{step}{flat}{(diatonic - 1) // 7}")
+        diatonic += rng.choice([-1, 1, -1, 1, -2, 2, 3, -3])
+        diatonic = min(max(diatonic, lowest), highest)
+    return melody
+
+
+def repeated_note_melody(length: int) -> list[str]:
+    """A melody of one repeated note followed by a short phrase. The repeated note has
+    several candidate nodes, but only one of them continues to the phrase, so that the
+    parse graph has branches that are as long as the melody and have to be pruned."""
+    return ["F4"] * (length - 4) + ["G4", "A4", "F4", "D4"]
+
+
+def gamut_melody(
+    gamut, length: int, seed: int = 0, span: int = None, accidentals: float = 0.3
+) -> list[str]:
+    """A random walk over the pitches of a gamut. The walk stays within `span` diatonic
+    steps around the middle of the gamut (or the whole gamut if `span` is None). Where
+    the gamut has both a natural and an altered pitch (like B and B-flat), the altered
+    one is chosen with probability `accidentals`. When the walk stays at the same step,
+    the previous pitch is repeated. Returns a list of pitch names."""
+    rng = random.Random(seed)
+    pitches = {}
+    for pitch in gamut.pitches:
+        pitches.setdefault(pitch.diatonicNoteNum, set()).add(pitch.nameWithOctave)
+    diatonic = sorted(pitches)
+    middle = (diatonic[0] + diatonic[-1]) // 2
+    if span is not None:
+        lowest, highest = middle - span // 2, middle + (span + 1) // 2
+        diatonic = [d for d in diatonic if lowest <= d <= highest]
+
+    index = len(diatonic) // 2
+    prev_index = None
+    melody = []
+    for _ in range(length):
+        names = sorted(pitches[diatonic[index]])
+        natural = [name for name in names if "-" not in name and "#" not in name]
+        altered = [name for name in names if name not in natural]
+        if index == prev_index:
+            melody.append(melody[-1])
+        elif len(altered) > 0 and (len(natural) == 0 or rng.random() < accidentals):
+            melody.append(rng.choice(altered))
+        else:
+            melody.append(natural[0])
+        prev_index = index
+        index += rng.choice([-1, 1, -1, 1, -2, 2, 3, -3])
+        index = min(max(index, 0), len(diatonic) - 1)
+    return melody
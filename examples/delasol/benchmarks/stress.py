@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Stress test for solmizing very long melodies.
+
+The script solmizes synthetic melodies of increasing length (up to 100k notes by
+default) and times the construction of the parse graph (including pruning), the
+segmentation and the selection of the best path. It fails if any stage does not scale
+linearly: if the time per note at the longest melody exceeds `--max-growth` times the
+time per note at the shortest. Melodies with very long dead branches are included to
+check that pruning does not depend on the recursion limit. Usage:
+
+    python benchmarks/stress.py --length 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+from music21.pitch import Pitch
+from delasol import get_gamut
+from delasol.parse_graph import GamutParseGraph
+from melodies import random_melody, repeated_note_melody
+
+MELODIES = {
+    "random": random_melody,
+    "repeated": repeated_note_melody,
+}
+
+
+def time_stages(melody: list[str], gamut_name: str = "hard-continental") -> dict:
+    """Solmize a melody and return the duration of every stage in seconds."""
+    gamut = get_gamut(gamut_name)
+    pitches = [Pitch(name) for name in melody]
+    times = {}
+    start = time.perf_counter()
+    parse = GamutParseGraph(gamut, pitches, mismatch_penalty=2)
+    times["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    segments = parse.segments
+    times["segment"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    path = list(parse.iter_best_path())
+    times["best_path"] = time.perf_counter() - start
+    assert len(path) == len(melody) and len(segments) > 0
+    return times
+
+
+def check_scaling(length: int = 100_000, steps: int = 3, max_growth: float = 2.0):
+    """Time all stages for melodies of length `length / 2**k` for k = steps, ..., 0
+    and return a list of problems; the list is empty if all stages scale linearly."""
+    # Warm up the gamut and its tables
+    time_stages(random_melody(100))
+    problems = []
+    for name, melody_fn in MELODIES.items():
+        per_note = {}
+        for k in range(steps, -1, -1):
+            n = length // 2**k
+            times = time_stages(melody_fn(n))
+            summary = ", ".join(f"{stage} {t:.2f}s" for stage, t in times.items())
+            print(f"{name:>8} n={n:>7}: {summary}")
+            for stage, t in times.items():
+                per_note.setdefault(stage, []).append(t / n)
+
+        for stage, values in per_note.items():
+            growth = values[-1] / max(values[0], 1e-9)
+            if growth > max_growth:
+                problems.append(
+                    f"{stage} of {name} melodies: time per note grew {growth:.1f}x "
+                    f"(max: {max_growth:.1f}x)"
+                )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--length", type=int, default=100_000)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--max-growth", type=float, default=2.0)
+    args = parser.parse_args()
+    problems = check_scaling(args.length, args.steps, args.max_growth)
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Reproducible benchmark suite for the solmization engine.
+
+Synthetic melodies of several lengths, ranges and densities of accidentals (see
+`melodies.gamut_melody`) are solmized with all gamuts in `GAMUTS`. For every melody the
+suite measures the stages of a solmization: building the parse graph, computing the
+segments and counting their paths, selecting the best path and annotating a stream.
+The construction of every gamut is measured separately. Times are the minimum over
+`--repeat` runs; peak memory is measured in a separate run using tracemalloc. The sizes
+of the parse graphs (nodes, maximum width, segments and paths) are recorded as well.
+
+Results are written to a JSON file. When a baseline is passed using `--compare`, the
+script reports every stage that became slower or used more memory than the baseline by
+more than `--threshold`, and every change in the sizes of the parse graphs (which
+should be identical), and fails if there are any. To compare results from machines (or
+moments) of different speed, times are scaled by the time of a fixed calibration loop,
+measured at the start and the end of every run. Usage:
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --output new.json --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+import numpy as np
+import music21
+from music21.pitch import Pitch
+from delasol import get_gamut, solmize
+from delasol.gamut_graph import GAMUTS
+from delasol.parse_graph import GamutParseGraph
+from delasol.profiling import Tracer
+from delasol.utils import as_stream
+from melodies import gamut_melody
+
+# Sizes of the parse graph that should not change between runs
+SIZES = ["nodes", "max_width", "segments", "max_paths", "total_paths"]
+
+# Differences below these are noise, regardless of the threshold
+MIN_TIME_DIFFERENCE = 1e-3
+MIN_MEMORY_DIFFERENCE = 64 * 1024
+
+
+def calibrate(repeat: int = 5) -> float:
+    """The minimum time of a fixed pure-Python workload."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sum(i * i for i in range(200_000))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def case_name(gamut_name: str, length: int, span: int, accidentals: float) -> str:
+    span = "full" if span is None else span
+    return f"{gamut_name}/n={length}/span={span}/acc={accidentals}"
+
+
+def run_stages(
+    gamut_name: str, melody: list[str], tracer: Tracer, annotate: bool = True
+) -> dict:
+    """Solmize a melody once, tracing every stage, and return the sizes of the parse."""
+    gamut = get_gamut(gamut_name)
+    pitches = [Pitch(name) for name in melody]
+    with tracer.stage("build"):
+        parse = GamutParseGraph(gamut, pitches, mismatch_penalty=2)
+    with tracer.stage("segments"):
+        num_paths = [segment.num_paths for segment in parse.segments]
+    with tracer.stage("best_path"):
+        path = list(parse.iter_best_path())
+    assert len(path) == len(melody)
+
+    if annotate:
+        stream = as_stream(" ".join(melody))
+        solmization = solmize(stream, gamut=gamut_name)
+        with tracer.stage("annotate"):
+            solmization.annotate()
+
+    return dict(
+        nodes=parse.num_nodes,
+        max_width=int(parse.width.max()),
+        segments=len(num_paths),
+        max_paths=max(num_paths),
+        total_paths=sum(num_paths),
+    )
+
+
+def measure(func, repeat: int = 5) -> dict:
+    """Run `func(tracer)` `repeat` times for timing and once more for memory, and
+    return the minimum time and the peak memory of every stage, and the result."""
+    times = {}
+    for _ in range(repeat):
+        tracer = Tracer(memory=False)
+        result = func(tracer)
+        for record in tracer.records:
+            stage = record["stage"]
+            times[stage] = min(times.get(stage, np.inf), record["time"])
+
+    tracer = Tracer(memory=True)
+    tracer.start()
+    try:
+        func(tracer)
+    finally:
+        tracer.stop()
+    stages = {
+        record["stage"]: dict(
+            time=times[record["stage"]], peak_memory=record["peak_memory"]
+        )
+        for record in tracer.records
+    }
+    return stages, result
+
+
+def run_suite(
+    lengths: list[int] = [100, 1000],
+    spans: list[int] = [7, None],
+    accidentals: list[float] = [0.0, 0.3],
+    repeat: int = 5,
+    max_annotate_length: int = 200,
+    seed: int = 0,
+) -> dict:
+    calibration = calibrate(repeat)
+    results = dict(
+        meta=dict(
+            date=datetime.now().isoformat(timespec="seconds"),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            numpy=np.__version__,
+            music21=music21.__version__,
+            repeat=repeat,
+            seed=seed,
+        ),
+        gamuts={},
+        cases={},
+    )
+    for gamut_name in GAMUTS:
+        stages, _ = measure(
+            lambda tracer: _build_gamut(gamut_name, tracer), repeat=repeat
+        )
+        results["gamuts"][gamut_name] = stages["gamut"]
+        print(f"{gamut_name}: gamut {stages['gamut']['time'] * 1000:.1f}ms")
+
+    for gamut_name in GAMUTS:
+        gamut = get_gamut(gamut_name)
+        for length in lengths:
+            for span in spans:
+                for density in accidentals:
+                    name = case_name(gamut_name, length, span, density)
+                    melody = gamut_melody(
+                        gamut, length, seed=seed, span=span, accidentals=density
+                    )
+                    annotate = length <= max_annotate_length
+                    stages, sizes = measure(
+                        lambda tracer: run_stages(gamut_name, melody, tracer, annotate),
+                        repeat=repeat,
+                    )
+                    results["cases"][name] = dict(stages=stages, **sizes)
+                    summary = ", ".join(
+                        f"{stage} {stats['time'] * 1000:.1f}ms"
+                        for stage, stats in stages.items()
+                    )
+                    print(f"{name}: {summary} (width {sizes['max_width']})")
+
+    calibration = (calibration + calibrate(repeat)) / 2
+    results["meta"]["calibration"] = calibration
+    return results
+
+
+def _build_gamut(gamut_name: str, tracer: Tracer):
+    with tracer.stage("gamut"):
+        get_gamut(gamut_name, cache=False)
+
+
+def _compare_stage(
+    name: str, stats: dict, base: dict, threshold: float, scale: float = 1.0
+) -> list[str]:
+    problems = []
+    duration, base_duration = stats["time"], base["time"] * scale
+    if (
+        duration > threshold * base_duration
+        and duration - base_duration > MIN_TIME_DIFFERENCE
+    ):
+        problems.append(
+            f"{name}: {duration * 1000:.1f}ms vs {base_duration * 1000:.1f}ms "
+            f"({duration / base_duration:.2f}x)"
+        )
+    memory, base_memory = stats["peak_memory"], base["peak_memory"]
+    if (
+        memory > threshold * base_memory
+        and memory - base_memory > MIN_MEMORY_DIFFERENCE
+    ):
+        problems.append(
+            f"{name}: peak memory {memory / 1024:.0f}KB vs {base_memory / 1024:.0f}KB "
+            f"({memory / max(base_memory, 1):.2f}x)"
+        )
+    return problems
+
+
+def compare(results: dict, baseline: dict, threshold: float = 1.5) -> list[str]:
+    """Compare results with a baseline and return a list of regressions; the list is
+    empty if there are none. Cases that are missing in either are skipped. The times
+    of the baseline are scaled by the ratio of the calibration times."""
+    scale = results["meta"]["calibration"] / baseline["meta"]["calibration"]
+    problems = []
+    for gamut_name, stats in results["gamuts"].items():
+        if gamut_name in baseline["gamuts"]:
+            base = baseline["gamuts"][gamut_name]
+            name = f"{gamut_name} gamut"
+            problems += _compare_stage(name, stats, base, threshold, scale)
+
+    for name, case in results["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        base_case = baseline["cases"][name]
+        for stage, stats in case["stages"].items():
+            if stage in base_case["stages"]:
+                base = base_case["stages"][stage]
+                stage_name = f"{name} {stage}"
+                problems += _compare_stage(stage_name, stats, base, threshold, scale)
+        for size in SIZES:
+            if case[size] != base_case[size]:
+                problems.append(
+                    f"{name}: {size} changed from {base_case[size]} to {case[size]}"
+                )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--threshold", type=float, default=1.5)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-annotate-length", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_suite(
+        lengths=args.lengths,
+        repeat=args.repeat,
+        max_annotate_length=args.max_annotate_length,
+        seed=args.seed,
+    )
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+        problems = compare(results, baseline, threshold=args.threshold)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if len(problems) == 0:
+            print(f"No regressions compared to {args.compare}")
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Concurrency stress test for solmizing in a thread pool.
+
+The script solmizes many random melodies with all gamuts and both engines, first
+sequentially and then repeatedly in a thread pool, starting every round with an empty
+gamut registry so that threads race to construct the same gamuts. It fails if any
+result differs from the sequential one, or if a gamut was constructed more than once.
+A very short switch interval makes thread switches (and thus races) more likely.
+
+A small variant of the check is part of the tests (tests/test_thread_stress.py). This
+script runs the larger stress test:
+
+    python benchmarks/thread_stress.py --threads 8 --rounds 5
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+from delasol import solmize
+from delasol.gamut_graph import GAMUTS, GAMUT_REGISTRY
+from melodies import random_melody
+
+ENGINES = ["graph", "trellis"]
+
+
+def make_jobs(num_melodies: int, length: int) -> list[tuple]:
+    """All combinations of a melody, a gamut and an engine."""
+    jobs = []
+    for seed in range(num_melodies):
+        melody = random_melody(length, seed=seed)
+        for gamut in GAMUTS:
+            for engine in ENGINES:
+                jobs.append((melody, gamut, engine))
+    return jobs
+
+
+def run_job(job: tuple) -> list[str]:
+    melody, gamut, engine = job
+    return solmize(melody, gamut=gamut, engine=engine).output(style="state")
+
+
+def run_round(jobs: list[tuple], threads: int) -> tuple[list, float]:
+    GAMUT_REGISTRY.clear()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(run_job, jobs))
+    return results, time.perf_counter() - start
+
+
+def check_threads(
+    threads: int = 4,
+    rounds: int = 2,
+    num_melodies: int = 3,
+    length: int = 20,
+    switch_interval: float = 1e-6,
+    verbose: bool = False,
+) -> list[str]:
+    """Compare solmizing in a thread pool to solmizing sequentially, and return a
+    description of every problem found. The defaults are small enough for the tests;
+    the script runs a larger variant."""
+    jobs = make_jobs(num_melodies, length)
+    GAMUT_REGISTRY.clear()
+    start = time.perf_counter()
+    expected = [run_job(job) for job in jobs]
+    if verbose:
+        duration = time.perf_counter() - start
+        print(f"sequential: {len(jobs)} solmizations in {duration:.2f}s")
+
+    problems = []
+    old_switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(switch_interval)
+    try:
+        for round in range(rounds):
+            results, duration = run_round(jobs, threads)
+            errors = sum(result != exp for result, exp in zip(results, expected))
+            misses = GAMUT_REGISTRY.info()["misses"]
+            if verbose:
+                print(
+                    f"round {round + 1}: {threads} threads, {duration:.2f}s, "
+                    f"{errors} differences, {misses} gamuts constructed"
+                )
+            if errors > 0:
+                problems.append(f"round {round + 1}: {errors} results differ")
+            if misses != len(GAMUTS):
+                problems.append(
+                    f"round {round + 1}: {misses} gamuts constructed "
+                    f"instead of {len(GAMUTS)}"
+                )
+    finally:
+        sys.setswitchinterval(old_switch_interval)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--num-melodies", type=int, default=25)
+    parser.add_argument("--length", type=int, default=50)
+    parser.add_argument("--switch-interval", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    problems = check_threads(
+        threads=args.threads,
+        rounds=args.rounds,
+        num_melodies=args.num_melodies,
+        length=args.length,
+        switch_interval=args.switch_interval,
+        verbose=True,
+    )
+    for problem in problems:
+        print(problem)
+    if problems:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
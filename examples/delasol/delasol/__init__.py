@@ -4,7 +4,25 @@
 # Copyright © 2024 Bas Cornelissen
 # -------------------------------------------------------------------
 from .solmization import solmize
+from .solmization import solmize_many
 from .solmization import Solmization
 from .solmization import StreamSolmization
 from .gamut_graph import get_gamut
-from .corpus import Corpus
+
+# Modules that are not needed for solmization are only imported when used. The corpus
+# module in particular depends on pandas, yaml and tqdm, which are slow to import.
+_LAZY_ATTRIBUTES = {
+    "Corpus": "corpus",
+    "StreamingSolmizer": "streaming",
+    "ResultCache": "result_cache",
+    "load_musicxml": "musicxml",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+
+        module = importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
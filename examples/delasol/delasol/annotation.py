@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import xml.etree.ElementTree as ET
+from collections.abc import Sequence
+from music21.note import Lyric, NotRest
+from music21.spanner import Line
+from music21.stream import Stream
+
+from .musicxml import _open, _lyric_number, _PartReader
+
+
+class AnnotationTable:
+    """A table of annotations of a sequence of notes: lyrics (with colors) and lines
+    over segments of notes. Notes are referred to by their index in the sequence. The
+    annotations are collected first and then applied in a single pass, either to
+    music21 notes (`apply`) or directly to a MusicXML file (`write_musicxml`).
+
+    >>> table = AnnotationTable()
+    >>> table.add_lyric(0, "ut", number=2, color="green")
+    >>> table.add_segment(0, 3)
+    >>> table
+    <AnnotationTable with 1 lyrics and 1 segments>
+    """
+
+    def __init__(self):
+        # Rows (note index, lyric number or None, text, color or None)
+        self.lyrics = []
+        # Pairs (index of the first note, index of the last note)
+        self.segments = []
+        # Colors of lyric lines on all notes
+        self.line_colors = {}
+
+    def __repr__(self):
+        return (
+            f"<AnnotationTable with {len(self.lyrics)} lyrics "
+            f"and {len(self.segments)} segments>"
+        )
+
+    def add_lyric(self, index: int, text: str, number: int = None, color: str = None):
+        """Add a lyric to a note. If the note already has a lyric with that number,
+        its text is replaced. Without a number, the lyric is added after the others."""
+        self.lyrics.append((index, number, text, color))
+
+    def add_segment(self, start: int, end: int):
+        """Draw a dotted line over the notes `start, ..., end`."""
+        self.segments.append((start, end))
+
+    def color_line(self, number: int, color: str):
+        """Set the color of a line of lyrics on all notes."""
+        self.line_colors[number] = color
+
+    def lyrics_by_note(self) -> dict[int, list[tuple]]:
+        lyrics = {}
+        for index, number, text, color in self.lyrics:
+            lyrics.setdefault(index, []).append((number, text, color))
+        return lyrics
+
+    def apply(self, notes: Sequence[NotRest], stream: Stream = None):
+        """Apply the annotations to music21 notes, and insert the segment lines into a
+        stream. Every note is visited once, and the stream is only updated once."""
+        for index, lyrics in self.lyrics_by_note().items():
+            note = notes[index]
+            by_number = {lyric.number: lyric for lyric in note.lyrics}
+            for number, text, color in lyrics:
+                if number is None:
+                    number = len(note.lyrics) + 1
+                if number in by_number:
+                    by_number[number].text = text
+                else:
+                    by_number[number] = Lyric(text, number)
+                    note.lyrics.append(by_number[number])
+                if color is not None:
+                    by_number[number].style.color = color
+
+        if len(self.line_colors) > 0:
+            for note in notes:
+                for lyric in note.lyrics:
+                    if lyric.number in self.line_colors:
+                        lyric.style.color = self.line_colors[lyric.number]
+
+        if stream is not None and len(self.segments) > 0:
+            for start, end in self.segments:
+                line = Line(notes[start : end + 1])
+                line.lineType = "dotted"
+                stream.coreInsert(0, line)
+            stream.coreElementsChanged()
+
+    def write_musicxml(self, source: str, target: str, part: int = 0):
+        """Write the lyrics directly into the notes of a part in a MusicXML file, and
+        save the result as an (uncompressed) MusicXML file. The notes are numbered as in
+        `musicxml.load_musicxml`. Segment lines are not written."""
+        from music21.musicxml.m21ToXml import normalizeColor
+
+        with _open(source) as file:
+            tree = ET.parse(file)
+        part_element = tree.getroot().findall("part")[part]
+        reader = _PartReader(part_element.get("id"))
+        for measure in part_element.findall("measure"):
+            reader.start_measure()
+            for element in measure:
+                reader.read(element)
+        elements = reader.elements()
+
+        def set_color(lyric, color):
+            if color is not None:
+                lyric.set("color", normalizeColor(color))
+
+        for index, lyrics in self.lyrics_by_note().items():
+            note = elements[index]
+            existing = note.findall("lyric")
+            by_number = {
+                _lyric_number(lyric, position): lyric
+                for position, lyric in enumerate(existing)
+            }
+            # Lyrics go before the play and listen elements (if any)
+            position = len(note)
+            for i, child in enumerate(note):
+                if child.tag in ("play", "listen"):
+                    position = i
+                    break
+            for number, text, color in lyrics:
+                if number is None:
+                    number = len(existing) + 1
+                if number in by_number:
+                    lyric = by_number[number]
+                    if lyric.find("text") is None:
+                        ET.SubElement(lyric, "text")
+                    lyric.find("text").text = text
+                else:
+                    lyric = ET.Element("lyric", number=str(number))
+                    ET.SubElement(lyric, "syllabic").text = "single"
+                    ET.SubElement(lyric, "text").text = text
+                    note.insert(position, lyric)
+                    position += 1
+                    existing.append(lyric)
+                    by_number[number] = lyric
+                set_color(lyric, color)
+
+        if len(self.line_colors) > 0:
+            for note in elements:
+                for position, lyric in enumerate(note.findall("lyric")):
+                    number = _lyric_number(lyric, position)
+                    set_color(lyric, self.line_colors.get(number))
+
+        tree.write(target, encoding="UTF-8", xml_declaration=True)
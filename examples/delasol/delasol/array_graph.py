@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import numpy as np
+import networkx as nx
+from collections.abc import Mapping
+from typing import Optional
+
+# Nodes are identified by a position and an integer code
+Node = tuple[int, int]
+
+
+class ArrayGraph:
+    """A compact directed graph whose nodes are pairs `(position, code)` of integers.
+
+    The graph is built in two phases. While building, nodes and edges can only be added;
+    they are kept in plain Python containers. Calling `finalize` converts the graph into
+    numpy arrays: nodes are sorted by position and code, and adjacency is stored in CSR
+    format (offsets into arrays of edge ids, sorted by source and target), with the edge
+    weights in a single float array. No attributes are stored per node or edge. After
+    finalizing, nodes can still be removed; they are then only marked as removed.
+
+    >>> G = ArrayGraph()
+    >>> G.add_edge((0, -1), (1, 3), weight=1.5)
+    >>> G.add_edge((0, -1), (1, 2), weight=0.5)
+    >>> G.finalize()
+    >>> G.successors((0, -1))
+    [(1, 2), (1, 3)]
+    >>> G.remove_node((1, 2))
+    >>> G.out_degree((0, -1))
+    1
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.finalized = False
+        # Build phase
+        self._node_ids = {}
+        self._node_list = []
+        self._edge_ids = {}
+        self._edge_weights = []
+        # Finalized graph
+        self.node_pos = np.zeros(0, dtype=np.int32)
+        self.node_code = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.pos_offsets = np.zeros(1, dtype=np.int64)
+        self.edge_src = np.zeros(0, dtype=np.int32)
+        self.edge_dst = np.zeros(0, dtype=np.int32)
+        self.edge_weight = np.zeros(0, dtype=float)
+        self.succ_offsets = np.zeros(1, dtype=np.int64)
+        self.succ_edges = np.zeros(0, dtype=np.int32)
+        self.pred_offsets = np.zeros(1, dtype=np.int64)
+        self.pred_edges = np.zeros(0, dtype=np.int32)
+        self._node_codes = None
+        self._adjacency = None
+
+    ## Building
+
+    def add_node(self, node: Node) -> int:
+        """Add a node (if it does not exist yet) and return its id."""
+        if self.finalized:
+            raise RuntimeError("Nodes cannot be added to a finalized graph")
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            node_id = len(self._node_list)
+            self._node_ids[node] = node_id
+            self._node_list.append(node)
+        return node_id
+
+    def add_edge(self, source: Node, target: Node, weight: float = 1):
+        """Add an edge, or update its weight if it already exists."""
+        key = (self.add_node(source), self.add_node(target))
+        edge_id = self._edge_ids.get(key)
+        if edge_id is None:
+            self._edge_ids[key] = len(self._edge_weights)
+            self._edge_weights.append(weight)
+        else:
+            self._edge_weights[edge_id] = weight
+
+    def has_node(self, node: Node) -> bool:
+        if not self.finalized:
+            return node in self._node_ids
+        return self._find(node) is not None
+
+    def finalize(self):
+        """Convert the graph to its compact array representation."""
+        if self.finalized:
+            return
+        nodes = np.array(self._node_list, dtype=np.int32).reshape(-1, 2)
+        order = np.lexsort((nodes[:, 1], nodes[:, 0]))
+        new_ids = np.empty(len(order), dtype=np.int32)
+        new_ids[order] = np.arange(len(order), dtype=np.int32)
+        self.node_pos = nodes[order, 0]
+        self.node_code = nodes[order, 1]
+        self.alive = np.ones(len(order), dtype=bool)
+        num_positions = self.node_pos.max() + 1 if len(order) > 0 else 0
+        counts = np.bincount(self.node_pos, minlength=num_positions)
+        self.pos_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        edges = np.array(list(self._edge_ids.keys()), dtype=np.int32).reshape(-1, 2)
+        self.edge_src = new_ids[edges[:, 0]]
+        self.edge_dst = new_ids[edges[:, 1]]
+        self.edge_weight = np.array(self._edge_weights, dtype=float)
+        self.succ_offsets, self.succ_edges = self._csr(self.edge_src, self.edge_dst)
+        self.pred_offsets, self.pred_edges = self._csr(self.edge_dst, self.edge_src)
+
+        self._node_ids = {}
+        self._node_list = []
+        self._edge_ids = {}
+        self._edge_weights = []
+        self.finalized = True
+
+    def _csr(self, rows: np.ndarray, cols: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Offsets and edge ids of a CSR representation, sorted by rows and columns"""
+        edges = np.lexsort((cols, rows)).astype(np.int32)
+        counts = np.bincount(rows, minlength=len(self.node_pos))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return offsets, edges
+
+    ## Nodes
+
+    def __len__(self):
+        return len(self.pos_offsets) - 1
+
+    def __contains__(self, node: Node) -> bool:
+        return self.has_node(node)
+
+    @property
+    def num_nodes(self) -> int:
+        return int(self.alive.sum())
+
+    @property
+    def nodes(self) -> list[Node]:
+        ids = np.flatnonzero(self.alive)
+        return list(zip(self.node_pos[ids].tolist(), self.node_code[ids].tolist()))
+
+    def node(self, node_id: int) -> Node:
+        return (int(self.node_pos[node_id]), int(self.node_code[node_id]))
+
+    def _find(self, node: Node) -> Optional[int]:
+        pos, code = node
+        if not 0 <= pos < len(self):
+            return None
+        start, end = self.pos_offsets[pos], self.pos_offsets[pos + 1]
+        index = start + np.searchsorted(self.node_code[start:end], code)
+        if index < end and self.node_code[index] == code and self.alive[index]:
+            return int(index)
+        return None
+
+    def node_id(self, node: Node) -> int:
+        node_id = self._find(node)
+        if node_id is None:
+            raise KeyError(f"Node {node} is not in the graph")
+        return node_id
+
+    def position_ids(self, pos: int) -> list[int]:
+        """The ids of all nodes at a given position"""
+        start, end = self.pos_offsets[pos], self.pos_offsets[pos + 1]
+        return (start + np.flatnonzero(self.alive[start:end])).tolist()
+
+    @property
+    def node_codes(self) -> list[int]:
+        """The codes of all nodes, indexed by node id"""
+        if self._node_codes is None:
+            self._node_codes = self.node_code.tolist()
+        return self._node_codes
+
+    def remove_node(self, node: Node):
+        self._remove(self.node_id(node))
+
+    def _remove(self, node_id: int):
+        self.alive[node_id] = False
+        self._adjacency = None
+
+    ## Edges
+
+    @property
+    def adjacency(self) -> tuple[list[int], list[int], list[float]]:
+        """The successors of all nodes as plain lists (offsets, target ids and weights),
+        which are much faster than numpy arrays for traversing the graph node by node.
+        Edges from or to removed nodes are left out."""
+        if self._adjacency is None:
+            edges = self.succ_edges[self.edge_alive[self.succ_edges]]
+            counts = np.bincount(self.edge_src[edges], minlength=len(self.node_pos))
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            self._adjacency = (
+                offsets.tolist(),
+                self.edge_dst[edges].tolist(),
+                self.edge_weight[edges].tolist(),
+            )
+        return self._adjacency
+
+    def out_edges(self, node_id: int) -> tuple[list[int], list[float]]:
+        """The ids of the successors of a node, and the weights of the edges to them"""
+        offsets, targets, weights = self.adjacency
+        start, end = offsets[node_id], offsets[node_id + 1]
+        return targets[start:end], weights[start:end]
+
+    def in_edges(self, node_id: int) -> tuple[list[int], list[float]]:
+        """The ids of the predecessors of a node, and the weights of the edges"""
+        edges = self.pred_edges[self.pred_offsets[node_id] : self.pred_offsets[node_id + 1]]
+        sources = self.edge_src[edges]
+        keep = self.alive[sources]
+        return sources[keep].tolist(), self.edge_weight[edges[keep]].tolist()
+
+    def successors(self, node: Node) -> list[Node]:
+        targets, _ = self.out_edges(self.node_id(node))
+        return [self.node(target) for target in targets]
+
+    def predecessors(self, node: Node) -> list[Node]:
+        sources, _ = self.in_edges(self.node_id(node))
+        return [self.node(source) for source in sources]
+
+    def out_degree(self, node: Node) -> int:
+        return self._out_degree(self.node_id(node))
+
+    def _out_degree(self, node_id: int) -> int:
+        edges = self.succ_edges[self.succ_offsets[node_id] : self.succ_offsets[node_id + 1]]
+        return int(self.alive[self.edge_dst[edges]].sum())
+
+    def in_degree(self, node: Node) -> int:
+        return len(self.in_edges(self.node_id(node))[0])
+
+    @property
+    def edge_alive(self) -> np.ndarray:
+        """A boolean array indicating which edges have not been removed"""
+        return self.alive[self.edge_src] & self.alive[self.edge_dst]
+
+    @property
+    def edges(self) -> list[tuple[Node, Node, float]]:
+        edges = np.flatnonzero(self.edge_alive)
+        return [
+            (self.node(u), self.node(v), w)
+            for u, v, w in zip(
+                self.edge_src[edges], self.edge_dst[edges], self.edge_weight[edges]
+            )
+        ]
+
+    def edge_weight_between(self, source: Node, target: Node) -> float:
+        targets, weights = self.out_edges(self.node_id(source))
+        return weights[targets.index(self.node_id(target))]
+
+    def splice(
+        self, other: "ArrayGraph", start: int, end: int, other_start: int, other_end: int
+    ) -> tuple[int, int]:
+        """Replace the positions `start, ..., end` of this graph by the positions
+        `other_start, ..., other_end` of another (finalized) graph. Both ranges must begin
+        and end at a position with a single node; these nodes are taken from the other
+        graph. The positions after `end` are shifted accordingly. Returns the shift of
+        the positions and of the node ids after the spliced range."""
+        if not (self.finalized and other.finalized):
+            raise RuntimeError("Only finalized graphs can be spliced")
+        N = len(self.node_pos)
+        nA = int(self.pos_offsets[start])
+        old_C = int(self.pos_offsets[end + 1])
+        B_start = int(other.pos_offsets[other_start])
+        B_end = int(other.pos_offsets[other_end + 1])
+        nB = B_end - B_start
+        if old_C - int(self.pos_offsets[end]) != 1 or nA + 1 != self.pos_offsets[start + 1]:
+            raise ValueError("The spliced range must start and end at a single node")
+        pos_shift = start + (other_end - other_start) - end
+        id_shift = nA + nB - old_C
+
+        # Map node ids of both graphs to the ids in the spliced graph
+        old_map = np.full(N, -1, dtype=np.int64)
+        old_map[:nA] = np.arange(nA)
+        old_map[old_C:] = np.arange(old_C, N) + id_shift
+        old_map[nA] = nA
+        old_map[old_C - 1] = nA + nB - 1
+        other_map = np.full(len(other.node_pos), -1, dtype=np.int64)
+        other_map[B_start:B_end] = np.arange(nA, nA + nB)
+
+        # Keep the edges outside the replaced range, and add those of the other graph
+        src_pos = self.node_pos[self.edge_src]
+        keep = (src_pos < start) | (src_pos >= end)
+        other_src_pos = other.node_pos[other.edge_src]
+        other_keep = (other_src_pos >= other_start) & (other_src_pos < other_end)
+
+        self.node_pos = np.concatenate(
+            [
+                self.node_pos[:nA],
+                other.node_pos[B_start:B_end] + (start - other_start),
+                self.node_pos[old_C:] + pos_shift,
+            ]
+        ).astype(np.int32)
+        self.node_code = np.concatenate(
+            [self.node_code[:nA], other.node_code[B_start:B_end], self.node_code[old_C:]]
+        )
+        self.alive = np.concatenate(
+            [self.alive[:nA], other.alive[B_start:B_end], self.alive[old_C:]]
+        )
+        counts = np.bincount(self.node_pos, minlength=self.node_pos[-1] + 1)
+        self.pos_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        self.edge_src = np.concatenate(
+            [old_map[self.edge_src[keep]], other_map[other.edge_src[other_keep]]]
+        ).astype(np.int32)
+        self.edge_dst = np.concatenate(
+            [old_map[self.edge_dst[keep]], other_map[other.edge_dst[other_keep]]]
+        ).astype(np.int32)
+        self.edge_weight = np.concatenate(
+            [self.edge_weight[keep], other.edge_weight[other_keep]]
+        )
+        self.succ_offsets, self.succ_edges = self._csr(self.edge_src, self.edge_dst)
+        self.pred_offsets, self.pred_edges = self._csr(self.edge_dst, self.edge_src)
+        self._node_codes = None
+        self._adjacency = None
+        return pos_shift, id_shift
+
+    def to_networkx(self) -> nx.DiGraph:
+        G = nx.DiGraph()
+        G.add_nodes_from(self.nodes)
+        G.add_weighted_edges_from(self.edges)
+        return G
+
+    def nbytes(self) -> int:
+        """The number of bytes used by the arrays of the (finalized) graph"""
+        arrays = [
+            self.node_pos,
+            self.node_code,
+            self.alive,
+            self.pos_offsets,
+            self.edge_src,
+            self.edge_dst,
+            self.edge_weight,
+            self.succ_offsets,
+            self.succ_edges,
+            self.pred_offsets,
+            self.pred_edges,
+        ]
+        return sum(array.nbytes for array in arrays)
+
+
+class PositionMap(Mapping):
+    """A read-only mapping from positions to the (remaining) nodes of an `ArrayGraph` at
+    that position. Nodes are looked up in the arrays of the graph on access, so the
+    mapping never has to be rebuilt when nodes are removed."""
+
+    def __init__(self, graph: ArrayGraph):
+        self.graph = graph
+
+    def __getitem__(self, pos: int) -> list[Node]:
+        if not 0 <= pos < len(self.graph):
+            raise KeyError(pos)
+        node_ids = self.graph.position_ids(pos)
+        if len(node_ids) == 0:
+            raise KeyError(pos)
+        return [self.graph.node(node_id) for node_id in node_ids]
+
+    def __iter__(self):
+        for pos in range(len(self.graph)):
+            start, end = self.graph.pos_offsets[pos], self.graph.pos_offsets[pos + 1]
+            if self.graph.alive[start:end].any():
+                yield pos
+
+    def __len__(self):
+        return sum(1 for _ in self)
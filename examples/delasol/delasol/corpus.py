@@ -4,23 +4,58 @@
 # Copyright © 2024 Bas Cornelissen
 # -------------------------------------------------------------------
 import glob
+import json
+import logging
+import multiprocessing
 import os
+import shutil
 import subprocess
+import tempfile
 import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import partial
 from datetime import datetime
 from typing import Union, Iterable, Optional
 import pandas as pd
-import seaborn as sns
 import music21
 from music21.metadata import Metadata
 from tqdm.auto import tqdm
 
-from .solmization import solmize, EVALUATION_STATUS
+from .solmization import solmize, get_formatter, EVALUATION_STATUS
+from .musicxml import load_musicxml
+from .profiling import get_tracer, stage, trace as trace_stages
+from .score_cache import ScoreCache
 
-MSCORE_EXECUTABLE = "/Applications/MuseScore 4.app/Contents/MacOS/mscore"
+logger = logging.getLogger(__name__)
+
+# The MuseScore executable can be changed using the environment variable MSCORE
+MSCORE_EXECUTABLE = os.environ.get(
+    "MSCORE", "/Applications/MuseScore 4.app/Contents/MacOS/mscore"
+)
 CUR_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.abspath(os.path.join(CUR_DIR, os.pardir))
 
+# The corpus and evaluation options in a worker process of `Corpus.evaluate`
+_WORKER_STATE = {}
+
+
+def _init_corpus_worker(corpus: "Corpus", options: dict, trace: bool):
+    global _WORKER_STATE
+    _WORKER_STATE = dict(corpus=corpus, options=options, trace=trace)
+
+
+def _evaluate_in_worker(id: str):
+    """Evaluate a work in a worker process, and return the result of
+    `Corpus._evaluate_one` and the trace records of the work (if tracing)."""
+    corpus = _WORKER_STATE["corpus"]
+    options = _WORKER_STATE["options"]
+    if not _WORKER_STATE["trace"]:
+        return corpus._evaluate_one(id, **options), []
+    with trace_stages() as tracer:
+        result = corpus._evaluate_one(id, **options)
+    return result, tracer.records
+
 
 class Corpus:
     _lyric_number = None
@@ -38,7 +73,15 @@ class Corpus:
         directory: str = None,
         metafile: str = "corpus.yaml",
         mscore_executable: str = MSCORE_EXECUTABLE,
+        score_cache: Union[bool, str, ScoreCache] = True,
     ):
+        """A corpus of works in a directory. Parsed scores are cached in the directory
+        `cache/scores` of the corpus (see `ScoreCache`), unless `score_cache` is False;
+        `score_cache` can also be another cache directory or a `ScoreCache`. The cache
+        stores pickles, and loading a pickle can run arbitrary code: only use the
+        default cache for corpus directories you trust (and not, say, a corpus
+        downloaded from elsewhere that already contains a `cache` directory), or pass
+        `score_cache=False`."""
         if name is None and directory is None:
             raise ValueError("Either 'name' or 'directory' must be provided")
         elif name is None:
@@ -63,6 +106,13 @@ class Corpus:
         for dir in self.dirs.values():
             os.makedirs(dir, exist_ok=True)
 
+        # Cache of parsed scores
+        if score_cache is True:
+            score_cache = os.path.join(self.dir, "cache", "scores")
+        if isinstance(score_cache, str):
+            score_cache = ScoreCache(score_cache)
+        self.score_cache = score_cache if score_cache is not False else None
+
         # Load metadata file
         self.metafile = os.path.join(self.dir, metafile)
         if not os.path.exists(self.metafile):
@@ -115,12 +165,39 @@ class Corpus:
             raise ValueError(f'Unsupported format "{format}"')
         return {id: work[f"_{format}"] for id, work in self.works.items()}
 
-    def mscore(self, *args):
-        if not os.path.exists(self.mscore_exec):
+    @property
+    def mscore_command(self) -> list[str]:
+        """The command that runs MuseScore. The executable can be a path, the name of
+        a program on the PATH, or a command as a list (for example a stand-in script:
+        `[sys.executable, "benchmarks/fake_mscore.py"]`)."""
+        if isinstance(self.mscore_exec, (list, tuple)):
+            return list(self.mscore_exec)
+        executable = self.mscore_exec
+        if not os.path.exists(executable):
+            executable = shutil.which(executable)
+        if executable is None:
             raise FileNotFoundError(
                 f"MuseScore executable not found: {self.mscore_exec}"
             )
-        return subprocess.run([self.mscore_exec, *args])
+        return [executable]
+
+    def mscore(self, *args):
+        return subprocess.run(
+            [*self.mscore_command, *args], capture_output=True, text=True
+        )
+
+    def _conversion_error(self, result, source: str, to: str) -> str:
+        message = f"Error converting {source} to {to}"
+        output = (result.stderr or result.stdout or "").strip()
+        return f"{message}: {output}" if output else message
+
+    def _log_mscore_output(self, result, description: str):
+        """Log the output of a failed MuseScore run, which is otherwise captured."""
+        output = (result.stderr or result.stdout or "").strip()
+        logger.warning(
+            f"MuseScore failed ({description}, exit code {result.returncode})"
+            + (f":\n{output}" if output else "")
+        )
 
     def convert_musescore_work(self, id, to: str, refresh: bool = False):
         work = self.works[id]
@@ -133,24 +210,135 @@ class Corpus:
         if not os.path.exists(target) or refresh:
             result = self.mscore("-o", target, source)
             if result.returncode != 0:
-                raise Exception(f"Error converting {source} to {to}: {result.stderr}")
+                self._log_mscore_output(result, f"converting {source} to {to}")
+                raise Exception(self._conversion_error(result, source, to))
+
+    def convert_musescore_batch(self, jobs: list[tuple[str, str, list[str]]]):
+        """Convert several works in a single MuseScore process, using a job file.
+        Jobs are tuples (id, source, targets). Returns a dict with an error message for
+        every work that was not (completely) converted. Existing targets are moved
+        aside during the job, so that a target counts as converted only if MuseScore
+        created it; if that fails, the old file is put back."""
+        old_targets = {}
+        for _, _, targets in jobs:
+            for target in targets:
+                if os.path.exists(target):
+                    old_targets[target] = f"{target}.{os.getpid()}.old"
+                    os.replace(target, old_targets[target])
+
+        job_file = [{"in": source, "out": targets} for _, source, targets in jobs]
+        handle, job_fn = tempfile.mkstemp(prefix="mscore-job-", suffix=".json")
+        try:
+            with os.fdopen(handle, "w") as file:
+                json.dump(job_file, file)
+            result = self.mscore("-j", job_fn)
+        finally:
+            os.remove(job_fn)
+            # MuseScore does not report which conversions failed; check the targets
+            failed = {}
+            for id, source, targets in jobs:
+                for target in targets:
+                    if not os.path.exists(target):
+                        failed.setdefault(id, []).append(target)
+                        if target in old_targets:
+                            os.replace(old_targets[target], target)
+                    elif target in old_targets:
+                        os.remove(old_targets[target])
+
+        if result.returncode != 0 or len(failed) > 0:
+            self._log_mscore_output(result, f"batch of {len(jobs)} works")
+
+        errors = {}
+        for id, source, _ in jobs:
+            if id in failed:
+                # The output of MuseScore is not included: it covers the whole batch
+                formats = ", ".join(os.path.splitext(t)[1][1:] for t in failed[id])
+                errors[id] = f"Error converting {source} to {formats} (in a batch)"
+        return errors
 
     def convert_musescore_files(
         self,
         to: Iterable[str] = ["musicxml", "pdf"],
         refresh: bool = False,
         ids: list[str] = None,
+        workers: int = 1,
+        batch_size: int = None,
     ):
-        """Convert musescore files to another format using the MuseScore executable"""
+        """Convert musescore files to another format using the MuseScore executable.
+
+        Up to `workers` MuseScore processes run at the same time. By default every
+        conversion starts a new process; with a `batch_size`, works are instead
+        converted in batches of that many works, each using a single MuseScore process
+        and a job file (see `convert_musescore_batch`), which avoids starting MuseScore
+        for every file. Errors do not stop the other conversions: all failed works are
+        reported in a single exception at the end."""
         if ids is None:
             ids = self.works.keys()
-        for id in tqdm(ids):
-            for format in to:
-                self.convert_musescore_work(id, to=format, refresh=refresh)
 
-    def load_score(self, id, **kwargs):
+        # Collect the conversions that are needed
+        jobs = []
+        errors = {}
+        for id in ids:
+            work = self.works[id]
+            source = work["_musescore"]
+            targets = [
+                work[f"_{format}"]
+                for format in to
+                if refresh or not os.path.exists(work[f"_{format}"])
+            ]
+            if len(targets) == 0:
+                continue
+            elif not os.path.exists(source):
+                errors[id] = f"MuseScore file not found (work id={id}): {source}"
+            else:
+                jobs.append((id, source, targets))
+
+        # Every task converts one or more works and returns a dict of errors
+        if batch_size is None:
+            tasks = [
+                partial(self._convert_musescore_job, id, source, targets)
+                for id, source, targets in jobs
+            ]
+            sizes = [1] * len(jobs)
+        else:
+            batches = [
+                jobs[start : start + batch_size]
+                for start in range(0, len(jobs), batch_size)
+            ]
+            tasks = [partial(self.convert_musescore_batch, batch) for batch in batches]
+            sizes = [len(batch) for batch in batches]
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(task): size for task, size in zip(tasks, sizes)}
+            with tqdm(total=len(jobs)) as progress:
+                for future in as_completed(futures):
+                    errors.update(future.result())
+                    progress.update(futures[future])
+
+        if len(errors) > 0:
+            messages = "\n".join(f"- {errors[id]}" for id in sorted(errors))
+            raise Exception(f"Failed to convert {len(errors)} works:\n{messages}")
+
+    def _convert_musescore_job(self, id, source: str, targets: list[str]) -> dict:
+        errors = []
+        for target in targets:
+            result = self.mscore("-o", target, source)
+            if result.returncode != 0:
+                format = os.path.splitext(target)[1][1:]
+                self._log_mscore_output(result, f"converting {source} to {format}")
+                errors.append(self._conversion_error(result, source, format))
+        return {id: "; ".join(errors)} if len(errors) > 0 else {}
+
+    def load_score(self, id, force_source: bool = False, **kwargs):
+        """Parse the MusicXML file of a work using music21, or load the parsed score
+        from the score cache. With `force_source`, the file is always parsed. The
+        cache loads pickles, so its directory must be trusted (see `Corpus`)."""
         work = self.works[id]
-        return music21.converter.parse(work["_musicxml"], **kwargs)
+        if self.score_cache is None or force_source:
+            return music21.converter.parse(
+                work["_musicxml"], forceSource=force_source, **kwargs
+            )
+        return self.score_cache.parse(work["_musicxml"], **kwargs)
 
     def report_evaluation(self, evaluation):
         # Make sure all fields are present
@@ -179,8 +367,14 @@ class Corpus:
         style: str = None,
         force_source: bool = False,
         solmization_kws: dict = {},
+        annotate: bool = True,
         **kwargs,
     ):
+        """Solmize and evaluate a work, and return the annotated score and the
+        evaluation. If `annotate` is False, the score is not annotated. The work is
+        then loaded using `load_musicxml`, which is much faster than parsing it with
+        music21, and None is returned instead of the score. (Unless the output style
+        depends on the notes or the part has several staves.)"""
         # Determine options
         if target_lyrics is None or target_lyrics not in self.lyric_number:
             raise ValueError(f"Invalid target_lyrics: {target_lyrics}")
@@ -188,23 +382,111 @@ class Corpus:
         if solmization_style is None:
             solmization_style = self.metadata["solmization_style"]
 
-        # Load stream, solmize and evaluate
+        # Without annotations, only the pitches and lyrics are needed
         work = self.works[id]
-        score = music21.converter.parse(work["_musicxml"], forceSource=force_source)
+        per_note = getattr(get_formatter(style or "syllable"), "per_note", True)
+        if not annotate and not per_note:
+            with stage("load", id=id, parser="musicxml"):
+                part = load_musicxml(work["_musicxml"])[0]
+            if part.staves == 1:
+                solmization = solmize(
+                    part, style=solmization_style, **solmization_kws
+                )
+                targets = part.extract_lyrics(target_lyrics_num)
+                evaluation = solmization.evaluate(targets, style=style)
+                self.report_evaluation(evaluation)
+                return None, evaluation
+
+        # Load stream, solmize and evaluate
+        with stage("load", id=id, parser="music21"):
+            score = self.load_score(id, force_source=force_source)
         solmization = solmize(score, style=solmization_style, **solmization_kws)
         evaluation = solmization.evaluate(target_lyrics=target_lyrics_num, style=style)
         report = self.report_evaluation(evaluation)
 
         # Annotate the evaluated score
-        solmization.annotate(
-            target_lyrics=target_lyrics_num, test_style=style, **kwargs
-        )
-        now = datetime.now().strftime("%d-%m-%Y")
-        metadata = dict(title=id, composer=f"Generated on {now}")
-        score.metadata = Metadata(lyricist=report, **metadata)
+        if annotate:
+            solmization.annotate(
+                target_lyrics=target_lyrics_num, test_style=style, **kwargs
+            )
+            now = datetime.now().strftime("%d-%m-%Y")
+            metadata = dict(title=id, composer=f"Generated on {now}")
+            score.metadata = Metadata(lyricist=report, **metadata)
 
         return score, evaluation
 
+    def _evaluate_one(
+        self,
+        id: str,
+        target_lyrics: str,
+        write_output: bool,
+        output_dir: str,
+        refresh: bool,
+        remove_musicxml: bool,
+        **kwargs,
+    ) -> tuple[dict, Optional[str]]:
+        """Evaluate (and optionally write) a single work, and return its log entry and
+        the error message, or None if there was no error."""
+        work = dict(id=id)
+        if write_output:
+            xml_fn = os.path.join(output_dir, f"{id}.musicxml")
+            pdf_fn = os.path.join(output_dir, f"{id}.pdf")
+        if not (refresh or not write_output or not os.path.exists(pdf_fn)):
+            work["status"] = "skipped"
+            return work, None
+        try:
+            with stage("work", id=id):
+                score, evaluation = self.evaluate_work(
+                    id,
+                    target_lyrics=target_lyrics,
+                    annotate=write_output,
+                    **kwargs,
+                )
+                if write_output:
+                    with stage("write"):
+                        score.write("musicxml.pdf", pdf_fn)
+                    if remove_musicxml:
+                        os.remove(xml_fn)
+            work["status"] = "success"
+            work["evaluation"] = evaluation
+            return work, None
+        except Exception as e:
+            work["status"] = "error"
+            return work, str(e)
+
+    def _evaluate_parallel(
+        self,
+        ids: list[str],
+        workers: int,
+        max_works_per_worker: int,
+        progress: bool,
+        trace: bool,
+        **options,
+    ):
+        """Evaluate works in a pool of worker processes and yield the results (as
+        `_evaluate_one`) in the order of `ids`. Every worker process is replaced after
+        `max_works_per_worker` works, which bounds its memory use. If `trace` is True,
+        the trace records of every work are added to the active tracer."""
+        results = {}
+        with multiprocessing.Pool(
+            processes=workers,
+            initializer=_init_corpus_worker,
+            initargs=(self, options, trace),
+            maxtasksperchild=max_works_per_worker,
+        ) as pool:
+            iterator = pool.imap_unordered(_evaluate_in_worker, ids)
+            for (work, error), records in tqdm(
+                iterator, total=len(ids), disable=not progress
+            ):
+                results[work["id"]] = (work, error), records
+
+        tracer = get_tracer() if trace else None
+        for id in ids:
+            result, records = results[id]
+            if tracer is not None:
+                tracer.extend(records)
+            yield result
+
     def evaluate(
         self,
         ids: Iterable[str] = None,
@@ -214,11 +496,23 @@ class Corpus:
         refresh: bool = False,
         remove_musicxml: bool = True,
         write_log: bool = True,
+        trace: str = None,
+        workers: int = None,
+        max_works_per_worker: int = 20,
         **kwargs,
     ):
+        """Evaluate (and optionally annotate and write) the works in the corpus. If
+        `trace` is the path of a JSON file, the time and memory used by all stages of
+        every work are traced and saved there (see `profiling.trace`).
+
+        With `workers`, the works are evaluated in that many processes. Every process is
+        replaced after `max_works_per_worker` works to bound its memory use. Errors are
+        logged per work as before, and the log lists the works in the same order as
+        `ids`, regardless of the order in which they finish."""
         start = datetime.now()
         if ids is None:
             ids = self.ids
+        ids = list(ids)
         if write_output is False:
             write_log = False
         if write_output:
@@ -238,31 +532,32 @@ class Corpus:
         log["works"] = {}
         log["errors"] = {}
 
-        iterator = tqdm(ids) if write_output else ids
-        for id in iterator:
-            work = dict(id=id)
-            if write_output:
-                xml_fn = os.path.join(output_dir, f"{id}.musicxml")
-                pdf_fn = os.path.join(output_dir, f"{id}.pdf")
-            if refresh or not write_output or not os.path.exists(pdf_fn):
-                try:
-                    score, evaluation = self.evaluate_work(
-                        id, target_lyrics=target_lyrics, **kwargs
-                    )
-                    if write_output:
-                        score.write("musicxml.pdf", pdf_fn)
-                        if remove_musicxml:
-                            os.remove(xml_fn)
-                    work["status"] = "success"
-                    work["evaluation"] = evaluation
-
-                except Exception as e:
-                    work["status"] = "error"
-                    log["errors"][id] = str(e)
+        options = dict(
+            target_lyrics=target_lyrics,
+            write_output=write_output,
+            output_dir=output_dir,
+            refresh=refresh,
+            remove_musicxml=remove_musicxml,
+            **kwargs,
+        )
+        tracing = trace_stages(trace) if trace is not None else nullcontext()
+        with tracing:
+            if workers is None or workers <= 1 or len(ids) <= 1:
+                iterator = tqdm(ids) if write_output else ids
+                results = (self._evaluate_one(id, **options) for id in iterator)
             else:
-                work["status"] = "skipped"
-
-            log["works"][id] = work
+                results = self._evaluate_parallel(
+                    ids,
+                    workers=workers,
+                    max_works_per_worker=max_works_per_worker,
+                    progress=write_output,
+                    trace=trace is not None,
+                    **options,
+                )
+            for work, error in results:
+                log["works"][work["id"]] = work
+                if error is not None:
+                    log["errors"][work["id"]] = error
 
         # Finish up logging
         log["time_stop"] = datetime.now()
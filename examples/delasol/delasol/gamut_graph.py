@@ -3,32 +3,35 @@
 # Author: Bas Cornelissen
 # Copyright © 2024 Bas Cornelissen
 # -------------------------------------------------------------------
+import hashlib
+import threading
 import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
 from typing import Union, Iterable, Optional
 from music21.pitch import Pitch
-from music21.scale import ConcreteScale, Direction
 from music21.key import KeySignature
 
 # Local imports
-from .utils import draw_graph, as_pitch
+from .utils import draw_graph, as_pitch, pitch_code, compact_graph, PitchCode
+from .shortest_paths import ShortestPathTable
 
 # Custom types
 HexachordGraphNode = Pitch
 GamutGraphNode = tuple[int, Pitch]
-
-# Number all possible hexachords within some bounds (in practice we only need 0-6)
-_hexachordTonicsScale = ConcreteScale(pitches=["F2", "G2", "C3"])
-HEXACHORD_TONICS = {}
-for i in range(-5, 20):
-    direction = Direction.DESCENDING if i < 0 else Direction.ASCENDING
-    pitch = _hexachordTonicsScale.nextPitch(
-        _hexachordTonicsScale.tonic, direction=direction, stepSize=abs(i)
-    )
-    if i == 0:
-        pitch = _hexachordTonicsScale.tonic
-    HEXACHORD_TONICS[pitch] = i
+GamutGraphCode = int
+
+# Number all possible hexachords within some bounds (in practice we only need 0-6).
+# The hexachords are numbered by stepping through the scale F-G-C, starting from F2
+# (hexachord 0). The numbers are listed explicitly to avoid building that scale when
+# the module is imported.
+_HEXACHORD_TONIC_NAMES = [
+    "G0", "C1", "F1", "G1", "C2",
+    "F2", "G2", "C3", "F3", "G3", "C4", "F4", "G4", "C5", "F5",
+    "G5", "C6", "F6", "G6", "C7", "F7", "G7", "C8", "F8", "G8",
+]  # fmt: skip
+HEXACHORD_TONICS = {
+    Pitch(name): i for i, name in enumerate(_HEXACHORD_TONIC_NAMES, start=-5)
+}
 HEXACHORD_TYPES = dict(C="natural", F="soft", G="hard")
 STATE_NAMES = ["ut", "re", "mi", "fa", "sol", "la", "fi"]
 
@@ -160,6 +163,8 @@ class HexachordGraph(nx.DiGraph):
         self.nodes[node]["syllable"]
 
     def draw(self, show_loops=True, fig=None, **kws):
+        import matplotlib.pyplot as plt
+
         if fig is None:
             plt.figure(figsize=(len(self), 1))
         draw_graph(self, show_loops=show_loops, **kws)
@@ -179,6 +184,15 @@ class GamutGraph(nx.DiGraph):
         self._names = None
         self._overlapping_hexachords = None
         self._pitches = None
+        self._compact = None
+        self._pitch_codes = None
+        self._degrees = None
+        self._diatonic_index = None
+        self._pitch_index = None
+        self._shortest_path_table = None
+        self._weight_matrix = None
+        self._fingerprint = None
+        self._parse_paths = {}
 
         if hexachords is not None:
             for hexachord in hexachords:
@@ -202,6 +216,112 @@ class GamutGraph(nx.DiGraph):
                 self._pitches[pitch].append((hex, pitch))
         return self._pitches
 
+    @property
+    def node_list(self) -> list[GamutGraphNode]:
+        """All nodes in the gamut. The index of a node in this list is its code."""
+        return self.compact[0]
+
+    @property
+    def codes(self) -> dict[GamutGraphNode, GamutGraphCode]:
+        """A dictionary mapping every node in the gamut to its integer code."""
+        return self.compact[1]
+
+    @property
+    def successors_by_code(self) -> list[dict[GamutGraphCode, float]]:
+        """The weights of all outgoing edges of every node, indexed by code."""
+        return self.compact[2]
+
+    @property
+    def compact(self) -> tuple[list, dict, list]:
+        if self._compact is None:
+            self._compact = compact_graph(self)
+        return self._compact
+
+    @property
+    def pitch_codes(self) -> list[PitchCode]:
+        """The pitch code of every node in the gamut, indexed by node code."""
+        if self._pitch_codes is None:
+            self._pitch_codes = [pitch_code(pitch) for _, pitch in self.node_list]
+        return self._pitch_codes
+
+    @property
+    def degrees(self) -> list[int]:
+        """The degree (1-7) of every node in its hexachord, indexed by node code."""
+        if self._degrees is None:
+            self._degrees = [self.nodes[node]["degree"] for node in self.node_list]
+        return self._degrees
+
+    @property
+    def diatonic_index(self) -> dict[int, list[GamutGraphCode]]:
+        """An index mapping diatonic note numbers to the codes of all nodes with that
+        diatonic note number (in increasing order)."""
+        if self._diatonic_index is None:
+            self._diatonic_index = {}
+            for code, (diatonic_num, _) in enumerate(self.pitch_codes):
+                self._diatonic_index.setdefault(diatonic_num, []).append(code)
+        return self._diatonic_index
+
+    @property
+    def pitch_index(self) -> dict[PitchCode, list[GamutGraphCode]]:
+        """An index mapping pitch codes to the codes of all nodes with exactly that
+        pitch (in increasing order)."""
+        if self._pitch_index is None:
+            self._pitch_index = {}
+            for code, pitch_code in enumerate(self.pitch_codes):
+                self._pitch_index.setdefault(pitch_code, []).append(code)
+        return self._pitch_index
+
+    @property
+    def shortest_path_table(self) -> ShortestPathTable:
+        """A table of all (unweighted) shortest paths between nodes in the gamut, indexed
+        by node codes. The table is persisted to disk, see `ShortestPathTable.cached`."""
+        if self._shortest_path_table is None:
+            successors = [list(succ.keys()) for succ in self.successors_by_code]
+            self._shortest_path_table = ShortestPathTable.cached(successors)
+        return self._shortest_path_table
+
+    @property
+    def weight_matrix(self) -> np.ndarray:
+        """A dense matrix with the weights of all edges in the gamut, indexed by node
+        codes. Pairs of nodes that are not connected have an infinite weight."""
+        if self._weight_matrix is None:
+            N = len(self.node_list)
+            self._weight_matrix = np.full((N, N), np.inf)
+            for code, successors in enumerate(self.successors_by_code):
+                for succ, weight in successors.items():
+                    self._weight_matrix[code, succ] = weight
+        return self._weight_matrix
+
+    @property
+    def fingerprint(self) -> str:
+        """A fingerprint of the gamut: the names, pitches and degrees of all nodes and
+        the weights of all edges. Two gamuts with the same fingerprint solmize any
+        sequence of pitches identically."""
+        if self._fingerprint is None:
+            names = [self.nodes[node]["name"] for node in self.node_list]
+            successors = [sorted(succ.items()) for succ in self.successors_by_code]
+            description = repr((names, self.pitch_codes, self.degrees, successors))
+            self._fingerprint = hashlib.sha1(description.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    @property
+    def parse_paths(self) -> dict:
+        """The shortest paths between nodes matching two pitches, memoized by all parse
+        graphs of this gamut (see `ParseGraph.shortest_paths`). Entries are only ever
+        added, never changed, so the dictionary can be shared between threads."""
+        return self._parse_paths
+
+    def _reset_compact(self):
+        self._compact = None
+        self._pitch_codes = None
+        self._degrees = None
+        self._diatonic_index = None
+        self._pitch_index = None
+        self._shortest_path_table = None
+        self._weight_matrix = None
+        self._fingerprint = None
+        self._parse_paths = {}
+
     @property
     def lowest(self) -> GamutGraphNode:
         lowest_hex = min(self.hexachords.keys())
@@ -233,6 +353,7 @@ class GamutGraph(nx.DiGraph):
         num = hexachord.number
         if num in self.hexachords:
             raise ValueError(f"Hexachord {num} already exists")
+        self._reset_compact()
         self.hexachords[num] = hexachord
         for node in hexachord.nodes:
             attrs = dict(**hexachord.nodes[node])
@@ -249,6 +370,7 @@ class GamutGraph(nx.DiGraph):
         The dictionary describes the degrees at which you can mutate from each type of
         hexachord to each other type, in both ascending and descending direction. The
         dictionary should have the following structure:"""
+        self._reset_compact()
         for hexachord in self.hexachords.values():
             for neighbor in self.overlapping_hexachords[hexachord]:
                 direction = "up" if neighbor.number > hexachord.number else "down"
@@ -268,6 +390,7 @@ class GamutGraph(nx.DiGraph):
         >>> G = GamutGraph(hexachords=[H1, H2])
         >>> G.add_edges_by_names([("fa1", "re2"), ("fa2", "la1", 1.5)])
         """
+        self._reset_compact()
         for edge in edges:
             edge_weight = weight if len(edge) == 2 else edge[2]
             self.add_edge(self.names[edge[0]], self.names[edge[1]], weight=edge_weight)
@@ -276,7 +399,30 @@ class GamutGraph(nx.DiGraph):
         """Return the solmization of a pitch in the gamut graph"""
         return self.nodes[node]["syllable"]
 
+    def freeze(self) -> "GamutGraph":
+        """Freeze the gamut and its hexachords, so that it can safely be shared between
+        solmizations. All lazily computed properties are computed upfront, so a frozen
+        gamut is never modified and can also be shared between threads. (Only the
+        memoized `parse_paths` still grow, which is safe.)"""
+        for hexachord in self.hexachords.values():
+            hexachord.names
+            nx.freeze(hexachord)
+        self.names
+        self.pitches
+        self.overlapping_hexachords
+        self.pitch_codes
+        self.degrees
+        self.diatonic_index
+        self.pitch_index
+        self.shortest_path_table
+        self.weight_matrix
+        self.fingerprint
+        nx.freeze(self)
+        return self
+
     def draw(self, show_axes: bool = True, fig=None, diatonic: bool = True, **kws):
+        import matplotlib.pyplot as plt
+
         if fig is None:
             plt.figure(figsize=(len(self) * 0.4, len(self.hexachords)))
         if diatonic:
@@ -437,33 +583,122 @@ SHARPS_TO_GAMUT_NAME = {
 }
 
 
+def _registry_key(value):
+    """Convert a (nested) keyword argument to a hashable value"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _registry_key(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_registry_key(v) for v in value)
+    elif isinstance(value, np.ndarray):
+        return (value.shape, value.dtype.str, value.tobytes())
+    elif isinstance(value, Pitch):
+        return value.nameWithOctave
+    elif isinstance(value, HexachordGraph):
+        edges = value.edges(data="weight")
+        return (
+            value.tonic.nameWithOctave,
+            tuple((u.nameWithOctave, v.nameWithOctave, w) for u, v, w in edges),
+        )
+    return value
+
+
+class GamutRegistry:
+    """A cache of frozen gamuts, keyed by the name of the gamut and all keyword arguments
+    used to construct it (including hexachord and mutation options). The registry keeps
+    track of the number of hits and misses.
+
+    The registry is thread-safe: all access is protected by a lock, and a gamut is
+    constructed at most once even if many threads request it at the same time.
+
+    >>> registry = GamutRegistry()
+    >>> gamut = registry.get("hard-continental", mutation_weight=3)
+    >>> registry.get("hard-continental", mutation_weight=3) is gamut
+    True
+    >>> registry.info()
+    {'hits': 1, 'misses': 1, 'size': 1}
+    """
+
+    def __init__(self):
+        self._gamuts = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._gamuts)
+
+    def __repr__(self):
+        return f"<GamutRegistry hits={self.hits} misses={self.misses} size={len(self)}>"
+
+    def key(self, name: str, **kws) -> tuple:
+        return (name, _registry_key(kws))
+
+    def get(self, name: str, **kws) -> GamutGraph:
+        """Return a frozen gamut, and construct it only if it is not yet registered."""
+        if name not in GAMUTS:
+            raise ValueError(
+                f"Invalid gamut name '{name}'. Suppored names are: {', '.join(GAMUTS.keys())}"
+            )
+        key = self.key(name, **kws)
+        with self._lock:
+            if key in self._gamuts:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._gamuts[key] = GAMUTS[name](**kws).freeze()
+            return self._gamuts[key]
+
+    def info(self) -> dict:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self))
+
+    def clear(self):
+        with self._lock:
+            self._gamuts = {}
+            self.hits = 0
+            self.misses = 0
+
+
+GAMUT_REGISTRY = GamutRegistry()
+
+
+def gamut_name(style: str, sharps: int) -> str:
+    """The name of the gamut for a solmization style and a number of sharps."""
+    if style is None:
+        raise ValueError(
+            "No solmization style specified. This is required if you provide a key signature or the number of sharps"
+        )
+    if style not in SHARPS_TO_GAMUT_NAME:
+        raise ValueError("Invalid style {style}")
+    if sharps not in SHARPS_TO_GAMUT_NAME[style]:
+        raise ValueError(
+            f"Number of sharps ({sharps}) is not supported for style {style}."
+        )
+    return SHARPS_TO_GAMUT_NAME[style][sharps]
+
+
 def get_gamut(
     name: str = None,
     style: str = None,
     sharps: int = None,
     key: KeySignature = None,
+    cache: bool = True,
     **kws,
 ) -> GamutGraph:
-    """Returns a gamut by its name, the style or the number of sharps"""
+    """Returns a gamut by its name, the style or the number of sharps. By default, the
+    gamut is taken from the gamut registry: it is then frozen and shared by all callers.
+    Pass `cache=False` to construct a new gamut that can still be modified."""
     if key is not None:
         sharps = key.sharps
 
     if sharps is not None:
-        if style is None:
-            raise ValueError(
-                "No solmization style specified. This is required if you provide a key signature or the number of sharps"
-            )
-        if style not in SHARPS_TO_GAMUT_NAME:
-            raise ValueError("Invalid style {style}")
-        if sharps not in SHARPS_TO_GAMUT_NAME[style]:
-            raise ValueError(
-                f"Number of sharps ({sharps}) is not supported for style {style}."
-            )
-        name = SHARPS_TO_GAMUT_NAME[style][sharps]
+        name = gamut_name(style, sharps)
 
     if name not in GAMUTS:
         raise ValueError(
             f"Invalid gamut name '{name}'. Suppored names are: {', '.join(GAMUTS.keys())}"
         )
+    elif cache:
+        return GAMUT_REGISTRY.get(name, **kws)
     else:
         return GAMUTS[name](**kws)
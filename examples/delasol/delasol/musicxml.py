@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import os
+import zipfile
+import numpy as np
+import xml.etree.ElementTree as ET
+from fractions import Fraction
+from typing import Union
+
+from .utils import PitchCode
+
+STEPS = "CDEFGAB"
+
+# Alterations of accidentals, used (like music21 does) if a pitch has no alter element
+ACCIDENTAL_ALTERS = {
+    "natural": 0,
+    "sharp": 1,
+    "flat": -1,
+    "double-sharp": 2,
+    "sharp-sharp": 2,
+    "flat-flat": -2,
+    "double-flat": -2,
+    "quarter-sharp": 0.5,
+    "quarter-flat": -0.5,
+    "three-quarters-sharp": 1.5,
+    "three-quarters-flat": -1.5,
+}
+
+
+class MusicXMLPart:
+    """The pitches of a part in a MusicXML file, as loaded by `load_musicxml`. Only the
+    notes that do not end a tie are included, in the same order as the (untied) notes
+    of the flattened music21 part. Pitches are stored in compact arrays:
+
+    - `diatonic`: the diatonic note numbers of the notes (as in music21),
+    - `alter`: their alterations in semitones,
+    - `durations`: their durations in quarter notes,
+    - `note_indices`: the index of every note among all notes of the part (including
+      notes that end a tie), so `list(part.flatten().notes)[index]` is the music21 note.
+
+    The key signature (`sharps`) and the clef (`clef`, for example `"G2"`) are those at
+    the start of the part, or None. Parts with several `staves` are not split into
+    separate staves, as music21 does. Solmize a part using `solmize(part, style=...)`.
+    """
+
+    def __init__(
+        self,
+        id: str,
+        name: str = None,
+        sharps: int = None,
+        clef: str = None,
+        staves: int = 1,
+        diatonic: np.ndarray = None,
+        alter: np.ndarray = None,
+        durations: np.ndarray = None,
+        note_indices: np.ndarray = None,
+        lyrics: list[dict[int, str]] = None,
+    ):
+        self.id = id
+        self.name = name
+        self.sharps = sharps
+        self.clef = clef
+        self.staves = staves
+        self.diatonic = np.zeros(0, dtype=int) if diatonic is None else diatonic
+        self.alter = np.zeros(0) if alter is None else alter
+        self.durations = np.zeros(0) if durations is None else durations
+        self.note_indices = (
+            np.zeros(0, dtype=int) if note_indices is None else note_indices
+        )
+        self.lyrics = [] if lyrics is None else lyrics
+
+    def __len__(self):
+        return len(self.diatonic)
+
+    def __repr__(self):
+        return f"<MusicXMLPart {self.id} with {len(self)} notes>"
+
+    @property
+    def pitch_codes(self) -> list[PitchCode]:
+        """The pitch codes of the notes (see `utils.pitch_code`)."""
+        return list(zip(self.diatonic.tolist(), self.alter.tolist()))
+
+    def extract_lyrics(self, number: int) -> list[str]:
+        """The lyrics at a given line number, or None for notes without lyrics on that
+        line; see `utils.extract_lyrics`."""
+        return [lyrics.get(number) for lyrics in self.lyrics]
+
+
+def _open(path: str):
+    """Open a MusicXML file, or the score inside a compressed MusicXML (.mxl) file."""
+    if not path.endswith(".mxl"):
+        return open(path, "rb")
+    archive = zipfile.ZipFile(path)
+    try:
+        container = ET.fromstring(archive.read("META-INF/container.xml"))
+        filename = container.find(".//rootfile").get("full-path")
+    except KeyError:
+        filename = [
+            name
+            for name in archive.namelist()
+            if name.endswith(".xml") and not name.startswith("META-INF")
+        ][0]
+    return archive.open(filename)
+
+
+def _lyric_text(lyric: ET.Element) -> Union[str, None]:
+    texts = [text.text or "" for text in lyric.findall("text")]
+    if len(texts) == 0:
+        return None
+    elisions = [elision.text or " " for elision in lyric.findall("elision")]
+    text = texts[0].strip()
+    for i, part in enumerate(texts[1:]):
+        text += (elisions[i] if i < len(elisions) else " ") + part.strip()
+    return text
+
+
+def _lyric_number(lyric: ET.Element, position: int) -> int:
+    """The number of a lyric as in music21: its number attribute or otherwise its
+    position among the lyrics of the note (lyrics without text always get number 1)."""
+    if lyric.find("text") is None:
+        return 1
+    try:
+        return int(lyric.get("number"))
+    except (TypeError, ValueError):
+        return position + 1
+
+
+def _read_lyrics(note: ET.Element) -> dict[int, str]:
+    """Lyrics of a note by line number (see `_lyric_number`)."""
+    lyrics = {}
+    for position, lyric in enumerate(note.findall("lyric")):
+        text = _lyric_text(lyric)
+        lyrics[_lyric_number(lyric, position)] = "" if text is None else text
+    return lyrics
+
+
+class _PartReader:
+    """Collects the notes of a part while the file is being parsed."""
+
+    def __init__(self, id: str, name: str = None):
+        self.id = id
+        self.name = name
+        self.sharps = None
+        self.clef = None
+        self.staves = 1
+        self.divisions = 1
+        self.measure_start = Fraction(0)
+        self.position = Fraction(0)
+        self.measure_length = Fraction(0)
+        # Notes as tuples (onset, order, is not a grace note, index, pitch, element),
+        # where the pitch is a tuple (diatonic, alter, duration, lyrics) or None for
+        # skipped notes, and the order is 0 for chord symbols and 1 for notes.
+        self.notes = []
+
+    def start_measure(self):
+        self.measure_start += self.measure_length
+        self.position = Fraction(0)
+        self.measure_length = Fraction(0)
+
+    def advance(self, duration: Fraction):
+        self.position += duration
+        self.measure_length = max(self.measure_length, self.position)
+
+    def read_attributes(self, attributes: ET.Element):
+        divisions = attributes.find("divisions")
+        if divisions is not None:
+            self.divisions = Fraction(divisions.text)
+        staves = attributes.findtext("staves")
+        if staves is not None:
+            self.staves = max(self.staves, int(staves))
+        # Like music21, only use the key signature and clef at the start of the part
+        if self.measure_start + self.position > 0:
+            return
+        fifths = attributes.find("key/fifths")
+        if self.sharps is None and fifths is not None:
+            self.sharps = int(fifths.text)
+        clef = attributes.find("clef")
+        if self.clef is None and clef is not None:
+            self.clef = f"{clef.findtext('sign', '')}{clef.findtext('line', '')}"
+
+    def read_note(self, note: ET.Element):
+        is_chord = note.find("chord") is not None
+        is_grace = note.find("grace") is not None
+        duration = Fraction(note.findtext("duration", "0")) / self.divisions
+        if is_chord:
+            # Chords are a single note in music21; only its first pitch is used
+            return
+        onset = self.measure_start + self.position
+        if not is_grace:
+            self.advance(duration)
+        if note.find("rest") is not None:
+            return
+
+        # All notes are collected to number them, but only untied pitches are kept
+        index = len(self.notes)
+        pitch = note.find("pitch")
+        tie_types = [tie.get("type") for tie in note.findall("tie")]
+        if pitch is None or tie_types == ["stop"]:
+            self.notes.append((onset, 1, not is_grace, index, None, note))
+            return
+        step = STEPS.index(pitch.findtext("step").strip())
+        octave = int(pitch.findtext("octave"))
+        alter = pitch.findtext("alter", "").strip()
+        if alter:
+            alter = float(alter)
+        else:
+            accidental = note.findtext("accidental", "").strip()
+            alter = float(ACCIDENTAL_ALTERS.get(accidental, 0))
+        lyrics = _read_lyrics(note)
+        pitch = (octave * 7 + step + 1, alter, float(duration), lyrics)
+        self.notes.append((onset, 1, not is_grace, index, pitch, note))
+
+    def read_harmony(self, harmony: ET.Element):
+        # Chord symbols are notes in music21 (sorted before notes at the same offset),
+        # so they are numbered as well
+        offset = Fraction(harmony.findtext("offset", "0")) / self.divisions
+        onset = self.measure_start + self.position + offset
+        self.notes.append((onset, 0, True, len(self.notes), None, harmony))
+
+    def read(self, element: ET.Element):
+        """Read an element in a measure."""
+        tag = element.tag
+        if tag == "note":
+            self.read_note(element)
+        elif tag == "harmony":
+            self.read_harmony(element)
+        elif tag == "attributes":
+            self.read_attributes(element)
+        elif tag == "backup":
+            self.position -= Fraction(element.findtext("duration")) / self.divisions
+        elif tag == "forward":
+            self.advance(Fraction(element.findtext("duration")) / self.divisions)
+
+    def ordered_notes(self) -> list[tuple]:
+        # Order notes in different voices by onset, and grace notes first (as music21)
+        return sorted(self.notes, key=lambda note: note[:4])
+
+    def elements(self) -> list[ET.Element]:
+        """The elements of the notes that are kept, in the order of `to_part`."""
+        return [note[5] for note in self.ordered_notes() if note[4] is not None]
+
+    def to_part(self) -> MusicXMLPart:
+        notes = self.ordered_notes()
+        indices = [index for index, note in enumerate(notes) if note[4] is not None]
+        pitches = [note[4] for note in notes if note[4] is not None]
+        return MusicXMLPart(
+            id=self.id,
+            name=self.name,
+            sharps=self.sharps,
+            clef=self.clef,
+            staves=self.staves,
+            diatonic=np.array([pitch[0] for pitch in pitches], dtype=int),
+            alter=np.array([pitch[1] for pitch in pitches], dtype=float),
+            durations=np.array([pitch[2] for pitch in pitches], dtype=float),
+            note_indices=np.array(indices, dtype=int),
+            lyrics=[pitch[3] for pitch in pitches],
+        )
+
+
+def load_musicxml(path: str) -> list[MusicXMLPart]:
+    """Load the pitches of all parts in a (compressed) MusicXML file, without parsing it
+    with music21. The file is parsed incrementally and only notes, key signatures and
+    clefs are read, which is many times faster than `music21.converter.parse`."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"MusicXML file not found: {path}")
+
+    names = {}
+    parts = []
+    reader = None
+    with _open(path) as file:
+        for event, element in ET.iterparse(file, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if tag == "part":
+                    id = element.get("id")
+                    reader = _PartReader(id, names.get(id))
+                elif tag == "measure" and reader is not None:
+                    reader.start_measure()
+                elif tag == "score-timewise":
+                    raise ValueError("Timewise MusicXML files are not supported")
+                continue
+
+            if tag in ("note", "harmony", "attributes", "backup", "forward"):
+                reader.read(element)
+                element.clear()
+            elif tag == "score-part":
+                names[element.get("id")] = element.findtext("part-name")
+            elif tag == "measure":
+                element.clear()
+            elif tag == "part":
+                parts.append(reader.to_part())
+                reader = None
+                element.clear()
+    return parts
@@ -3,27 +3,46 @@
 # Author: Bas Cornelissen
 # Copyright © 2024 Bas Cornelissen
 # -------------------------------------------------------------------
-import matplotlib.pyplot as plt
+import copy
+import bisect
+import heapq
+import itertools
 import numpy as np
 import networkx as nx
 from music21.pitch import Pitch
 from typing import Callable, Iterable, Any
 
-from .utils import segment_deviations, draw_graph
+from .array_graph import ArrayGraph, PositionMap
+from .utils import segment_deviations, draw_graph, pitch_code, compact_graph
 from .gamut_graph import GamutGraph
+from .shortest_paths import ShortestPathTable
+from .profiling import stage
 
 OrigGraphNode = Any
-ParseGraphNode = tuple[int, OrigGraphNode]
+# Nodes in the original graph are represented by integer codes (their index in the
+# original graph), and parse nodes by a tuple of a position and such a code.
+OrigGraphCode = int
+ParseGraphNode = tuple[int, OrigGraphCode]
 SequenceItem = Any
 Path = list[ParseGraphNode]
 
+# Codes of the start and end nodes of a parse graph, and the nodes they stand for
+START = -1
+END = -2
+SENTINEL_NODES = {START: "START", END: "END"}
+
 
 def match_fn(node: OrigGraphNode, target: SequenceItem) -> bool:
     return node[1] == target
 
 
 class Segment:
-    def __init__(self, graph, start: int, end: int):
+    """A part of a parse graph with a unique start and end node. The paths through the
+    segment are enumerated lazily in order of increasing weight; ties are broken by the
+    codes of the nodes along the path. At most `max_paths` paths are ever computed
+    (all paths if `max_paths` is None)."""
+
+    def __init__(self, graph, start: int, end: int, max_paths: int = None):
         if not isinstance(graph, ParseGraph):
             raise Exception("Only segments of parse graphs are currently supported.")
         if len(graph.positions[start]) > 1 or len(graph.positions[end]) > 1:
@@ -32,20 +51,15 @@ class Segment:
         self.graph = graph
         self.start = start
         self.end = end
+        self.max_paths = max_paths
         self.start_node = self.graph.positions[start][0]
         self.end_node = self.graph.positions[end][0]
-        if self.start_node == self.end_node:
-            paths = [[self.start_node]]
-            weights = [0]
-        else:
-            paths = list(
-                nx.all_simple_paths(self.graph, self.start_node, self.end_node)
-            )
-            weights = [nx.path_weight(self.graph, path, "weight") for path in paths]
-
-        self.ranking = np.argsort(weights)
-        self.paths = [paths[i] for i in self.ranking]
-        self.weights = [weights[i] for i in self.ranking]
+        self._start_id = self.graph.node_id(self.start_node)
+        self._end_id = self.graph.node_id(self.end_node)
+        self._paths = []
+        self._weights = []
+        self._ranked_paths = self._iter_ranked_paths()
+        self._num_paths = None
 
     def __repr__(self):
         return f"<Segment {self.start}–{self.end} of {repr(self.graph)}>"
@@ -58,53 +72,214 @@ class Segment:
             yield self[pos]
 
     def __getitem__(self, index):
+        return self.step(index)
+
+    def _iter_ranked_paths(self):
+        """Enumerate all paths from the start to the end node in order of increasing
+        weight. Since the parse graph is layered (edges always connect consecutive
+        positions), the minimum weight from every node to the end node can be computed
+        in a single backward pass. A best-first search using these exact remaining
+        weights then pops complete paths in order of their weight, while only expanding
+        partial paths that are needed for the next path."""
+        if self.start_node == self.end_node:
+            yield [self.start_node], 0
+            return
+
+        # Minimum remaining weight from every node (id) to the end node
+        out_edges = self.graph.out_edges
+        remaining = {self._end_id: 0}
+        for pos in range(self.end - 1, self.start - 1, -1):
+            for node_id in self.graph.position_ids(pos):
+                targets, weights = out_edges(node_id)
+                weights = [
+                    weight + remaining[target]
+                    for target, weight in zip(targets, weights)
+                    if target in remaining
+                ]
+                if len(weights) > 0:
+                    remaining[node_id] = min(weights)
+        if self._start_id not in remaining:
+            return
+
+        # Partial paths are stored as (estimated weight, key, weight so far, node id,
+        # index in the segment, codes). The codes are a linked list (code, previous codes), and the key
+        # contains the codes at positions where the graph is wider than one node. Codes at
+        # other positions are shared by all paths and do not affect the ranking, so
+        # leaving them out keeps the search linear in the length of the segment.
+        codes_of = self.graph.node_codes
+        varying = (self.graph.width[self.start : self.end + 1] > 1).tolist()
+        _, start_code = self.start_node
+        start_key = (start_code,) if varying[0] else ()
+        start_entry = (start_code, None)
+        queue = [(remaining[self._start_id], start_key, 0, self._start_id, 0, start_entry)]
+        while queue:
+            _, key, weight, node_id, index, codes = heapq.heappop(queue)
+            if node_id == self._end_id:
+                path = []
+                while codes is not None:
+                    code, codes = codes
+                    path.append(code)
+                path.reverse()
+                yield [(self.start + i, code) for i, code in enumerate(path)], weight
+                continue
+            for target, edge_weight in zip(*out_edges(node_id)):
+                if target in remaining:
+                    succ_weight = weight + edge_weight
+                    estimate = succ_weight + remaining[target]
+                    code = codes_of[target]
+                    succ_key = key + (code,) if varying[index + 1] else key
+                    entry = (
+                        estimate,
+                        succ_key,
+                        succ_weight,
+                        target,
+                        index + 1,
+                        (code, codes),
+                    )
+                    heapq.heappush(queue, entry)
+
+    def _compute_paths(self, num_paths: int = None):
+        """Make sure the first `num_paths` paths (or all paths) have been computed."""
+        if self.max_paths is not None:
+            num_paths = self.max_paths if num_paths is None else num_paths
+            num_paths = min(num_paths, self.max_paths)
+        while num_paths is None or len(self._paths) < num_paths:
+            try:
+                path, weight = next(self._ranked_paths)
+            except StopIteration:
+                break
+            self._paths.append(path)
+            self._weights.append(weight)
+
+    @property
+    def paths(self) -> list[Path]:
+        """The paths through the segment, sorted by weight."""
+        self._compute_paths()
+        return self._paths
+
+    @property
+    def weights(self) -> list[float]:
+        """The weights of the paths through the segment."""
+        self._compute_paths()
+        return self._weights
+
+    @property
+    def num_paths(self) -> int:
+        """The total number of paths through the segment. This is computed by counting,
+        without enumerating the paths."""
+        if self._num_paths is None:
+            counts = {self._end_id: 1}
+            for pos in range(self.end - 1, self.start - 1, -1):
+                for node_id in self.graph.position_ids(pos):
+                    targets, _ = self.graph.out_edges(node_id)
+                    counts[node_id] = sum(counts.get(target, 0) for target in targets)
+            self._num_paths = counts[self._start_id]
+        return self._num_paths
+
+    def path(self, n: int = 0) -> Path:
+        """Return the n-th best path, or the worst path if there are fewer paths."""
+        self._compute_paths(n + 1)
+        return self._paths[min(n, len(self._paths) - 1)]
+
+    def shift(self, pos_shift: int, id_shift: int):
+        """Move the segment after the graph has changed before it. Paths that were
+        already computed are kept; the enumeration of further paths restarts after them."""
+        self.start += pos_shift
+        self.end += pos_shift
+        self.start_node = (self.start, self.start_node[1])
+        self.end_node = (self.end, self.end_node[1])
+        self._start_id += id_shift
+        self._end_id += id_shift
+        self._paths = [[(pos + pos_shift, code) for pos, code in p] for p in self._paths]
+        self._ranked_paths = itertools.islice(
+            self._iter_ranked_paths(), len(self._paths), None
+        )
+
+    def step(self, index: int, max_paths: int = None):
+        """Return the nodes at a position in the first `max_paths` paths, sorted by
+        the weight of the path."""
+        self._compute_paths(max_paths)
+        num = len(self._paths) if max_paths is None else max_paths
         index = index - self.start
         return dict(
-            nodes=[path[index] for path in self.paths],
-            weights=self.weights,
+            nodes=[path[index] for path in self._paths[:num]],
+            weights=self._weights[:num],
+            num_paths=self.num_paths,
             pos_in_segment=index,
         )
 
 
-class SegmentedGraph(nx.DiGraph):
-    _pos_to_segment = None
-    _positions = None
-    _segments = []
+class SegmentedGraph(ArrayGraph):
+    max_paths = None
 
-    @property
-    def length(self):
-        return len(self._positions)
+    def __init__(self):
+        self._pos_to_segment = None
+        self._width = None
+        self._segments = None
+        super().__init__()
+        self.positions = PositionMap(self)
+
+    def clear(self):
+        self._pos_to_segment = None
+        self._width = None
+        self._segments = None
+        super().clear()
+
+    def _remove(self, node_id: int):
+        # The width is updated in place, the segmentation has to be recomputed
+        if self._width is not None:
+            self._width[self.node_pos[node_id]] -= 1
+        self._pos_to_segment = None
+        self._segments = None
+        super()._remove(node_id)
 
     @property
-    def positions(self) -> dict[int, list[ParseGraphNode]]:
-        if self._positions is None:
-            self._positions = {}
-            for node in self.nodes:
-                pos, _ = node
-                if pos not in self._positions:
-                    self._positions[pos] = []
-                self._positions[pos].append(node)
-        return self._positions
+    def length(self):
+        return len(self)
 
     @property
     def width(self) -> np.ndarray:
         """A numpy array with the number of nodes at each position."""
         if self._width is None:
-            self._width = np.zeros(len(self))
-            for pos, _ in self.nodes:
-                self._width[pos] += 1
+            alive_pos = self.node_pos[self.alive]
+            self._width = np.bincount(alive_pos, minlength=len(self)).astype(float)
         return self._width
 
     @property
     def segments(self) -> list[Segment]:
         if self._segments is None:
             self._segments = []
-            positions = segment_deviations(self.width, value=1)
+            positions = segment_deviations(self.width.tolist(), value=1)
             for start, end in positions:
-                segment = Segment(self, start, end)
+                segment = Segment(self, start, end, max_paths=self.max_paths)
                 self._segments.append(segment)
         return self._segments
 
+    def splice(self, other: ArrayGraph, start: int, end: int, *args) -> tuple[int, int]:
+        """Splice another graph into this one (see `ArrayGraph.splice`). Segments that lie
+        entirely outside the replaced range are reused."""
+        old_segments = self._segments or []
+        pos_shift, id_shift = super().splice(other, start, end, *args)
+        self._width = None
+        self._pos_to_segment = None
+        self._segments = None
+        self.positions = PositionMap(self)
+
+        reusable = {}
+        for segment in old_segments:
+            if segment.end <= start:
+                reusable[(segment.start, segment.end)] = segment
+            elif segment.start >= end:
+                segment.shift(pos_shift, id_shift)
+                reusable[(segment.start, segment.end)] = segment
+        self._segments = []
+        for seg_start, seg_end in segment_deviations(self.width.tolist(), value=1):
+            segment = reusable.get((seg_start, seg_end))
+            if segment is None:
+                segment = Segment(self, seg_start, seg_end, max_paths=self.max_paths)
+            self._segments.append(segment)
+        return pos_shift, id_shift
+
     @property
     def pos_to_segment(self):
         if self._pos_to_segment is None:
@@ -118,15 +293,26 @@ class SegmentedGraph(nx.DiGraph):
         segment = self.pos_to_segment[position]
         return segment[position]
 
+    def orig_node(self, node: ParseGraphNode) -> OrigGraphNode:
+        """Return the node in the original graph corresponding to a parse node."""
+        return node[1]
+
     def iter_steps(
-        self, positions: Iterable[int] = None, return_orig_node: bool = True
+        self,
+        positions: Iterable[int] = None,
+        return_orig_node: bool = True,
+        max_paths: int = None,
     ):
+        """Iterate over the nodes at every position in the best `max_paths` paths
+        through the segment containing that position."""
+        if positions is None:
+            positions = range(len(self))
         last_segment = None
         for position in positions:
             segment = self.pos_to_segment[position]
-            step = segment[position]
+            step = segment.step(position, max_paths=max_paths)
             if return_orig_node:
-                step["nodes"] = [n[1] for n in step["nodes"]]
+                step["nodes"] = [self.orig_node(n) for n in step["nodes"]]
             step["is_first"] = segment != last_segment
             last_segment = segment
             yield step
@@ -137,26 +323,39 @@ class SegmentedGraph(nx.DiGraph):
         positions: Iterable[int] = None,
         return_orig_node: bool = True,
     ):
+        if positions is not None:
+            positions = set(positions)
         for index, segment in enumerate(self.segments):
-            index = selector(index, segment)
-            for i, step in enumerate(segment):
+            path = segment.path(selector(index, segment))
+            for i, node in enumerate(path):
                 pos = segment.start + i
                 if positions is None or pos in positions:
-                    node = step["nodes"][index]
-                    yield node[1] if return_orig_node else node
+                    yield self.orig_node(node) if return_orig_node else node
 
     def iter_nth_path(self, n: int = 0, **kwargs):
-        selector = lambda index, segment: min(n, len(segment.paths))
+        selector = lambda index, segment: n
         return self.iter_selected_paths(selector, **kwargs)
 
     def iter_best_path(self, **kwargs):
         return self.iter_nth_path(0, **kwargs)
 
+    @property
+    def best_weight(self) -> float:
+        """The total weight of the best path through the graph, including the edges
+        between segments."""
+        path = [node for segment in self.segments for node in segment.path(0)]
+        node_ids = [self.node_id(node) for node in path]
+        weight = 0
+        for source, target in zip(node_ids, node_ids[1:]):
+            targets, weights = self.out_edges(source)
+            weight += weights[targets.index(target)]
+        return weight
+
 
 class ParseGraph(SegmentedGraph):
-    input_positions = None
-    _positions = None
-    _shortest_paths = {}
+    """A graph of all ways to parse a sequence as a path through an original graph.
+    Parse nodes are pairs of a position and the code of a node in the original graph;
+    their attributes are not copied but can be looked up in `orig_attrs`."""
 
     def __init__(
         self,
@@ -164,150 +363,390 @@ class ParseGraph(SegmentedGraph):
         sequence: Iterable[SequenceItem] = None,
         match_fn: Callable[[OrigGraphNode, SequenceItem], bool] = match_fn,
         prune: bool = True,
-        **kwargs,
+        max_paths: int = None,
+        beam_width: int = None,
     ):
-        super().__init__(**kwargs)
+        super().__init__()
+        self.max_paths = max_paths
+        if beam_width is not None and beam_width < 1:
+            raise ValueError("The beam width should be at least 1")
+        self.beam_width = beam_width
         self.orig = graph
+        self.orig_nodes, self.orig_codes, self.orig_successors = self.compact(graph)
+        self.orig_attrs = [self.orig.nodes[node] for node in self.orig_nodes]
+        self.orig_paths = self.shortest_path_table(graph)
         self.match_fn = match_fn
+        self.input_positions = None
+        self._shortest_paths = self.path_memo(graph)
         if sequence is not None:
             self.build(sequence, prune=prune)
 
     def __repr__(self):
         return f"<ParseGraph of {self.orig.__class__.__name__}>"
 
-    def __len__(self):
-        return max(*self.positions.keys()) + 1
+    ## Encoding
+
+    def compact(self, graph: nx.Graph) -> tuple[list, dict, list]:
+        """Number the nodes of the original graph, see `utils.compact_graph`."""
+        return compact_graph(graph)
+
+    def shortest_path_table(self, graph: nx.Graph) -> ShortestPathTable:
+        """Compute a table of all shortest paths between nodes in the original graph."""
+        successors = [list(succ.keys()) for succ in self.orig_successors]
+        return ShortestPathTable.from_successors(successors)
+
+    def path_memo(self, graph: nx.Graph) -> dict:
+        """The dictionary in which `shortest_paths` memoizes its results. Entries are
+        added atomically and never changed, so the dictionary can be shared."""
+        return {}
+
+    def encode(self, item: SequenceItem) -> Any:
+        """Encode an item of the sequence. The encoded items are passed to the search
+        function and are compared to decide whether two consecutive items are equal."""
+        return item
+
+    def penalty(self, code: OrigGraphCode, target: Any) -> float:
+        """The penalty for parsing an (encoded) item of the sequence as a node of the
+        original graph. It is used to rank partial paths in the beam search."""
+        return 0
+
+    def orig_node(self, node: ParseGraphNode) -> OrigGraphNode:
+        """The node in the original graph, or "START" or "END" for the start and end
+        nodes (their negative codes are not indices in `orig_nodes`)."""
+        code = node[1]
+        if code < 0:
+            return SENTINEL_NODES[code]
+        return self.orig_nodes[code]
 
     ## Parent search operations
 
     def search(
-        self, target: Any, nodes: Iterable[OrigGraphNode] = None
-    ) -> list[tuple[OrigGraphNode, dict]]:
-        """Search for nodes matching a certain target value using the match function."""
+        self, target: Any, nodes: Iterable[OrigGraphCode] = None
+    ) -> list[OrigGraphCode]:
+        """Search for nodes matching a certain (encoded) target value using the match
+        function. Returns the codes of the matching nodes."""
         if nodes is None:
-            nodes = self.orig.nodes
+            nodes = range(len(self.orig_nodes))
         matches = []
-        for node in nodes:
-            if not node in self.orig:
-                raise ValueError(f"Node {node} is not in the original graph.")
-            if self.match_fn(node, target):
-                matches.append(node)
+        for code in nodes:
+            if not 0 <= code < len(self.orig_nodes):
+                raise ValueError(f"Node {code} is not in the original graph.")
+            if self.match_fn(self.orig_nodes[code], target):
+                matches.append(code)
         return matches
 
     def shortest_paths(
-        self, source_value: OrigGraphNode, target_value: OrigGraphNode
-    ) -> dict[tuple[OrigGraphNode, OrigGraphNode], list[list[OrigGraphNode]]]:
-        """Return the shortest paths between two nodes in the original graph. This function memoizes the results."""
-        if (source_value, target_value) not in self._shortest_paths:
+        self, source_value: Any, target_value: Any
+    ) -> list[list[OrigGraphCode]]:
+        """Return the shortest paths between nodes matching the (encoded) source and
+        target values in the original graph. The paths are enumerated from the table of
+        shortest paths in the original graph. This function memoizes the results; the
+        memo may be shared by parse graphs in different threads (see `path_memo`)."""
+        key = (source_value, target_value)
+        all_paths = self._shortest_paths.get(key)
+        if all_paths is None:
             source_matches = self.search(source_value)
             target_matches = self.search(target_value)
+            pairs = [
+                (source, target, self.orig_paths.distance(source, target))
+                for source in source_matches
+                for target in target_matches
+            ]
+
+            # Store the shortest paths (unreachable pairs have distance -1)
+            shortest_length = min([dist for _, _, dist in pairs if dist >= 0])
             all_paths = []
-            for source in source_matches:
-                for target in target_matches:
-                    paths = nx.all_shortest_paths(self.orig, source, target)
-                    all_paths.extend(paths)
-
-            # Store the shortest paths
-            shortest_length = min([len(path) for path in all_paths])
-            all_paths = [path for path in all_paths if len(path) == shortest_length]
-            self._shortest_paths[(source_value, target_value)] = all_paths
+            for source, target, dist in pairs:
+                if dist == shortest_length:
+                    all_paths.extend(self.orig_paths.paths(source, target))
 
-        return self._shortest_paths[(source_value, target_value)]
+            # If another thread stored the same paths in the meantime, use those
+            all_paths = self._shortest_paths.setdefault(key, all_paths)
+        return all_paths
 
     ## Construction
 
-    def _add_node(self, pos: int, orig_node: OrigGraphNode) -> ParseGraphNode:
-        """Add a node to the parse graph based on the position and a node in the original graph."""
-        node = (pos, orig_node)
-        attrs = dict(**self.orig.nodes[orig_node])
-        self.add_node(node, **attrs)
-        return node
-
     def _add_path(self, start, path):
         new_nodes = []
-        for i, orig_node in enumerate(path):
-            pos = start + i
-            new_node = (pos, orig_node)
-            if new_node not in self.nodes:
-                self._add_node(pos, orig_node)
+        for i, code in enumerate(path):
+            new_node = (start + i, code)
             if i >= 1:
-                orig_weight = self.orig[new_nodes[-1][1]][new_node[1]]["weight"]
+                orig_weight = self.orig_successors[new_nodes[-1][1]][code]
                 self.add_edge(new_nodes[-1], new_node, weight=orig_weight)
-
+            else:
+                self.add_node(new_node)
             new_nodes.append(new_node)
         return new_nodes
 
     def prune_branch(self, source: ParseGraphNode):
         """Remove all predecessors of a node that have only one successor. This allows us to
-        prune branches that cannot parse the sequence anyway."""
-        predecessors = list(self.predecessors(source))
-        for predecessor in predecessors:
-            if self.out_degree[predecessor] == 1:
-                self.prune_branch(predecessor)
-                self.remove_node(predecessor)
-
-        if self.out_degree[source] == 0:
-            self.remove_node(source)
-
-    def clear(self):
-        self._segments = None
-        self._width = None
-        self._positions = None
-        self._shortest_paths = {}
-        super().clear()
+        prune branches that cannot parse the sequence anyway. Branches are walked
+        backwards (depth first) using an explicit stack, so that arbitrarily long
+        branches can be pruned."""
+        source_id = self.node_id(source)
+        # Every frame holds a node, its predecessors and the index of the next one
+        stack = [(source_id, self.in_edges(source_id)[0], 0)]
+        while stack:
+            node_id, predecessors, i = stack.pop()
+            if i < len(predecessors):
+                stack.append((node_id, predecessors, i + 1))
+                predecessor = predecessors[i]
+                if self.alive[predecessor] and self._out_degree(predecessor) == 1:
+                    stack.append((predecessor, self.in_edges(predecessor)[0], 0))
+            elif node_id != source_id:
+                # All predecessors have been handled: remove the branch node itself
+                self._remove(node_id)
+
+        if self._out_degree(source_id) == 0:
+            self._remove(source_id)
 
     def build(self, sequence: Iterable[SequenceItem], prune: bool = True):
-        self.clear()
+        """Build the parse graph of a sequence."""
         self.seq = sequence
-        self.start = (0, "START")
-        self.add_node(self.start, name="START", position=(0, 0))
-
-        # First step: from start to first matching nodes (in the original graph)
-        matches = self.search(self.seq[0])
-        for orig_node in matches:
-            new_node = self._add_node(1, orig_node)
-            self.add_edge(self.start, new_node, weight=0)
-
-        pos = 1
-        prev_nodes = [node for node in matches]
-        self.input_positions = [1]
-        for prev_value, next_value in zip(self.seq, self.seq[1:]):
-            # Find all paths from prev_value to next_value
-            paths = self.shortest_paths(prev_value, next_value)
-            paths = [p for p in paths if p[0] in prev_nodes]
-            if len(paths) == 0:
-                raise Exception("This sequence could not be parsed")
-
-            # Add paths to the next nodes
-            next_nodes = []
-            for prev_node in prev_nodes:
-                for path in paths:
-                    if path[0] == prev_node:
-                        if prev_value != next_value:
-                            path = path[1:]
-                        new_nodes = self._add_path(pos + 1, path)
-                        orig_weight = self.orig[prev_node][new_nodes[0][1]]["weight"]
-                        self.add_edge(
-                            (pos, prev_node), new_nodes[0], weight=orig_weight
-                        )
-                        next_nodes.append(new_nodes[-1][1])
-
-            # Prune paths
-            if prune:
-                for prev_node in prev_nodes:
-                    if self.out_degree[(pos, prev_node)] == 0:
-                        self.prune_branch((pos, prev_node))
+        self.encoded_seq = [self.encode(item) for item in sequence]
+        self.build_encoded(self.encoded_seq, prune=prune)
 
-            pos = new_nodes[-1][0]
-            self.input_positions.append(pos)
-            prev_nodes = set(next_nodes)
+    def build_encoded(
+        self, encoded_seq: list, prune: bool = True, start_code: OrigGraphCode = None
+    ):
+        """Build the parse graph of an encoded sequence, optionally starting from a single
+        node of the original graph. Nodes and edges are first collected and then
+        converted to a compact array graph. Branches that cannot be continued are pruned
+        afterwards, in the order in which they were found during construction.
+
+        Positions of the input where only one node can be reached (regardless of the rest
+        of the sequence) are stored in `anchors`, a dict mapping the index in the
+        sequence to the code of that node.
+
+        If the graph has a `beam_width`, only that many nodes are kept at every input
+        position: those with the lowest cost of the best partial path reaching them.
+        The other nodes are not continued (and pruned). This gives an approximate
+        parse, which is much smaller for large original graphs."""
+        with stage("parse_graph", length=len(encoded_seq)) as record:
+            self.clear()
+            self.start = (0, START)
+            self.add_node(self.start)
+
+            # First step: from start to first matching nodes (in the original graph)
+            matches = self.search(encoded_seq[0])
+            if start_code is not None:
+                if start_code not in matches:
+                    raise ValueError("The start node does not match the sequence")
+                matches = [start_code]
+            for code in matches:
+                self.add_edge(self.start, (1, code), weight=0)
+
+            pos = 1
+            prev_nodes = [code for code in matches]
+            dead_ends = []
+            if self.beam_width is not None:
+                viable = self.viable_nodes(encoded_seq)
+                costs = {code: self.penalty(code, encoded_seq[0]) for code in matches}
+                prev_nodes = self._beam(1, costs, dead_ends, viable[0])
+            self.input_positions = [1]
+            self.anchors = {0: matches[0]} if len(matches) == 1 else {}
+            for index in range(1, len(encoded_seq)):
+                prev_value, next_value = encoded_seq[index - 1], encoded_seq[index]
+                # Find all paths from prev_value to next_value
+                paths = self.shortest_paths(prev_value, next_value)
+                paths = [p for p in paths if p[0] in prev_nodes]
+                if len(paths) == 0:
+                    raise Exception("This sequence could not be parsed")
+
+                # Add paths to the next nodes
+                next_nodes = []
+                next_costs = {}
+                for prev_node in prev_nodes:
+                    has_paths = False
+                    for path in paths:
+                        if path[0] == prev_node:
+                            has_paths = True
+                            if prev_value != next_value:
+                                path = path[1:]
+                            new_nodes = self._add_path(pos + 1, path)
+                            successors = self.orig_successors[prev_node]
+                            orig_weight = successors[new_nodes[0][1]]
+                            self.add_edge(
+                                (pos, prev_node), new_nodes[0], weight=orig_weight
+                            )
+                            next_nodes.append(new_nodes[-1][1])
+                            if self.beam_width is not None:
+                                self._update_cost(
+                                    next_costs,
+                                    costs[prev_node],
+                                    prev_node,
+                                    path,
+                                    next_value,
+                                )
+                    if not has_paths:
+                        dead_ends.append((pos, prev_node))
+
+                pos = new_nodes[-1][0]
+                self.input_positions.append(pos)
+                prev_nodes = set(next_nodes)
+                if self.beam_width is not None:
+                    costs = next_costs
+                    prev_nodes = self._beam(pos, costs, dead_ends, viable[index])
+                if len(prev_nodes) == 1:
+                    self.anchors[index] = next(iter(prev_nodes))
+
+            # Finish up: connect to end node
+            self.end = (pos + 1, END)
+            for prev_node in prev_nodes:
+                self.add_edge((pos, prev_node), self.end, weight=0)
+            self.finalize()
+            if record is not None:
+                record["nodes"] = self.num_nodes
+                record["edges"] = int(self.edge_alive.sum())
+                record["max_width"] = int(self.width.max())
+
+        # Prune branches that could not be continued
+        if prune:
+            with stage("prune", dead_ends=len(dead_ends)) as record:
+                for node in dead_ends:
+                    self.prune_branch(node)
+                if record is not None:
+                    record["nodes"] = self.num_nodes
+                    record["max_width"] = int(self.width.max())
+
+    def _update_cost(
+        self,
+        costs: dict,
+        prev_cost: float,
+        prev_node: OrigGraphCode,
+        path: list[OrigGraphCode],
+        target: Any,
+    ):
+        """Update the lowest cost of reaching the last node of a path"""
+        cost = prev_cost
+        for source, target_node in zip([prev_node] + path, path):
+            cost += self.orig_successors[source][target_node]
+        cost += self.penalty(path[-1], target)
+        if cost < costs.get(path[-1], np.inf):
+            costs[path[-1]] = cost
+
+    def viable_nodes(self, encoded_seq: list) -> list[set[OrigGraphCode]]:
+        """For every item of the sequence, the codes of the matching nodes from which the
+        rest of the sequence can be parsed, computed in a single backward pass."""
+        viable = [set(self.search(encoded_seq[-1]))]
+        for index in range(len(encoded_seq) - 2, -1, -1):
+            paths = self.shortest_paths(encoded_seq[index], encoded_seq[index + 1])
+            viable.append(set(p[0] for p in paths if p[-1] in viable[-1]))
+        return viable[::-1]
+
+    def _beam(
+        self, pos: int, costs: dict, dead_ends: list, viable: set[OrigGraphCode]
+    ) -> list[OrigGraphCode]:
+        """Keep the `beam_width` nodes with the lowest costs (ties are broken by their
+        codes); the other nodes become dead ends. Nodes from which the rest of the
+        sequence can be parsed are always preferred, so the beam never gets stuck."""
+        ranked = sorted(costs, key=lambda code: (code not in viable, costs[code], code))
+        for code in ranked[self.beam_width :]:
+            dead_ends.append((pos, code))
+        return ranked[: self.beam_width]
+
+    def next_frontier(
+        self, prev_nodes: set[OrigGraphCode], prev_value: Any, next_value: Any
+    ) -> set[OrigGraphCode]:
+        """The codes of the nodes that can be reached at the next input position from
+        the nodes at the previous input position (before pruning)."""
+        paths = self.shortest_paths(prev_value, next_value)
+        next_nodes = set(p[-1] for p in paths if p[0] in prev_nodes)
+        if len(next_nodes) == 0:
+            raise Exception("This sequence could not be parsed")
+        return next_nodes
+
+    def update(
+        self, sequence: Iterable[SequenceItem], start: int, stop: int, prune: bool = True
+    ):
+        """Update the parse graph after the items `start, ..., stop - 1` of the sequence
+        have been replaced by any number of new items, resulting in `sequence`. Only the
+        part of the graph between the nearest anchors around the edited range is rebuilt
+        and spliced into the graph; segments outside that part are reused.
+
+        The right anchor is the first anchor after the edit at which the new sequence
+        reaches the same single node as before: from there on, the graph is unchanged.
+        If there is no such anchor, the graph is rebuilt up to the end. Graphs built
+        with a beam are always rebuilt entirely."""
+        if self.beam_width is not None:
+            # Nodes outside the beam depend on the entire sequence before them
+            return self.build(sequence, prune=prune)
+        old_length = len(self.encoded_seq)
+        shift = len(sequence) - old_length
+        if not 0 <= start <= stop <= old_length or stop + shift < start:
+            raise ValueError("Invalid range of edited items")
+        encoded_seq = (
+            self.encoded_seq[:start]
+            + [self.encode(item) for item in sequence[start : stop + shift]]
+            + self.encoded_seq[stop:]
+        )
+        if len(encoded_seq) == 0:
+            raise ValueError("The sequence is empty")
+
+        # Left anchor: the last anchor before the edit. The graph is rebuilt from there.
+        anchors = sorted(self.anchors)
+        i = bisect.bisect_left(anchors, start) - 1
+        left = anchors[i] if i >= 0 else None
+        first = 0 if left is None else left
+
+        # Right anchor: follow the frontier of the new sequence until it coincides with
+        # an anchor of the old sequence after the edit
+        right = None
+        frontier = set(self.search(encoded_seq[first]))
+        if left is not None:
+            frontier = {self.anchors[left]}
+        for index in range(first + 1, len(encoded_seq)):
+            frontier = self.next_frontier(
+                frontier, encoded_seq[index - 1], encoded_seq[index]
+            )
+            old_index = index - shift
+            if old_index >= stop and frontier == {self.anchors.get(old_index)}:
+                right = old_index
+                break
+        last = len(encoded_seq) - 1 if right is None else right + shift
+
+        # Build the affected part and splice it into the graph
+        part = self._empty_copy()
+        part.build_encoded(
+            encoded_seq[first : last + 1],
+            prune=prune,
+            start_code=None if left is None else self.anchors[left],
+        )
+        old_input_positions = self.input_positions
+        splice_start = 0 if left is None else old_input_positions[left]
+        part_start = 0 if left is None else part.input_positions[0]
+        if right is None:
+            splice_end, part_end = len(self) - 1, len(part) - 1
+        else:
+            splice_end, part_end = old_input_positions[right], part.input_positions[-1]
+        pos_shift, _ = self.splice(part, splice_start, splice_end, part_start, part_end)
+
+        offset = splice_start - part_start
+        suffix = [] if right is None else old_input_positions[right + 1 :]
+        self.input_positions = (
+            old_input_positions[:first]
+            + [pos + offset for pos in part.input_positions]
+            + [pos + pos_shift for pos in suffix]
+        )
+        self.anchors = {
+            **{index: code for index, code in self.anchors.items() if index < first},
+            **{index + first: code for index, code in part.anchors.items()},
+            **{
+                index + shift: code
+                for index, code in self.anchors.items()
+                if right is not None and index > right
+            },
+        }
+        self.seq = sequence
+        self.encoded_seq = encoded_seq
+        self.end = (len(self) - 1, END)
 
-        # Finish up: connect to end node
-        self.end = (pos + 1, "END")
-        self.add_node(self.end, name="END", position=(pos + 1, 0))
-        for prev_node in prev_nodes:
-            self.add_edge((pos, prev_node), self.end, weight=0)
-        self.set_node_positions()
+    def _empty_copy(self) -> "ParseGraph":
+        """An empty parse graph of the same original graph, sharing all lookup tables"""
+        graph = copy.copy(self)
+        graph.clear()
+        graph.positions = PositionMap(graph)
+        return graph
 
     ## Iterating segments
 
@@ -317,6 +756,15 @@ class ParseGraph(SegmentedGraph):
         input_only=True,
         **kwargs,
     ):
+        """Iterate over the nodes of the selected path through every segment: only
+        those at input positions, or all nodes including the start and end nodes.
+
+        >>> from delasol import solmize
+        >>> parse = solmize(["C4", "D4"], gamut="hard-continental").parse
+        >>> path = list(parse.iter_best_path(input_only=False))
+        >>> path[0], [str(pitch) for _, pitch in path[1:-1]], path[-1]
+        ('START', ['C4', 'D4'], 'END')
+        """
         if input_only:
             kwargs["positions"] = self.input_positions
         return super().iter_selected_paths(selector, **kwargs)
@@ -328,17 +776,31 @@ class ParseGraph(SegmentedGraph):
 
     # Drawing
 
-    def set_node_positions(self):
+    def node_positions(self) -> dict[ParseGraphNode, tuple[int, int]]:
+        """Positions for drawing the parse graph: nodes at the same position are
+        ordered by their vertical position in the original graph."""
+
         def orig_y_position(node):
-            if node[1] in self.orig.nodes:
-                orig_node_attrs = self.orig.nodes[node[1]]
-                return orig_node_attrs.get("position", (0, 0))[1]
+            if node[1] >= 0:
+                return self.orig_attrs[node[1]].get("position", (0, 0))[1]
             return 0
 
+        node_positions = {}
         for pos, nodes in self.positions.items():
             nodes = sorted(nodes, key=orig_y_position)
             for i, node in enumerate(nodes):
-                self.nodes[node]["position"] = (pos, i)
+                node_positions[node] = (pos, i)
+        return node_positions
+
+    def node_names(self) -> dict[ParseGraphNode, str]:
+        """Names of all nodes, taken from the original graph"""
+        names = {}
+        for node in self.nodes:
+            if node[1] in SENTINEL_NODES:
+                names[node] = SENTINEL_NODES[node[1]]
+            else:
+                names[node] = self.orig_attrs[node[1]].get("name", str(node[1]))
+        return names
 
     def draw(
         self,
@@ -348,6 +810,8 @@ class ParseGraph(SegmentedGraph):
         width_factor: float = 0.7,
         **kws,
     ):
+        import matplotlib.pyplot as plt
+
         if fig is None:
             plt.figure(figsize=((len(self) - 1) * width_factor, self.width.max()))
         if show_segments:
@@ -355,7 +819,9 @@ class ParseGraph(SegmentedGraph):
                 plt.gca().axvline(
                     segment.start - 0.5, color="k", lw=0.5, linestyle="--"
                 )
-        draw_graph(self, **kws)
+        kws.setdefault("pos", self.node_positions())
+        kws.setdefault("labels", self.node_names())
+        draw_graph(self.to_networkx(), **kws)
         if show_axes:
             ax = plt.gca()
             ax.spines["top"].set_visible(False)
@@ -389,8 +855,8 @@ class GamutParseGraph(ParseGraph):
     ):
         if not isinstance(gamut, GamutGraph):
             raise ValueError("The graph should be a GamutGraph.")
-        if sequence is not None and not isinstance(sequence[0], Pitch):
-            raise ValueError("The sequence should be a list of pitches.")
+        if sequence is not None and not isinstance(sequence[0], (Pitch, tuple)):
+            raise ValueError("The sequence should be a list of pitches or pitch codes.")
         if match_fn is not None:
             raise Warning("The match function is ignored for GamutParseGraph.")
 
@@ -398,21 +864,104 @@ class GamutParseGraph(ParseGraph):
         self.mismatch_penalty = mismatch_penalty
         super().__init__(graph=gamut, sequence=sequence, **kwargs)
 
+    def compact(self, graph: GamutGraph) -> tuple[list, dict, list]:
+        return graph.compact
+
+    def shortest_path_table(self, graph: GamutGraph) -> ShortestPathTable:
+        return graph.shortest_path_table
+
+    def path_memo(self, graph: GamutGraph) -> dict:
+        # Shared by all parse graphs of the gamut
+        return graph.parse_paths
+
+    def encode(self, item: Pitch) -> tuple[int, float]:
+        return pitch_code(item)
+
+    def penalty(self, code: OrigGraphCode, target: tuple[int, float]) -> float:
+        if self.gamut.pitch_codes[code] != target:
+            return self.mismatch_penalty
+        return 0
+
     def search(
-        self, target: Pitch, nodes: Iterable[OrigGraphNode] = None
-    ) -> list[tuple[OrigGraphNode, dict]]:
-        """Search for nodes with a matching pitch"""
-        if nodes is None:
-            nodes = self.orig.nodes
-        return [n for n in nodes if n[1].diatonicNoteNum == target.diatonicNoteNum]
-
-    def build(self, sequence: Iterable[Pitch], prune: bool = True):
-        super().build(sequence, prune=prune)
-
-        # Add a mismatch penalty to all nodes that do not exactly match the target pitch
-        for pos, target in zip(self.input_positions, sequence):
-            for node in self.positions[pos]:
-                _, (_, pitch) = node
-                if pitch != target:
-                    for predecessor in self.predecessors(node):
-                        self[predecessor][node]["weight"] += self.mismatch_penalty
+        self, target: tuple[int, float], nodes: Iterable[OrigGraphCode] = None
+    ) -> list[OrigGraphCode]:
+        """Search for nodes with a matching (encoded) pitch, using the gamut's index of
+        diatonic note numbers."""
+        matches = self.gamut.diatonic_index.get(target[0], [])
+        if nodes is not None:
+            nodes = set(nodes)
+            matches = [code for code in matches if code in nodes]
+        return matches
+
+    def build_encoded(self, encoded_seq: list, prune: bool = True, **kwargs):
+        super().build_encoded(encoded_seq, prune=prune, **kwargs)
+        self.edge_weight[self.mismatches(encoded_seq)] += self.mismatch_penalty
+        self._adjacency = None
+
+    def mismatches(self, encoded_seq: list = None) -> np.ndarray:
+        """A boolean array marking the edges into nodes at input positions that do not
+        exactly match the target pitch. These edges get the mismatch penalty. Edges are
+        compared all at once."""
+        if encoded_seq is None:
+            encoded_seq = self.encoded_seq
+        num_positions = len(self)
+        target_step = np.full(num_positions, np.nan)
+        target_alter = np.full(num_positions, np.nan)
+        target_step[self.input_positions] = [step for step, _ in encoded_seq]
+        target_alter[self.input_positions] = [alter for _, alter in encoded_seq]
+        gamut_codes = np.array(self.gamut.pitch_codes, dtype=float).reshape(-1, 2)
+
+        pos = self.node_pos[self.edge_dst]
+        code = self.node_code[self.edge_dst]
+        at_input = ~np.isnan(target_step[pos]) & (code >= 0)
+        node_codes = gamut_codes[np.where(at_input, code, 0)]
+        return at_input & (
+            (node_codes[:, 0] != target_step[pos])
+            | (node_codes[:, 1] != target_alter[pos])
+        )
+
+    def reweight(self, gamut: GamutGraph = None, mismatch_penalty: float = None):
+        """Recompute all edge weights for another gamut with the same nodes and edges
+        (for example with a different mutation weight) and/or another mismatch penalty,
+        without rebuilding the graph. The structure of the parse graph only depends on
+        the unweighted shortest paths in the gamut, so it does not change; the paths
+        through all segments are ranked again when they are needed. The new weights
+        are looked up in the gamut's weight matrix for all edges at once."""
+        if self.beam_width is not None:
+            raise ValueError(
+                "Graphs built with a beam cannot be reweighted: the nodes in the beam "
+                "depend on the weights"
+            )
+        if gamut is None:
+            gamut = self.gamut
+        if gamut is not self.gamut and not same_topology(gamut, self.gamut):
+            raise ValueError("The gamut should have the same nodes and edges")
+        if mismatch_penalty is not None:
+            self.mismatch_penalty = mismatch_penalty
+
+        self.gamut = self.orig = gamut
+        self.orig_nodes, self.orig_codes, self.orig_successors = self.compact(gamut)
+        self.orig_attrs = [gamut.nodes[node] for node in self.orig_nodes]
+        self.orig_paths = self.shortest_path_table(gamut)
+        self._shortest_paths = self.path_memo(gamut)
+
+        # Edges from the start node and to the end node have no weight
+        source = self.node_code[self.edge_src]
+        target = self.node_code[self.edge_dst]
+        inner = (source >= 0) & (target >= 0)
+        weights = np.zeros(len(self.edge_src))
+        weights[inner] = gamut.weight_matrix[source[inner], target[inner]]
+        weights[self.mismatches()] += self.mismatch_penalty
+        self.edge_weight = weights
+        self._adjacency = None
+        self._segments = None
+        self._pos_to_segment = None
+
+
+def same_topology(gamut: GamutGraph, other: GamutGraph) -> bool:
+    """Whether two gamuts have the same nodes (in the same order) and the same edges,
+    regardless of the weights of the edges."""
+    return gamut.node_list == other.node_list and all(
+        succ.keys() == other_succ.keys()
+        for succ, other_succ in zip(gamut.successors_by_code, other.successors_by_code)
+    )
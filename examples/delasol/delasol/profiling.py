@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+"""Tracing of the stages of a solmization, to find which stage blows up on a
+pathological piece without attaching a profiler.
+
+Tracing is off by default and then costs almost nothing. It is turned on either in
+code, using the `trace` context manager:
+
+>>> from delasol import solmize
+>>> with trace(memory=False) as tracer:
+...     solmization = solmize(["G3", "A3", "B3"], gamut="hard-continental")
+...     codes = solmization.codes
+>>> [record["stage"] for record in tracer.records]
+['gamut', 'parse_graph', 'prune', 'paths']
+>>> [record.get("nodes") for record in tracer.records]
+[None, 8, 8, None]
+
+or for a whole process, by setting the environment variable `DELASOL_TRACE` to the
+path of a JSON file (or to `1` to print the JSON to stderr when the process exits).
+"""
+import atexit
+import contextvars
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Union
+
+TRACE_VARIABLE = "DELASOL_TRACE"
+
+_active_tracer = contextvars.ContextVar("delasol_tracer", default=None)
+_env_tracer = None
+
+
+class Tracer:
+    """Records the wall time and memory allocations of stages. Every stage gives a
+    record (a dict) with its `stage` name, the `parent` record (an index in `records`,
+    or None), the wall `time` in seconds, the net number of allocated memory `blocks`
+    and, if `memory` is True, the net `memory` and `peak_memory` allocated in bytes
+    (measured using tracemalloc, which slows everything down considerably). Stages can
+    add sizes (node counts, widths, ...) to their record."""
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.records = []
+        self._stack = []
+        self._started_tracemalloc = False
+
+    def __repr__(self):
+        return f"<Tracer with {len(self.records)} records>"
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str, **sizes):
+        """Trace a stage. Yields its record, to which sizes can be added."""
+        parent = self._stack[-1] if len(self._stack) > 0 else None
+        record = dict(stage=name, parent=parent, **sizes)
+        index = len(self.records)
+        self.records.append(record)
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for every stage; pass it on to the enclosing stage
+            if parent is not None:
+                outer = self.records[parent]
+                outer["_peak"] = max(outer["_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_start_memory"] = current
+            record["_peak"] = current
+        self._stack.append(index)
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["time"] = time.perf_counter() - start
+            record["blocks"] = sys.getallocatedblocks() - blocks
+            self._stack.pop()
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(record.pop("_peak"), peak)
+                start_memory = record.pop("_start_memory")
+                record["memory"] = current - start_memory
+                record["peak_memory"] = peak - start_memory
+                if parent is not None:
+                    outer = self.records[parent]
+                    outer["_peak"] = max(outer["_peak"], peak)
+                tracemalloc.reset_peak()
+
+    def extend(self, records: list[dict]):
+        """Add the records of another tracer (for example one in a worker process),
+        nested in the current stage."""
+        offset = len(self.records)
+        parent = self._stack[-1] if len(self._stack) > 0 else None
+        for record in records:
+            record = dict(record)
+            if record["parent"] is None:
+                record["parent"] = parent
+            else:
+                record["parent"] += offset
+            self.records.append(record)
+
+    def summary(self) -> dict[str, dict]:
+        """The number of records, the total and maximum time and the maximum peak
+        memory of every stage."""
+        summary = {}
+        for record in self.records:
+            stats = summary.setdefault(
+                record["stage"], dict(count=0, time=0.0, max_time=0.0)
+            )
+            stats["count"] += 1
+            stats["time"] += record.get("time", 0.0)
+            stats["max_time"] = max(stats["max_time"], record.get("time", 0.0))
+            if "peak_memory" in record:
+                stats["max_peak_memory"] = max(
+                    stats.get("max_peak_memory", 0), record["peak_memory"]
+                )
+        return summary
+
+    def to_dict(self) -> dict:
+        return dict(records=self.records, summary=self.summary())
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), default=str, **kwargs)
+
+    def save(self, path: str):
+        with open(path, "w") as file:
+            file.write(self.to_json(indent=2))
+
+
+@contextmanager
+def trace(path: str = None, memory: bool = True):
+    """Trace all stages inside the context, and optionally save the trace as JSON.
+    Yields the `Tracer`."""
+    tracer = Tracer(memory=memory)
+    tracer.start()
+    token = _active_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _active_tracer.reset(token)
+        tracer.stop()
+        if path is not None:
+            tracer.save(path)
+
+
+def _write_env_trace(tracer: Tracer, target: str):
+    if target == "1":
+        print(tracer.to_json(indent=2), file=sys.stderr)
+    else:
+        tracer.save(target)
+
+
+def get_tracer() -> Union[Tracer, None]:
+    """The active tracer: that of the enclosing `trace` context, or the tracer of the
+    process if the environment variable `DELASOL_TRACE` is set, or None."""
+    global _env_tracer
+    tracer = _active_tracer.get()
+    if tracer is not None:
+        return tracer
+    if _env_tracer is None:
+        target = os.environ.get(TRACE_VARIABLE)
+        if not target or target == "0":
+            return None
+        _env_tracer = Tracer(memory=True)
+        _env_tracer.start()
+        atexit.register(_write_env_trace, _env_tracer, target)
+    return _env_tracer
+
+
+@contextmanager
+def stage(name: str, **sizes):
+    """Trace a stage if tracing is on. Yields the record of the stage, or None if
+    tracing is off, so that sizes are only computed when needed:
+
+    >>> with stage("example") as record:
+    ...     if record is not None:
+    ...         record["size"] = 3
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+    else:
+        with tracer.stage(name, **sizes) as record:
+            yield record
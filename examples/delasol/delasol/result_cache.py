@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from collections.abc import Iterable
+from typing import Callable, Union
+
+from .shortest_paths import CACHE_DIR
+from .utils import PitchCode
+
+# Bump this whenever the parse graph or its ranking of paths changes, so that results
+# computed by an older version are no longer used.
+RESULT_CACHE_VERSION = 1
+
+
+class MissingPathError(LookupError):
+    """Raised when a path is requested that is not stored in a `CachedParse`."""
+
+
+class CachedSegment:
+    """A segment of a parse graph as stored in a `ResultCache`: the best paths through
+    the segment (restricted to input positions) and their weights, and the total number
+    of paths. Only the first `num_stored` of all `num_paths` paths are available."""
+
+    def __init__(
+        self,
+        positions: list[int],
+        paths: list[list[int]],
+        weights: list[float],
+        num_paths: int,
+    ):
+        self.positions = positions
+        self.paths = [list(zip(positions, codes)) for codes in paths]
+        self.weights = weights
+        self.num_paths = num_paths
+        self.num_stored = len(self.paths)
+
+    def __repr__(self):
+        return f"<CachedSegment of {len(self.positions)} notes>"
+
+    def __len__(self):
+        return len(self.positions)
+
+    def has_path(self, n: int) -> bool:
+        """Whether the n-th best path is stored. As in the parse graph, any n beyond the
+        number of paths refers to the worst path."""
+        return min(n, self.num_paths - 1) < self.num_stored
+
+    def path(self, n: int = 0) -> list[tuple[int, int]]:
+        """Return the n-th best path, or raise a `MissingPathError` if not stored."""
+        if not self.has_path(n):
+            raise MissingPathError(
+                f"Path {n} is not stored; only {self.num_stored} paths are cached"
+            )
+        return self.paths[min(n, self.num_stored - 1)]
+
+
+class CachedParse:
+    """The ranked paths through a parse graph, as stored in a `ResultCache`. It
+    supports the methods of `GamutParseGraph` that `Solmization` uses to select and
+    annotate paths, but only at input positions, and only for the paths that were
+    stored. The parse graph itself is not available."""
+
+    def __init__(self, input_positions: list[int], segments: list[CachedSegment]):
+        self.input_positions = input_positions
+        self.segments = segments
+
+    def __repr__(self):
+        return f"<CachedParse of {len(self.input_positions)} notes>"
+
+    @classmethod
+    def from_parse(cls, parse, num_paths: int = 8) -> "CachedParse":
+        """Store the best `num_paths` paths through every segment of a parse graph."""
+        inputs = set(parse.input_positions)
+        segments = []
+        for segment in parse.segments:
+            positions = [
+                pos for pos in range(segment.start, segment.end + 1) if pos in inputs
+            ]
+            count = min(num_paths, segment.num_paths, segment.max_paths or num_paths)
+            paths = []
+            for n in range(count):
+                path = segment.path(n)
+                paths.append([code for pos, code in path if pos in inputs])
+            weights = segment.step(segment.start, max_paths=count)["weights"]
+            segments.append(CachedSegment(positions, paths, weights, segment.num_paths))
+        return cls(list(parse.input_positions), segments)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        segments = self.segments
+        return dict(
+            input_positions=np.array(self.input_positions, dtype=np.int64),
+            lengths=np.array([len(s) for s in segments], dtype=np.int64),
+            path_counts=np.array([s.num_stored for s in segments], dtype=np.int64),
+            # The number of paths can be too large for any integer type
+            num_paths=np.array([str(s.num_paths) for s in segments]),
+            codes=np.array(
+                [code for s in segments for p in s.paths for _, code in p],
+                dtype=np.int32,
+            ),
+            weights=np.array([w for s in segments for w in s.weights], dtype=float),
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "CachedParse":
+        input_positions = arrays["input_positions"].tolist()
+        codes = arrays["codes"].tolist()
+        weights = arrays["weights"].tolist()
+        segments = []
+        position = code_offset = weight_offset = 0
+        for length, count, num_paths in zip(
+            arrays["lengths"].tolist(),
+            arrays["path_counts"].tolist(),
+            arrays["num_paths"].tolist(),
+        ):
+            positions = input_positions[position : position + length]
+            paths = [
+                codes[code_offset + i * length : code_offset + (i + 1) * length]
+                for i in range(count)
+            ]
+            segment_weights = weights[weight_offset : weight_offset + count]
+            segment = CachedSegment(positions, paths, segment_weights, int(num_paths))
+            segments.append(segment)
+            position += length
+            code_offset += count * length
+            weight_offset += count
+        return cls(input_positions, segments)
+
+    def has_paths(self, num_paths: int) -> bool:
+        """Whether the best `num_paths` paths through every segment are stored."""
+        return all(segment.has_path(num_paths - 1) for segment in self.segments)
+
+    def iter_selected_paths(
+        self,
+        selector: Callable[[int, CachedSegment], int],
+        input_only: bool = True,
+        return_orig_node: bool = True,
+    ):
+        if not input_only:
+            raise ValueError("Cached parses only store the paths at input positions")
+        for index, segment in enumerate(self.segments):
+            for node in segment.path(selector(index, segment)):
+                yield node[1] if return_orig_node else node
+
+    def iter_nth_path(self, n: int = 0, **kwargs):
+        selector = lambda index, segment: n
+        return self.iter_selected_paths(selector, **kwargs)
+
+    def iter_best_path(self, **kwargs):
+        return self.iter_nth_path(0, **kwargs)
+
+    def iter_steps(
+        self, input_only: bool = True, return_orig_node: bool = True, max_paths=None
+    ):
+        if not input_only:
+            raise ValueError("Cached parses only store the paths at input positions")
+        for segment in self.segments:
+            num = segment.num_stored if max_paths is None else max_paths
+            for index in range(len(segment)):
+                nodes = [path[index] for path in segment.paths[:num]]
+                if return_orig_node:
+                    nodes = [code for _, code in nodes]
+                yield dict(
+                    nodes=nodes,
+                    weights=segment.weights[:num],
+                    num_paths=segment.num_paths,
+                    pos_in_segment=index,
+                    is_first=index == 0,
+                )
+
+
+class ResultCache:
+    """An on-disk cache of solmization results. Entries are keyed by a hash of the
+    pitches, the gamut (its nodes and all edge weights, see `GamutGraph.fingerprint`)
+    and the parameters of the parse graph, and store the best `num_paths` paths through
+    every segment of the parse graph (see `CachedParse`). A solmization that finds its
+    result in the cache skips the construction of the parse graph and the enumeration
+    of paths entirely. Pass a cache to `solmize` using `solmize(..., cache=True)` or
+    `solmize(..., cache=ResultCache(directory))`.
+
+    The cache holds at most `max_entries` entries; when it is full, the least recently
+    used entries are removed. Entries are written atomically, so several processes can
+    share a cache directory."""
+
+    def __init__(
+        self, directory: str = None, max_entries: int = 1000, num_paths: int = 8
+    ):
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, "results") if CACHE_DIR else ""
+        self.directory = directory
+        self.max_entries = max_entries
+        self.num_paths = num_paths
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        hits, misses = self.hits, self.misses
+        return f"<ResultCache {self.directory} ({hits} hits, {misses} misses)>"
+
+    def __len__(self):
+        return len(self._entries())
+
+    def key(
+        self, pitch_codes: Iterable[PitchCode], gamut_fingerprint: str, **params
+    ) -> str:
+        """A key for the result of solmizing some pitches with a gamut and parameters
+        (the mismatch penalty and all other parameters of the parse graph)."""
+        description = json.dumps(
+            dict(
+                version=RESULT_CACHE_VERSION,
+                pitches=[[int(d), float(a)] for d, a in pitch_codes],
+                gamut=gamut_fingerprint,
+                params=params,
+            ),
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def filename(self, key: str) -> str:
+        return os.path.join(self.directory, f"result-{key}.npz")
+
+    def get(self, key: str) -> Union[CachedParse, None]:
+        """The cached parse for a key, or None. Unreadable entries are ignored."""
+        if not self.directory:
+            return None
+        filename = self.filename(key)
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                parse = CachedParse.from_arrays(data)
+            os.utime(filename)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return parse
+
+    def put(self, key: str, parse) -> None:
+        """Store the paths of a parse graph. Failures to write the cache are ignored."""
+        if not self.directory:
+            return
+        if not isinstance(parse, CachedParse):
+            parse = CachedParse.from_parse(parse, num_paths=self.num_paths)
+        filename = self.filename(key)
+        # Write to a temporary file first so that readers never see partial files
+        tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            np.savez(tmp_filename, **parse.to_arrays())
+            os.replace(tmp_filename, filename)
+            self.evict()
+        except OSError:
+            pass
+
+    def _entries(self) -> list[str]:
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith("result-")
+            and name.endswith(".npz")
+            and not name.endswith(".tmp.npz")
+        ]
+
+    def evict(self):
+        """Remove the least recently used entries until at most `max_entries` remain."""
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        times = {}
+        for entry in entries:
+            try:
+                times[entry] = os.path.getmtime(entry)
+            except OSError:
+                pass
+        for entry in sorted(times, key=times.get)[: len(times) - self.max_entries]:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all entries."""
+        for entry in self._entries():
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
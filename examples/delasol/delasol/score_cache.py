@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import os
+import json
+import hashlib
+import threading
+import music21
+from music21.freezeThaw import StreamFreezer, StreamThawer
+
+# Bump this whenever the way scores are parsed or stored changes
+SCORE_CACHE_VERSION = 1
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """The sha1 hash of the contents of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ScoreCache:
+    """An on-disk cache of scores parsed by music21, used by `Corpus` to avoid parsing
+    the same files on every run. Entries are keyed by the path, modification time, size
+    and a hash of the contents of the file, the parse options and the versions of
+    music21 and of the cache, so changing a file (or music21) invalidates its entry.
+    Scores are stored as music21 pickles (see `music21.freezeThaw`), which load several
+    times faster than parsing MusicXML. Only use a cache directory you trust, as loading
+    a pickle can run arbitrary code.
+
+    Hashing a large file on every lookup is slow, so the hashes are stored in an index
+    (`index.json` in the cache directory) by path, modification time and size. A file
+    is only hashed again when its modification time or size changes.
+
+    The cache holds at most `max_size` bytes; when it is larger, the least recently used
+    entries are removed. Entries are written atomically, so several processes can read
+    and write the same cache directory."""
+
+    def __init__(self, directory: str, max_size: int = 500 * 1024**2):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def __repr__(self):
+        hits, misses = self.hits, self.misses
+        return f"<ScoreCache {self.directory} ({hits} hits, {misses} misses)>"
+
+    def __len__(self):
+        return len(self._entries())
+
+    @property
+    def index_filename(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_filename, "r") as file:
+                index = json.load(file)
+            return index if isinstance(index, dict) else {}
+        except Exception:
+            return {}
+
+    def _write_index(self):
+        # Merge with the index on disk, which other processes may have updated
+        index = {**self._read_index(), **self._index}
+        tmp_filename = (
+            f"{self.index_filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_filename, "w") as file:
+                json.dump(index, file)
+            os.replace(tmp_filename, self.index_filename)
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def file_hash(self, path: str, stat: os.stat_result = None) -> str:
+        """The hash of a file, from the index if the file has not changed since it
+        was last hashed."""
+        path = os.path.abspath(path)
+        if stat is None:
+            stat = os.stat(path)
+        with self._index_lock:
+            if self._index is None:
+                self._index = self._read_index()
+            entry = self._index.get(path)
+            if entry is not None and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+                return entry[2]
+            digest = file_hash(path)
+            self._index[path] = [stat.st_mtime_ns, stat.st_size, digest]
+            self._write_index()
+        return digest
+
+    def key(self, path: str, **kwargs) -> str:
+        """A key for a file parsed with some options (keyword arguments of
+        `music21.converter.parse`)."""
+        stat = os.stat(path)
+        description = json.dumps(
+            dict(
+                version=SCORE_CACHE_VERSION,
+                music21=music21.__version__,
+                path=os.path.abspath(path),
+                mtime=stat.st_mtime_ns,
+                size=stat.st_size,
+                hash=self.file_hash(path, stat=stat),
+                kwargs=kwargs,
+            ),
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def filename(self, key: str) -> str:
+        return os.path.join(self.directory, f"score-{key}.p")
+
+    def get(self, key: str) -> music21.stream.Stream:
+        """The cached score for a key, or None. Unreadable entries are ignored."""
+        filename = self.filename(key)
+        try:
+            thawer = StreamThawer()
+            thawer.open(filename)
+            os.utime(filename)
+        except Exception:
+            # Missing, partial or incompatible pickles are all simply misses
+            self.misses += 1
+            return None
+        self.hits += 1
+        return thawer.stream
+
+    def put(self, key: str, score: music21.stream.Stream) -> None:
+        """Store a score. The score itself is not changed (the freezer copies it).
+        Failures to write the cache are ignored."""
+        filename = self.filename(key)
+        # Write to a temporary file first so that readers never see partial files
+        tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            StreamFreezer(score).write(fmt="pickle", fp=tmp_filename)
+            os.replace(tmp_filename, filename)
+            self.evict()
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def parse(self, path: str, **kwargs) -> music21.stream.Stream:
+        """Parse a file using `music21.converter.parse`, or load it from the cache.
+        Files are parsed with `forceSource=True`, since music21's own cache is not
+        needed."""
+        key = self.key(path, **kwargs)
+        score = self.get(key)
+        if score is None:
+            kwargs.setdefault("forceSource", True)
+            score = music21.converter.parse(path, **kwargs)
+            self.put(key, score)
+        return score
+
+    def _entries(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith("score-") and name.endswith(".p")
+        ]
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is at most
+        `max_size` bytes."""
+        stats = {}
+        for entry in self._entries():
+            try:
+                stats[entry] = os.stat(entry)
+            except OSError:
+                pass
+        size = sum(stat.st_size for stat in stats.values())
+        for entry in sorted(stats, key=lambda entry: stats[entry].st_mtime):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(entry)
+                size -= stats[entry].st_size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all entries and the index."""
+        with self._index_lock:
+            self._index = None
+            for entry in [*self._entries(), self.index_filename]:
+                try:
+                    os.remove(entry)
+                except OSError:
+                    pass
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import os
+import hashlib
+import threading
+import numpy as np
+from collections.abc import Iterable, Iterator
+
+# Directory where shortest path tables are stored. Set the environment variable
+# DELASOL_CACHE_DIR to an empty string to disable persisting tables to disk.
+CACHE_DIR = os.environ.get(
+    "DELASOL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "delasol")
+)
+
+
+def graph_fingerprint(successors: list[Iterable[int]]) -> str:
+    """A fingerprint of the topology of a graph with integer-coded nodes. The order of
+    successors is part of the fingerprint, as it determines the order of paths."""
+    description = ";".join(",".join(map(str, succ)) for succ in successors)
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+class ShortestPathTable:
+    """A table with all (unweighted) shortest paths between all pairs of nodes in a
+    graph whose nodes are numbered 0, ..., N-1. For every source node, the table stores
+    the number of hops to every other node, and the predecessors of every node on the
+    shortest paths from the source. Shortest paths are enumerated from these
+    predecessor lists, in the same order as `networkx.all_shortest_paths`.
+
+    >>> table = ShortestPathTable.from_successors([[1, 2], [3], [3], []])
+    >>> table.distance(0, 3)
+    2
+    >>> list(table.paths(0, 3))
+    [[0, 1, 3], [0, 2, 3]]
+    """
+
+    def __init__(self, hops: np.ndarray, offsets: np.ndarray, predecessors: np.ndarray):
+        self.hops = hops
+        self.offsets = offsets
+        self.predecessor_array = predecessors
+
+        # Nested lists are much faster than numpy arrays for scalar lookups
+        N = len(hops)
+        self._hops = hops.tolist()
+        offsets = offsets.tolist()
+        predecessors = predecessors.tolist()
+        self._predecessors = [
+            [
+                predecessors[offsets[s * N + v] : offsets[s * N + v + 1]]
+                for v in range(N)
+            ]
+            for s in range(N)
+        ]
+
+    def __len__(self):
+        return len(self.hops)
+
+    def __repr__(self):
+        return f"<ShortestPathTable of {len(self)} nodes>"
+
+    @classmethod
+    def from_successors(cls, successors: list[Iterable[int]]) -> "ShortestPathTable":
+        """Compute the table using a breadth-first search from every node."""
+        N = len(successors)
+        hops = np.full((N, N), -1, dtype=np.int32)
+        offsets = [0]
+        predecessors = []
+        for source in range(N):
+            level = 0
+            seen = {source: 0}
+            pred = {source: []}
+            next_level = [source]
+            while next_level:
+                level += 1
+                this_level = next_level
+                next_level = []
+                for v in this_level:
+                    for w in successors[v]:
+                        if w not in seen:
+                            pred[w] = [v]
+                            seen[w] = level
+                            next_level.append(w)
+                        elif seen[w] == level:
+                            pred[w].append(v)
+            for node, distance in seen.items():
+                hops[source, node] = distance
+            for node in range(N):
+                predecessors.extend(pred.get(node, []))
+                offsets.append(len(predecessors))
+        return cls(
+            hops,
+            np.array(offsets, dtype=np.int64),
+            np.array(predecessors, dtype=np.int32),
+        )
+
+    @classmethod
+    def cached(
+        cls, successors: list[Iterable[int]], cache_dir: str = None
+    ) -> "ShortestPathTable":
+        """Load the table for a graph from the cache directory, or compute it and store
+        it there. Failures to write the cache are ignored."""
+        if cache_dir is None:
+            cache_dir = CACHE_DIR
+        if not cache_dir:
+            return cls.from_successors(successors)
+
+        fingerprint = graph_fingerprint(successors)
+        filename = os.path.join(cache_dir, f"shortest-paths-{fingerprint}.npz")
+        if os.path.exists(filename):
+            try:
+                return cls.load(filename)
+            except (OSError, ValueError, KeyError):
+                pass
+        table = cls.from_successors(successors)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.save(filename)
+        except OSError:
+            pass
+        return table
+
+    def save(self, filename: str):
+        # Write to a temporary file first so that readers never see partial files. The
+        # name is unique per process and thread, so concurrent writers do not collide.
+        tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(
+            tmp_filename,
+            hops=self.hops,
+            offsets=self.offsets,
+            predecessors=self.predecessor_array,
+        )
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename: str) -> "ShortestPathTable":
+        with np.load(filename) as data:
+            return cls(data["hops"], data["offsets"], data["predecessors"])
+
+    def distance(self, source: int, target: int) -> int:
+        """The number of hops from source to target, or -1 if it cannot be reached."""
+        return self._hops[source][target]
+
+    def predecessors(self, source: int, node: int) -> list[int]:
+        """The predecessors of a node on the shortest paths from source to that node."""
+        return self._predecessors[source][node]
+
+    def paths(self, source: int, target: int) -> Iterator[list[int]]:
+        """Enumerate all shortest paths from source to target."""
+        if self._hops[source][target] < 0:
+            return
+        pred = self._predecessors[source]
+        stack = [[target, 0]]
+        top = 0
+        while top >= 0:
+            node, i = stack[top]
+            if node == source:
+                yield [n for n, _ in reversed(stack[: top + 1])]
+            if len(pred[node]) > i:
+                stack[top][1] = i + 1
+                top += 1
+                if top == len(stack):
+                    stack.append([pred[node][i], 0])
+                else:
+                    stack[top][:] = [pred[node][i], 0]
+            else:
+                top -= 1
@@ -3,27 +3,41 @@
 # Author: Bas Cornelissen
 # Copyright © 2024 Bas Cornelissen
 # -------------------------------------------------------------------
-from typing import Union, Callable, Any
+from typing import TYPE_CHECKING, Union, Callable, Any
 from collections.abc import Iterable
 from collections import Counter
 from copy import deepcopy
-from music21.spanner import Line
 from music21.stream import Stream
 from music21.pitch import Pitch
 from music21.note import Note
-from music21.tie import Tie
 from music21.clef import Clef
 
 # Local imports
-from .parse_graph import GamutParseGraph, Segment
-from .gamut_graph import GamutGraph, get_gamut, GamutGraphNode, HexachordGraph
+from .parse_graph import GamutParseGraph, Segment, same_topology
+from .profiling import stage
+from .gamut_graph import (
+    GamutGraph,
+    get_gamut,
+    gamut_name,
+    GAMUTS,
+    GamutGraphNode,
+    GamutGraphCode,
+    HexachordGraph,
+)
 from .utils import (
-    set_lyrics_color,
-    annotate_note,
+    PitchCode,
+    pitch_code,
     num_lyrics,
     extract_lyrics,
+    scan_stream,
 )
 
+# The trellis engine, the result cache, MusicXML parts and annotation tables are only
+# imported when used, to keep `import delasol` fast (see benchmarks/import_time.py)
+if TYPE_CHECKING:
+    from .annotation import AnnotationTable
+    from .result_cache import ResultCache, CachedParse
+
 
 def evaluator(syllable: str, target: str) -> str:
     """
@@ -56,7 +70,9 @@ EVALUATION_COLORS = dict(
 )
 
 
-SolmizationInput = Union[Iterable[Pitch], Iterable[Note], Iterable[str]]
+SolmizationInput = Union[
+    Iterable[Pitch], Iterable[Note], Iterable[str], Iterable[PitchCode]
+]
 GamutInput = Union[GamutGraph, str]
 OutputStyle = Union[str, Iterable[str], Callable[[int, int, Pitch], str]]
 
@@ -91,6 +107,7 @@ def by_degree(degree_names: list[str]) -> Callable[[Any], str]:
     def func(degree: int, *args, **kwargs):
         return degree_names[degree - 1]
 
+    func.per_note = False
     return func
 
 
@@ -119,6 +136,14 @@ def format_davantes(
     return symbol
 
 
+# Formatters whose output only depends on the hexachord and degree are memoized per
+# style (see `Solmization.label_table`). Formatters that also depend on the note are
+# marked `per_note`; so are custom formatters, unless they set `per_note = False`.
+format_syllable_subscript.per_note = False
+format_state.per_note = False
+format_state_subscript.per_note = False
+format_davantes.per_note = True
+
 FORMATTERS = {
     "syllable": by_degree(SYLLABLES),
     "syllable-subscript": format_state_subscript,
@@ -131,6 +156,41 @@ FORMATTERS = {
 }
 
 
+def get_formatter(style: OutputStyle) -> Callable[..., str]:
+    """Return the function that formats the output for a given style: the name of one of
+    the `FORMATTERS`, a list of names for the 7 degrees, or a function."""
+    if callable(style):
+        return style
+    elif isinstance(style, str) and style in FORMATTERS:
+        return FORMATTERS[style]
+    elif isinstance(style, Iterable):
+        return by_degree(style)
+    else:
+        raise ValueError(f"Invalid style input")
+
+
+def to_pitches(input: SolmizationInput) -> list[Pitch]:
+    """Convert the input of a solmization to a list of pitches."""
+    if isinstance(input, Stream):
+        raise ValueError("Use StreamSolmation for stream inputs")
+    elif isinstance(input, Iterable):
+        if isinstance(input[0], Pitch):
+            return [Pitch(p) for p in input]
+        elif isinstance(input[0], Note):
+            return [Pitch(n.pitch) for n in input]
+        elif isinstance(input[0], str):
+            return [Pitch(p) for p in input]
+        elif isinstance(input[0], tuple):
+            # Pitch codes (see `utils.pitch_code`) are used as they are
+            return list(input)
+        else:
+            raise ValueError(
+                "Unsupported input type: you can pass an iterable of pitches, notes, pitch strings or pitch codes"
+            )
+    else:
+        raise ValueError("You must pass an input.")
+
+
 class Solmization:
 
     def __init__(
@@ -141,66 +201,250 @@ class Solmization:
         prune_parse: bool = True,
         gamut_kws: dict = {},
         parse_graph_kws: dict = {},
+        engine: str = "graph",
+        cache: Union[bool, str, "ResultCache"] = None,
     ):
+        """Solmize a sequence of pitches. The `graph` engine builds a parse graph
+        containing all possible solmizations. The `trellis` engine only computes the best
+        solmization (identical to the best path in the parse graph), but is much faster
+        on long inputs.
+
+        With the graph engine, the best paths can be stored in an on-disk `cache` (a
+        `ResultCache`, a cache directory, or True for the default directory). If the
+        same pitches were solmized before with the same gamut and parameters, the parse
+        graph is not built at all and `parse` is a `CachedParse` instead.
+
+        Solmizations can be created concurrently from multiple threads: all shared
+        state (the gamut registry, frozen gamuts and their memoized shortest paths) is
+        either read-only or safe to update concurrently. A single Solmization object
+        should not be used by several threads at once."""
         if isinstance(gamut, str):
-            gamut = get_gamut(gamut, **gamut_kws)
+            with stage("gamut", gamut=gamut):
+                gamut = get_gamut(gamut, **gamut_kws)
         if not isinstance(gamut, GamutGraph):
             raise ValueError("No gamut was specified.")
-        if isinstance(input, Stream):
-            raise ValueError("Use StreamSolmation for stream inputs")
-        elif isinstance(input, Iterable):
-            if isinstance(input[0], Pitch):
-                pitches = [Pitch(p) for p in input]
-            elif isinstance(input[0], Note):
-                pitches = [Pitch(n.pitch) for n in input]
-            elif isinstance(input[0], str):
-                pitches = [Pitch(p) for p in input]
-            else:
-                raise ValueError(
-                    "Unsupported input type: you can pass an iterable of pitches, notes or pitch strings"
-                )
-        else:
-            raise ValueError("You must pass an input.")
-
-        self._path = None
+        pitches = to_pitches(input)
+        self._codes = None
+        self._label_tables = {}
         self.gamut = gamut
         self.pitches = pitches
-        self.parse = GamutParseGraph(
+        self.engine = engine
+        self.mismatch_penalty = mismatch_penalty
+        self.prune_parse = prune_parse
+        self.parse_graph_kws = parse_graph_kws
+        if cache is True or isinstance(cache, str):
+            from .result_cache import ResultCache
+
+            cache = ResultCache() if cache is True else ResultCache(cache)
+        self.cache = cache if cache is not False else None
+        self.parse = None
+        self.trellis = None
+        if engine == "graph":
+            self.parse = self._build_parse()
+        elif engine == "trellis":
+            from .trellis import Trellis
+
+            with stage("trellis", length=len(self.pitches)):
+                self.trellis = Trellis(
+                    self.gamut,
+                    [pitch_code(p) for p in self.pitches],
+                    mismatch_penalty=mismatch_penalty,
+                )
+        else:
+            raise ValueError(f"Unknown engine '{engine}': use 'graph' or 'trellis'")
+
+    def _build_parse(
+        self, use_cache: bool = True
+    ) -> Union[GamutParseGraph, "CachedParse"]:
+        """Build the parse graph, or load its paths from the result cache."""
+        key = None
+        if self.cache is not None and use_cache:
+            key = self.cache.key(
+                [pitch_code(p) for p in self.pitches],
+                self.gamut.fingerprint,
+                mismatch_penalty=self.mismatch_penalty,
+                prune=self.prune_parse,
+                **self.parse_graph_kws,
+            )
+            with stage("cache") as record:
+                parse = self.cache.get(key)
+                if record is not None:
+                    record["hit"] = parse is not None
+            if parse is not None:
+                return parse
+
+        parse = GamutParseGraph(
             self.gamut,
             self.pitches,
-            mismatch_penalty=mismatch_penalty,
-            prune=prune_parse,
-            **parse_graph_kws,
+            mismatch_penalty=self.mismatch_penalty,
+            prune=self.prune_parse,
+            **self.parse_graph_kws,
+        )
+        if key is not None:
+            self.cache.put(key, parse)
+        return parse
+
+    def _is_cached_parse(self) -> bool:
+        """Whether the parse was loaded from the result cache (see `CachedParse`)."""
+        if self.cache is None or self.parse is None:
+            return False
+        from .result_cache import CachedParse
+
+        return isinstance(self.parse, CachedParse)
+
+    def _require_paths(self, num_paths: int = None):
+        """Make sure the best `num_paths` paths (or all paths, if None) are available.
+        A cached parse only stores the best few paths; if more are needed, the parse
+        graph is built after all."""
+        if not self._is_cached_parse():
+            return
+        if num_paths is None:
+            available = all(s.num_stored == s.num_paths for s in self.parse.segments)
+        else:
+            available = self.parse.has_paths(num_paths)
+        if not available:
+            self.parse = self._build_parse(use_cache=False)
+
+    def update(self, input: SolmizationInput, start: int, stop: int):
+        """Update the solmization after the notes `start, ..., stop - 1` of the input have
+        been edited: replaced by any number of new notes, giving the new `input`. With the
+        graph engine only the part of the parse graph around the edit is rebuilt (see
+        `ParseGraph.update`); the trellis engine is simply run again. A cached parse is
+        replaced by a new parse graph."""
+        pitches = to_pitches(input)
+        if self._is_cached_parse():
+            self.pitches = pitches
+            self.parse = self._build_parse()
+        elif self.parse is not None:
+            self.parse.update(pitches, start, stop, prune=self.prune_parse)
+        else:
+            from .trellis import Trellis
+
+            self.trellis = Trellis(
+                self.gamut,
+                [pitch_code(p) for p in pitches],
+                mismatch_penalty=self.mismatch_penalty,
+            )
+        self.pitches = pitches
+        self._codes = None
+
+    def reweight(
+        self,
+        gamut: GamutInput = None,
+        mismatch_penalty: float = None,
+        mutation_weight: float = None,
+        loop_weight: float = None,
+        fa_super_la_weight: float = None,
+        step_weight: float = None,
+        hexachord_weights=None,
+    ):
+        """Solmize the same pitches with other weights, without rebuilding the parse
+        graph (see `GamutParseGraph.reweight`). The weights are those of `solmize`; the
+        gamut is constructed again with the new weights, unless a `gamut` with the same
+        nodes and edges is passed. Only the weights can change, so options that change
+        the gamut itself (like `fa_super_la`) are not supported.
+
+        >>> pitches = ["C4", "D4", "E4", "F4", "G4", "A4", "B-4", "A4"]
+        >>> solmization = solmize(pitches, gamut="soft-continental")
+        >>> solmization.output()
+        ['ut', 're', 'mi', 'fa', 'sol', 'la', 'fa', 'la']
+        >>> solmization.reweight(mutation_weight=0.5)
+        >>> solmization.output()
+        ['sol', 're', 'mi', 'fa', 're', 'mi', 'fa', 'la']
+        """
+        gamut_kws = gamut_options(
+            mutation_weight=mutation_weight,
+            loop_weight=loop_weight,
+            fa_super_la_weight=fa_super_la_weight,
+            step_weight=step_weight,
+            hexachord_weights=hexachord_weights,
         )
+        if isinstance(gamut, str):
+            gamut = get_gamut(gamut, **gamut_kws)
+        elif gamut is None:
+            names = [name for name, cls in GAMUTS.items() if type(self.gamut) is cls]
+            if len(names) == 0:
+                raise ValueError("Please pass the reweighted gamut")
+            gamut = get_gamut(names[0], **gamut_kws)
+        if mismatch_penalty is not None:
+            self.mismatch_penalty = mismatch_penalty
+
+        if self.trellis is not None:
+            from .trellis import Trellis
+
+            if not same_topology(gamut, self.gamut):
+                raise ValueError("The gamut should have the same nodes and edges")
+            self.gamut = gamut
+            self.trellis = Trellis(
+                self.gamut,
+                [pitch_code(p) for p in self.pitches],
+                mismatch_penalty=self.mismatch_penalty,
+            )
+        elif self._is_cached_parse():
+            if not same_topology(gamut, self.gamut):
+                raise ValueError("The gamut should have the same nodes and edges")
+            self.gamut = gamut
+            self.parse = self._build_parse()
+        else:
+            self.parse.reweight(gamut, mismatch_penalty=self.mismatch_penalty)
+            self.gamut = gamut
+        self._codes = None
 
     @property
-    def path(self):
+    def path(self) -> list[GamutGraphNode]:
         """Return the solmization path, defaults to the best solmization path."""
-        if self._path is None:
+        return [self.gamut.node_list[code] for code in self.codes]
+
+    @property
+    def codes(self) -> list[GamutGraphCode]:
+        """The solmization path as a list of codes of nodes in the gamut."""
+        if self._codes is None:
             self.select("best")
-        return self._path
+        return self._codes
 
     def select(
         self, path: Union[str, Iterable[int], Callable[[int, Segment], int]] = "best"
     ) -> None:
         """Select a solmization path"""
+        with stage("paths") as record:
+            try:
+                self._select(path)
+            except LookupError:
+                # The selected paths may not all be stored in a cached parse (this is
+                # a `MissingPathError`)
+                if not self._is_cached_parse():
+                    raise
+                self._require_paths(None)
+                self._select(path)
+            if record is not None and self.parse is not None:
+                num_paths = [segment.num_paths for segment in self.parse.segments]
+                record["segments"] = len(num_paths)
+                record["max_paths_per_segment"] = max(num_paths, default=0)
+                record["total_paths"] = sum(num_paths)
+
+    def _select(self, path):
+        if self.trellis is not None:
+            if path != "best":
+                raise ValueError("The trellis engine only computes the best path")
+            self._codes = self.trellis.best_path()
+            return
+
+        opts = dict(input_only=True, return_orig_node=False)
+        if path == "worst":
+            self._require_paths(None)
         if path == "best":
-            self._path = list(self.parse.iter_best_path(input_only=True))
+            nodes = self.parse.iter_best_path(**opts)
+            self._codes = [code for _, code in nodes]
         elif path == "worst":
-            self._path = self.parse.iter_nth_path(
-                99,
-                input_only=True,
-            )
+            nodes = self.parse.iter_nth_path(99, **opts)
+            self._codes = [code for _, code in nodes]
         elif isinstance(path, Iterable) and isinstance(path[0], int):
-            path = lambda index, segment: path[index]
+            indices = path
+            path = lambda index, segment: indices[index]
 
         if callable(path):
-            self._path = []
-            for node in self.parse.iter_selected_paths(
-                path,
-                input_only=True,
-            ):
-                self.path.append(node)
+            nodes = self.parse.iter_selected_paths(path, **opts)
+            self._codes = [code for _, code in nodes]
 
     def match(
         self, targets: Iterable[str], style: OutputStyle = "syllable"
@@ -210,28 +454,29 @@ class Solmization:
 
     def output(
         self,
-        nodes: Iterable[GamutGraphNode] = None,
+        nodes: Iterable[Union[GamutGraphNode, GamutGraphCode]] = None,
         style: OutputStyle = "syllable",
         **kwargs,
     ) -> list[str]:
-        """Output labels for a given list of nodes."""
+        """Output labels for a given list of nodes (or codes of nodes) in the gamut."""
         if nodes is None:
-            nodes = self.path
-        if callable(style):
-            formatter = style
-        elif style in FORMATTERS:
-            formatter = FORMATTERS[style]
-        elif isinstance(style, Iterable):
-            formatter = by_degree(style)
+            codes = self.codes
         else:
-            raise ValueError(f"Invalid style input")
-
+            codes = [
+                self.gamut.codes[node] if isinstance(node, tuple) else node
+                for node in nodes
+            ]
+        table = self.label_table(style)
+        if table is not None:
+            return [table[code] for code in codes]
+
+        formatter = get_formatter(style)
         output = []
-        for hex, pitch in nodes:
-            degree = self.gamut.nodes[(hex, pitch)]["degree"]
+        for code in codes:
+            hex, pitch = self.gamut.node_list[code]
             output.append(
                 formatter(
-                    degree=degree,
+                    degree=self.gamut.degrees[code],
                     pitch=pitch,
                     hexachord=self.gamut.hexachords[hex],
                     solmization=self,
@@ -240,6 +485,29 @@ class Solmization:
             )
         return output
 
+    def label_table(self, style: OutputStyle = "syllable") -> Union[list[str], None]:
+        """The labels of all nodes in the gamut for a style, indexed by node code. The
+        table is computed once per style. Returns None if the labels depend on the note
+        (see `FORMATTERS`), and then have to be formatted for every note separately."""
+        key = style if isinstance(style, str) or callable(style) else tuple(style)
+        if key not in self._label_tables:
+            formatter = get_formatter(style)
+            if getattr(formatter, "per_note", True):
+                self._label_tables[key] = None
+            else:
+                self._label_tables[key] = [
+                    formatter(
+                        degree=degree,
+                        pitch=pitch,
+                        hexachord=self.gamut.hexachords[hex],
+                        solmization=self,
+                    )
+                    for (hex, pitch), degree in zip(
+                        self.gamut.node_list, self.gamut.degrees
+                    )
+                ]
+        return self._label_tables[key]
+
     def evaluate(
         self,
         targets: Iterable[str],
@@ -254,13 +522,111 @@ class Solmization:
         if nodes is None:
             nodes = self.path
         if predictions is None:
-            predictions = self.output(nodes, style=style)
+            with stage("output", notes=len(nodes)):
+                predictions = self.output(nodes, style=style)
         evaluation = [evaluator(pred, targ) for pred, targ in zip(predictions, targets)]
         if return_counts:
             return dict(Counter(evaluation))
         else:
             return evaluation
 
+    def annotation_table(
+        self,
+        test_style: str = None,
+        output_style: str = None,
+        targets: Iterable[str] = None,
+        offset: int = 0,
+        best_only: bool = False,
+        max_num_paths: int = 4,
+        show_more_paths: bool = True,
+        show_weights: bool = True,
+        show_segments: bool = True,
+        show_all_segments: bool = True,
+        grey_lyrics_num: int = None,
+        evaluator: Callable = evaluator,
+        colors: dict[str, str] = EVALUATION_COLORS,
+        notes: Iterable[Note] = None,
+    ) -> "AnnotationTable":
+        """Collect the annotations of the solmization in a table: the syllables of the
+        best paths (in lyric lines `offset + 1, offset + 2, ...`), colored by their
+        evaluation against the `targets`, and the segments of the parse. The table can
+        be applied to music21 notes or written to a MusicXML file. The `notes` are only
+        needed for output styles that depend on the note."""
+        if test_style is None:
+            test_style = "syllable"
+        if output_style is None:
+            output_style = "state-subscript"
+        if best_only:
+            max_num_paths = 1
+            show_segments = False
+            show_more_paths = False
+            show_weights = False
+
+        from .annotation import AnnotationTable
+
+        table = AnnotationTable()
+
+        # Local helper function to overline segments
+        def overline_segment(start, end, n_paths):
+            if show_segments and end > start and (show_all_segments or n_paths > 1):
+                table.add_segment(start, end)
+
+        with stage("annotation_table") as record:
+            self._require_paths(max_num_paths)
+            if self.parse is not None:
+                steps = self.parse.iter_steps(
+                    return_orig_node=False, max_paths=max_num_paths
+                )
+            elif best_only:
+                best_path = self.codes
+                steps = (
+                    dict(nodes=[(pos, code)], num_paths=1, is_first=pos == 1)
+                    for pos, code in zip(self.trellis.input_positions, best_path)
+                )
+            else:
+                raise ValueError("The trellis engine can only annotate the best path")
+            if notes is None:
+                notes = [None] * len(self.pitches)
+
+            segment_start = 0
+            pos = -1
+            for pos, (step, note) in enumerate(zip(steps, notes)):
+                n_paths = step["num_paths"]
+                num_ranks = min(max_num_paths, n_paths, len(step["nodes"]))
+                codes = [code for _, code in step["nodes"][:num_ranks]]
+                kwargs = dict(note=note) if note is not None else {}
+                annotations = self.output(codes, style=output_style, **kwargs)
+                if targets is not None:
+                    predictions = self.output(codes, style=test_style, **kwargs)
+                for rank in range(num_ranks):
+                    annot = annotations[rank]
+                    if show_weights and step["is_first"]:
+                        annot = f"[w={step['weights'][rank]:.1f}] {annot}"
+                    color = None
+                    if targets is not None:
+                        result = evaluator(predictions[rank], targets[pos])
+                        color = colors.get(result, "black")
+                    table.add_lyric(pos, annot, number=rank + offset + 1, color=color)
+
+                # Show the number of hidden paths and overline segments
+                if step["is_first"]:
+                    if show_more_paths and n_paths > max_num_paths:
+                        table.add_lyric(pos, f"({n_paths - max_num_paths} more paths)")
+                    overline_segment(segment_start, pos - 1, n_paths)
+                    segment_start = pos
+
+            # Overline possible final segment
+            if pos >= 0:
+                overline_segment(segment_start, pos, n_paths)
+            if record is not None:
+                record["lyrics"] = len(table.lyrics)
+                record["segments"] = len(table.segments)
+
+        # Gray out lyrics if needed
+        if grey_lyrics_num is not None:
+            table.color_line(grey_lyrics_num, "#999999")
+        return table
+
 
 class StreamSolmization(Solmization):
     def __init__(
@@ -271,7 +637,7 @@ class StreamSolmization(Solmization):
         in_place: bool = True,
         **kwargs,
     ):
-        self.stream = stream if in_place else deepcopy(stream)
+        self.stream = stream
         if self.stream.hasPartLikeStreams():
             if len(self.stream.parts) >= 2:
                 print(
@@ -279,15 +645,39 @@ class StreamSolmization(Solmization):
                 )
                 self.stream = self.stream.parts[0]
         self.style = style
-        self.clef = self.stream.flat.clef
+        self.in_place = in_place
+        self.clef, key, self.notes = scan_stream(self.stream)
         if gamut is None:
-            key = self.stream.flat.keySignature
-            gamut = get_gamut(style=self.style, key=key)
-        self.notes = [
-            note for note in self.stream.flat.notes if note.tie != Tie("stop")
-        ]
+            with stage("gamut", style=self.style):
+                gamut_kws = kwargs.get("gamut_kws", {})
+                gamut = get_gamut(style=self.style, key=key, **gamut_kws)
         super().__init__(self.notes, gamut=gamut, **kwargs)
 
+    def update(self, notes: Iterable[Note], start: int, stop: int):
+        """Update the solmization after the notes `start, ..., stop - 1` have been
+        edited (see `Solmization.update`). Pass all (untied) notes of the edited stream."""
+        self.notes = list(notes)
+        super().update(self.notes, start, stop)
+
+    def copy_stream(self):
+        """Replace the stream by a copy, unless the solmization works in place, and
+        use the corresponding notes of the copy. Annotating a solmization that is not
+        in place makes this copy, so that the original stream is never changed.
+
+        This is a full deep copy of the stream: the annotated notes and the lines over
+        segments have to be part of a stream that is independent of the original, and
+        music21 elements (notes, spanners) refer to the streams that contain them. The
+        copy is only postponed until the stream is annotated. The notes are mapped to
+        their copies using the memo of the deep copy, so neither stream is scanned
+        again."""
+        if self.in_place:
+            return
+        memo = {}
+        stream = deepcopy(self.stream, memo)
+        self.stream = stream
+        self.notes = [memo.get(id(note), note) for note in self.notes]
+        self.in_place = True
+
     def evaluate(
         self,
         target_lyrics: int = None,
@@ -306,10 +696,12 @@ class StreamSolmization(Solmization):
                 )
             targets = extract_lyrics(self.notes, target_lyrics)
 
-        predictions = []
-        for note, node in zip(self.notes, self.path):
-            pred = self.output([node], style=style, note=note)[0]
-            predictions.append(pred)
+        codes = self.codes
+        with stage("output", notes=len(codes)):
+            predictions = [
+                self.output([code], style=style, note=note)[0]
+                for note, code in zip(self.notes, codes)
+            ]
 
         return super().evaluate(targets, predictions=predictions, **kwargs)
 
@@ -320,99 +712,40 @@ class StreamSolmization(Solmization):
         targets: Iterable[str] = None,
         target_lyrics: int = None,
         offset: int = None,
-        best_only: bool = False,
-        max_num_paths: int = 4,
-        show_more_paths: bool = True,
-        show_weights: bool = True,
-        show_segments: bool = True,
-        show_all_segments: bool = True,
-        grey_lyrics_num: int = None,
-        evaluator: Callable = evaluator,
-        colors: dict[str, str] = EVALUATION_COLORS,
+        **kwargs,
     ):
-        """Annotate a stream with solmization syllables."""
-        if test_style is None:
-            test_style = "syllable"
-        if output_style is None:
-            output_style = "state-subscript"
-        if best_only:
-            max_num_paths = 1
-            show_segments = False
-            show_more_paths = False
-            show_weights = False
+        """Annotate a stream with solmization syllables. The annotations are collected
+        in a table first (see `Solmization.annotation_table`) and then added to the
+        notes in a single pass."""
+        self.copy_stream()
         if offset is None:
             offset = num_lyrics(self.stream)
-        notes = self.notes
         if target_lyrics is not None:
-            targets = extract_lyrics(notes, target_lyrics)
-
-        # Local helper function to overline segments
-        def overline_segment(segment_notes, n_paths):
-            if (
-                show_segments
-                and len(segment_notes) > 1
-                and (show_all_segments or n_paths > 1)
-            ):
-                line = Line(segment_notes)
-                line.lineType = "dotted"
-                self.stream.insert(0, line)
-
-        segment_notes = []
-        for pos, (step, note) in enumerate(zip(self.parse.iter_steps(), notes)):
-            n_paths = len(step["nodes"])
-            kwargs = dict(note=note)
-            predictions = self.output(step["nodes"], style=test_style, **kwargs)
-            annotations = self.output(step["nodes"], style=output_style, **kwargs)
-            for rank in range(min(max_num_paths, n_paths)):
-
-                # Annotate the note
-                annot = annotations[rank]
-                pred = predictions[rank]
-                if show_weights and step["is_first"]:
-                    annot = f"[w={step['weights'][rank]:.1f}] {annot}"
-                opts = dict(number=rank + offset + 1)
-                if targets is not None:
-                    result = evaluator(pred, targets[pos])
-                    opts["color"] = colors.get(result, "black")
-                annotate_note(note, annot, **opts)
-
-            # Show the number of hidden paths and overline segments
-            if step["is_first"]:
-                if show_more_paths and n_paths > max_num_paths:
-                    note.addLyric(f"({n_paths - max_num_paths} more paths)")
-                overline_segment(segment_notes, n_paths)
-                segment_notes = []
-
-            # Add next notes to segment
-            segment_notes.append(note)
-
-        # Overline possible final segment and gray out lyrics if needed
-        overline_segment(segment_notes, n_paths)
-        if grey_lyrics_num is not None:
-            set_lyrics_color(notes, grey_lyrics_num, "#999999")
+            targets = extract_lyrics(self.notes, target_lyrics)
+        table = self.annotation_table(
+            test_style=test_style,
+            output_style=output_style,
+            targets=targets,
+            offset=offset,
+            notes=self.notes,
+            **kwargs,
+        )
+        with stage("annotate", notes=len(self.notes)):
+            table.apply(self.notes, self.stream)
 
 
-def solmize(
-    input,
-    style: str = None,
-    gamut: GamutInput = None,
-    prune_parse: bool = True,
-    mismatch_penalty: float = None,
+def gamut_options(
     mutation_weight: float = None,
     loop_weight: float = None,
     fa_super_la: bool = None,
     fa_super_la_weight: float = None,
     step_weight: float = None,
     hexachord_weights=None,
-    in_place: bool = True,
-) -> Solmization:
-    """A convenience function that creates a Solmization object depending on the input type."""
-    opts = {}
-
+) -> dict:
+    """Keyword arguments of a gamut for the given weights (only those that are set)."""
     gamut_kws = {}
     if mutation_weight is not None:
         gamut_kws["mutation_weight"] = mutation_weight
-    opts["gamut_kws"] = gamut_kws
 
     hex_kws = {}
     if loop_weight is not None:
@@ -425,17 +758,123 @@ def solmize(
         hex_kws["step_weight"] = step_weight
     if hexachord_weights is not None:
         hex_kws["weights"] = hexachord_weights
-    opts["gamut_kws"]["hexachord_kws"] = hex_kws
+    gamut_kws["hexachord_kws"] = hex_kws
+    return gamut_kws
+
+
+def solmize(
+    input,
+    style: str = None,
+    gamut: GamutInput = None,
+    prune_parse: bool = True,
+    mismatch_penalty: float = None,
+    mutation_weight: float = None,
+    loop_weight: float = None,
+    fa_super_la: bool = None,
+    fa_super_la_weight: float = None,
+    step_weight: float = None,
+    hexachord_weights=None,
+    max_paths: int = None,
+    beam_width: int = None,
+    engine: str = "graph",
+    in_place: bool = True,
+    cache: Union[bool, str, "ResultCache"] = None,
+) -> Solmization:
+    """A convenience function that creates a Solmization object depending on the input
+    type: a stream, a part loaded with `musicxml.load_musicxml`, or a sequence of
+    pitches, notes, pitch strings or pitch codes. Results are only cached on disk if a
+    `cache` is passed (see `Solmization`)."""
+    opts = {}
+    opts["gamut_kws"] = gamut_options(
+        mutation_weight=mutation_weight,
+        loop_weight=loop_weight,
+        fa_super_la=fa_super_la,
+        fa_super_la_weight=fa_super_la_weight,
+        step_weight=step_weight,
+        hexachord_weights=hexachord_weights,
+    )
 
     if mismatch_penalty is not None:
         opts["mismatch_penalty"] = mismatch_penalty
     if prune_parse is not None:
         opts["prune_parse"] = prune_parse
+    parse_graph_kws = {}
+    if max_paths is not None:
+        parse_graph_kws["max_paths"] = max_paths
+    if beam_width is not None:
+        parse_graph_kws["beam_width"] = beam_width
+    if parse_graph_kws:
+        opts["parse_graph_kws"] = parse_graph_kws
+    opts["engine"] = engine
+    if cache is not None:
+        opts["cache"] = cache
+
+    from .musicxml import MusicXMLPart
 
     if isinstance(input, Stream):
         solmization = StreamSolmization(
             input, style=style, gamut=gamut, in_place=in_place, **opts
         )
+    elif isinstance(input, MusicXMLPart):
+        # Use the gamut for the key signature of the part, as for streams
+        if gamut is None and input.sharps is not None:
+            gamut = gamut_name(style, input.sharps)
+        solmization = Solmization(input.pitch_codes, gamut=gamut, **opts)
     else:
         solmization = Solmization(input, gamut=gamut, **opts)
     return solmization
+
+
+# Keyword arguments of `solmize` in a worker process of `solmize_many`
+_WORKER_KWARGS = {}
+
+
+def _init_worker(kwargs: dict):
+    global _WORKER_KWARGS
+    _WORKER_KWARGS = kwargs
+
+
+def _solmize_one(input, output: OutputStyle = None, **kwargs):
+    solmization = solmize(input, **kwargs)
+    if output is not None:
+        return solmization.output(style=output)
+    return solmization
+
+
+def _solmize_in_worker(input):
+    return _solmize_one(input, **_WORKER_KWARGS)
+
+
+def solmize_many(
+    inputs: Iterable,
+    workers: int = None,
+    output: OutputStyle = None,
+    chunksize: int = 16,
+    **kwargs,
+) -> list[Union[Solmization, list[str]]]:
+    """Solmize many inputs with the same options, see `solmize`. The results are
+    returned in the order of the inputs: Solmization objects or, if an `output` style is
+    given, the syllables of the best paths.
+
+    The gamut is constructed only once (see `GAMUT_REGISTRY`), and the shortest paths
+    between pitches are memoized by the gamut and shared by all parse graphs. With
+    `workers`, the inputs are solmized in that many processes, in chunks of `chunksize`
+    inputs. Every process then constructs the gamut once. Note that Solmization objects
+    have to be copied back from the worker processes, so the speedup is largest when
+    only the output is returned.
+
+    >>> inputs = [["G3", "A3"], ["C4", "D4"]]
+    >>> solmize_many(inputs, gamut="hard-continental", output="syllable")
+    [['sol', 'la'], ['fa', 'sol']]
+    """
+    inputs = list(inputs)
+    if workers is None or workers <= 1 or len(inputs) <= 1:
+        return [_solmize_one(input, output=output, **kwargs) for input in inputs]
+
+    kwargs = dict(kwargs, output=output)
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(kwargs,)
+    ) as executor:
+        return list(executor.map(_solmize_in_worker, inputs, chunksize=chunksize))
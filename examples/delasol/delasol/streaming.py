@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import numpy as np
+from typing import Union
+from music21.pitch import Pitch
+from music21.note import Note
+
+from .gamut_graph import GamutGraph, GamutGraphCode, get_gamut
+from .solmization import OutputStyle, get_formatter
+from .trellis import Trellis
+from .utils import pitch_code
+
+StreamingInput = Union[Pitch, Note, str, int]
+
+
+class StreamingSolmizer:
+    """Solmize a stream of pitches that arrive one at a time, for example from live MIDI
+    input. Every call to `push` extends a trellis (see `Trellis`) by one pitch. As soon as
+    all candidate paths pass through a single node, the best path up to that node can no
+    longer change: the segment is closed and its syllables are returned. Only the layers
+    of the currently open segment are kept in memory. At the end of the stream, `close`
+    returns the syllables of the last segment.
+
+    The syllables are identical to those of the best path computed by `Solmization`.
+
+    >>> solmizer = StreamingSolmizer("hard-continental", style="state")
+    >>> [solmizer.push(pitch) for pitch in ["G3", "A3", "B3"]]
+    [[], [], []]
+    >>> solmizer.push("C4")
+    ['ut4', 're4', 'mi4', 'fa4']
+    >>> [solmizer.push(pitch) for pitch in ["D4", "A4"]]
+    [[], ['re5']]
+    >>> solmizer.close()
+    ['la5']
+    """
+
+    def __init__(
+        self,
+        gamut: Union[GamutGraph, str],
+        mismatch_penalty: float = 2,
+        style: OutputStyle = "syllable",
+        gamut_kws: dict = {},
+    ):
+        if isinstance(gamut, str):
+            gamut = get_gamut(gamut, **gamut_kws)
+        if not isinstance(gamut, GamutGraph):
+            raise ValueError("No gamut was specified.")
+        self.gamut = gamut
+        self.style = style
+        self.formatter = get_formatter(style)
+        if getattr(self.formatter, "per_note", True):
+            # Such styles need the notes (and clef) of a score, see `Solmization.output`
+            raise ValueError(
+                f"Output style {style!r} depends on the notes, which are not available "
+                "when streaming pitches (set `per_note = False` on custom formatters "
+                "that only use the hexachord and degree)"
+            )
+        self.trellis = Trellis(gamut, [], mismatch_penalty=mismatch_penalty)
+        self.reset()
+
+    def __repr__(self):
+        return (
+            f"<StreamingSolmizer with {self.num_pushed} pitches, "
+            f"{self.num_emitted} emitted>"
+        )
+
+    def reset(self):
+        """Start a new stream."""
+        self.num_pushed = 0
+        self.num_emitted = 0
+        self._prev_value = None
+        self._costs = None
+        # Layers of the open segment: (nodes, parent rows, pitch or None). The pitch is
+        # set for layers that correspond to input pitches that have not been emitted.
+        self._layers = []
+
+    @property
+    def open_length(self) -> int:
+        """The number of pitches in the open segment that have not been emitted."""
+        return self.num_pushed - self.num_emitted
+
+    @property
+    def width(self) -> int:
+        """The number of candidate nodes for the last pitch."""
+        return 0 if len(self._layers) == 0 else len(self._layers[-1][0])
+
+    def push(self, pitch: StreamingInput) -> list[str]:
+        """Add a pitch to the stream, and return the syllables of all pitches whose
+        solmization has become final."""
+        if isinstance(pitch, Note):
+            pitch = pitch.pitch
+        pitch = Pitch(pitch)
+        value = pitch_code(pitch)
+        first_new = len(self._layers)
+        if self._prev_value is None:
+            nodes, self._costs = self.trellis.first_layer(value)
+            self._layers.append((nodes, np.full(len(nodes), -1), pitch))
+        else:
+            nodes = self._layers[-1][0]
+            new_layers, self._costs = self.trellis.advance(
+                nodes, self._costs, self._prev_value, value
+            )
+            self._layers.extend((nodes, parents, None) for nodes, parents in new_layers)
+            self._layers[-1] = (*new_layers[-1], pitch)
+        self._prev_value = value
+        self.num_pushed += 1
+
+        # Close the segment at the last new layer with a single node, if any. (The first
+        # layer of the open segment always has a single node, once it has been emitted.)
+        for index in range(len(self._layers) - 1, first_new - 1, -1):
+            if len(self._layers[index][0]) == 1:
+                return self._emit(index, 0)
+        return []
+
+    def close(self) -> list[str]:
+        """End the stream: return the syllables of the best path through the open
+        segment and start a new stream."""
+        if len(self._layers) == 0:
+            return []
+        # The first node with the lowest cost is the best one, see `Trellis.best_path`
+        output = self._emit(len(self._layers) - 1, int(np.argmin(self._costs)))
+        self.reset()
+        return output
+
+    def _emit(self, index: int, row: int) -> list[str]:
+        """Emit the syllables on the best path to a node in one of the layers, and drop
+        all layers before that node. The node becomes the root of the open segment."""
+        layers = self._layers[: index + 1]
+        codes = Trellis.backtrack([(nodes, parents) for nodes, parents, _ in layers], row)
+        output = []
+        for code, (_, _, pitch) in zip(codes, layers):
+            if pitch is not None:
+                output.append(self.format(code, pitch))
+        self.num_emitted += len(output)
+
+        # The node becomes the only node in the first layer of the open segment. Since
+        # it is the only node in its layer, all nodes in the next layer have parent 0.
+        root = np.array([codes[-1]])
+        self._layers = [(root, np.full(1, -1), None)] + self._layers[index + 1 :]
+        return output
+
+    def format(self, code: GamutGraphCode, pitch: Pitch) -> str:
+        hex, _ = self.gamut.node_list[code]
+        return self.formatter(
+            degree=self.gamut.degrees[code],
+            pitch=pitch,
+            hexachord=self.gamut.hexachords[hex],
+            solmization=self,
+        )
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+import numpy as np
+from collections.abc import Iterable
+
+from .gamut_graph import GamutGraph, GamutGraphCode
+from .utils import PitchCode
+
+
+class Trellis:
+    """A trellis (Viterbi) engine that computes the best solmization path without
+    building a parse graph. The gamut's edge weights are stored in a dense cost matrix,
+    and every position of the parse is described by a mask of candidate nodes. A min-plus
+    dynamic program with backpointers then finds the best path.
+
+    The trellis has exactly the same positions, candidate nodes and edge weights as a
+    (pruned) `GamutParseGraph`: consecutive input pitches are connected by all shortest
+    paths in the gamut between the nodes matching them. Between paths of equal weight,
+    the path whose sequence of node codes comes first is selected, which is also how
+    segments of the parse graph rank their paths. The best path is therefore identical to
+    `GamutParseGraph.iter_best_path`.
+    """
+
+    def __init__(
+        self,
+        gamut: GamutGraph,
+        sequence: Iterable[PitchCode],
+        mismatch_penalty: float = 0,
+    ):
+        self.gamut = gamut
+        self.seq = list(sequence)
+        self.mismatch_penalty = mismatch_penalty
+        self.input_positions = None
+        self.weight = None
+        self._layers = None
+        self._costs = None
+        self._penalties = {}
+        self._masks = {}
+
+    def __repr__(self):
+        return f"<Trellis of length {len(self.seq)}>"
+
+    def penalties(self, target: PitchCode) -> np.ndarray:
+        """Mismatch penalties of all gamut nodes for a target pitch"""
+        if target not in self._penalties:
+            penalties = np.full(len(self.gamut.node_list), float(self.mismatch_penalty))
+            penalties[self.gamut.pitch_index.get(target, [])] = 0
+            self._penalties[target] = penalties
+        return self._penalties[target]
+
+    def matches(self, target: PitchCode) -> np.ndarray:
+        return np.array(self.gamut.diatonic_index.get(target[0], []), dtype=int)
+
+    def masks(
+        self, prev_value: PitchCode, next_value: PitchCode, candidates: np.ndarray
+    ) -> list[np.ndarray]:
+        """The candidate nodes at all positions between two input pitches: node x can
+        occur j steps after the previous pitch if it lies j steps from a candidate node
+        of the previous pitch and L - j steps from a node matching the next pitch, where
+        L is the length of the shortest paths between any nodes matching both pitches.
+        Returns a list with the (sorted) codes of the candidates at every position."""
+        key = (prev_value[0], next_value[0], np.sort(candidates).tobytes())
+        if key not in self._masks:
+            hops = self.gamut.shortest_path_table.hops
+            sources = self.matches(prev_value)
+            targets = self.matches(next_value)
+            distances = hops[np.ix_(sources, targets)]
+            reachable = distances[distances >= 0]
+            if len(reachable) == 0:
+                raise Exception("This sequence could not be parsed")
+            length = reachable.min()
+            if length == 0:
+                # Repeated notes: every candidate can only be repeated (using a loop)
+                masks = [np.sort(candidates)]
+            else:
+                from_sources = hops[candidates]
+                to_targets = hops[:, targets]
+                masks = []
+                for j in range(1, length + 1):
+                    mask = (from_sources == j).any(axis=0)
+                    mask &= (to_targets == length - j).any(axis=1)
+                    masks.append(np.flatnonzero(mask))
+            self._masks[key] = (length, masks)
+        return self._masks[key]
+
+    def first_layer(self, value: PitchCode) -> tuple[np.ndarray, np.ndarray]:
+        """The nodes matching the first pitch of a sequence and their costs."""
+        nodes = self.matches(value)
+        if len(nodes) == 0:
+            raise Exception("This sequence could not be parsed")
+        return nodes, self.penalties(value)[nodes]
+
+    def advance(
+        self,
+        nodes: np.ndarray,
+        costs: np.ndarray,
+        prev_value: PitchCode,
+        next_value: PitchCode,
+    ) -> tuple[list[tuple[np.ndarray, np.ndarray]], np.ndarray]:
+        """Extend the trellis from the nodes of the previous pitch to the next pitch.
+        Returns the new layers, each a tuple of nodes and the row indices of their
+        parents in the previous layer, and the costs of the nodes in the last layer."""
+        weights = self.gamut.weight_matrix
+        length, masks = self.masks(prev_value, next_value, nodes)
+        if length == 0 and prev_value != next_value:
+            raise Exception("This sequence could not be parsed")
+        layers = []
+        for j, targets in enumerate(masks):
+            if length == 0:
+                # Only loops: a square matrix with the loop weights on the diagonal
+                transition = np.full((len(nodes), len(targets)), np.inf)
+                diagonal = nodes[:, None] == targets[None, :]
+                transition[diagonal] = weights[nodes, nodes]
+            else:
+                transition = weights[np.ix_(nodes, targets)]
+            if j == len(masks) - 1:
+                transition = transition + self.penalties(next_value)[targets]
+
+            # Min-plus step. Nodes are ordered lexicographically by their best paths,
+            # so in case of ties the first (lowest) row index is the best parent.
+            total = costs[:, None] + transition
+            best = total.min(axis=0)
+            parents = (total == best[None, :]).argmax(axis=0)
+            reachable = np.isfinite(best)
+            targets, best, parents = (
+                targets[reachable],
+                best[reachable],
+                parents[reachable],
+            )
+            if len(targets) == 0:
+                raise Exception("This sequence could not be parsed")
+
+            # The lexicographic order of the best paths to the new nodes: first by
+            # the order of the best path to the parent, then by the node itself.
+            order = np.lexsort((targets, parents))
+            nodes, costs = targets[order], best[order]
+            layers.append((nodes, parents[order]))
+        return layers, costs
+
+    def run(self):
+        """Run the dynamic program over the whole sequence. Every layer of the trellis
+        stores the reachable nodes in the lexicographic order of their best paths, the
+        costs of those paths and the parent of every node."""
+        if len(self.seq) == 0:
+            raise ValueError("The sequence is empty")
+
+        # First position: from the start node to all nodes matching the first pitch
+        nodes, costs = self.first_layer(self.seq[0])
+        layers = [(nodes, np.full(len(nodes), -1))]
+        self.input_positions = [1]
+        for prev_value, next_value in zip(self.seq, self.seq[1:]):
+            new_layers, costs = self.advance(nodes, costs, prev_value, next_value)
+            layers.extend(new_layers)
+            nodes = new_layers[-1][0]
+            self.input_positions.append(len(layers))
+
+        self._layers = layers
+        self._costs = costs
+        self.weight = costs.min()
+
+    @staticmethod
+    def backtrack(layers: list[tuple[np.ndarray, np.ndarray]], index: int) -> list[int]:
+        """The codes of the nodes on the path ending in row `index` of the last layer."""
+        path = []
+        for nodes, parents in reversed(layers):
+            path.append(int(nodes[index]))
+            index = parents[index]
+        return path[::-1]
+
+    def best_path(self, input_only: bool = True) -> list[GamutGraphCode]:
+        """Return the codes of the nodes on the best path; by default only the nodes at
+        positions corresponding to the input sequence."""
+        if self._layers is None:
+            self.run()
+        # The best final node has the lowest cost, and then the lowest (lexicographic)
+        # order; by construction that is the first node with the lowest cost.
+        index = int(np.argmin(self._costs))
+        path = self.backtrack(self._layers, index)
+        if input_only:
+            return [path[pos - 1] for pos in self.input_positions]
+        return path
@@ -5,11 +5,16 @@
 # -------------------------------------------------------------------
 import networkx as nx
 import numpy as np
-import matplotlib.cm as cm
 from collections.abc import Iterable
+from typing import Union
 from music21.pitch import Pitch
 from music21.stream import Stream
-from music21.note import Note
+from music21.note import Note, NotRest
+from music21.clef import Clef
+from music21.key import KeySignature
+
+# A compact, hashable representation of a pitch: its diatonic note number and alteration
+PitchCode = tuple[int, float]
 
 
 def as_stream(pitch_string: str, sep: str = " ") -> Stream:
@@ -24,6 +29,31 @@ def as_pitch(pitch):
     return pitch
 
 
+def pitch_code(pitch: Union[Pitch, PitchCode]) -> PitchCode:
+    """Encode a pitch as a tuple of its diatonic note number and alteration. Two
+    pitches are equal if and only if their codes are equal. Codes are returned as is.
+
+    >>> pitch_code(Pitch("B-4"))
+    (35, -1.0)
+    """
+    if isinstance(pitch, tuple):
+        return pitch
+    return (pitch.diatonicNoteNum, pitch.alter)
+
+
+def compact_graph(graph: nx.DiGraph) -> tuple[list, dict, list[dict[int, float]]]:
+    """Number the nodes of a graph in insertion order. Returns the list of nodes, a
+    dictionary mapping nodes to their number (code) and, for every code, a dictionary
+    with the weights of the outgoing edges, again indexed by code."""
+    nodes = list(graph.nodes)
+    codes = {node: code for code, node in enumerate(nodes)}
+    successors = [
+        {codes[v]: data.get("weight", 1) for v, data in graph.adj[node].items()}
+        for node in nodes
+    ]
+    return nodes, codes, successors
+
+
 def extract_lyrics(notes: Iterable[Note], number: int) -> list[str]:
     """Extract the lyrics at a given line number from an iterable of notes"""
     extracted = []
@@ -46,6 +76,24 @@ def num_lyrics(stream: Stream) -> int:
     return num_lyrics
 
 
+def scan_stream(stream: Stream) -> tuple[Clef, KeySignature, list[NotRest]]:
+    """Flatten a stream once and return its clef, its key signature and all notes that
+    do not end a tie. The clef and key signature are the first ones at offset 0, as in
+    `stream.flat.clef` and `stream.flat.keySignature`."""
+    clef = key_signature = None
+    notes = []
+    for element in stream.flatten():
+        if isinstance(element, NotRest):
+            if element.tie is None or element.tie.type != "stop":
+                notes.append(element)
+        elif element.offset == 0:
+            if clef is None and isinstance(element, Clef):
+                clef = element
+            elif key_signature is None and isinstance(element, KeySignature):
+                key_signature = element
+    return clef, key_signature, notes
+
+
 def annotate_note(
     note: Note, text: str = None, color: str = None, number: int = 1
 ) -> None:
@@ -101,25 +149,23 @@ def segment_deviations(sequence, value):
     >>> segment_deviations([1, 2, 1, 1, 1, 1], 1)
     [(0, 2), (3, 5)]
     """
+    # All indices are absolute, so that every element is visited a constant number of
+    # times and no copies of the sequence are made.
     start = 0
     segments = []
     while start < len(sequence):
-        diff = find_first_difference(sequence[start:], value)
+        diff = find_first_difference(sequence, value, offset=start)
         if diff is None:
             segments.append((start, len(sequence) - 1))
             break
         else:
-            end = find_first_repeat(sequence[start:], value, offset=max(0, diff - 2))
+            end = find_first_repeat(sequence, value, offset=max(start, diff - 2))
             if end is None:
                 segments.append((start, len(sequence) - 1))
                 break
             else:
-                if start == 0:
-                    segment = (0, end)
-                else:
-                    segment = (start, start + end)
-                segments.append(segment)
-                start += end + 1
+                segments.append((start, end))
+                start = end + 1
 
     return segments
 
@@ -132,10 +178,15 @@ def draw_graph(
     show_loops=False,
     label_kws={},
     edge_kws={},
-    color_mapper=lambda w: cm.Reds(0.9 * w + 0.1),
+    color_mapper=None,
 ):
     """
     Draw a networkx graph with specific attributes for nodes and edges."""
+    if color_mapper is None:
+        import matplotlib.cm as cm
+
+        color_mapper = lambda w: cm.Reds(0.9 * w + 0.1)
+
     # Nodes
     if pos is None:
         pos = nx.get_node_attributes(graph, "position")
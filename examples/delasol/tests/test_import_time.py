@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+from import_time import check_import_time
+
+
+def test_import_time_budget():
+    """Importing delasol stays within the budget and does not import the plotting or
+    corpus dependencies (see benchmarks/import_time.py)."""
+    assert check_import_time() == []
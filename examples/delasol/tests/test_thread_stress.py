@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------
+# Author: Bas Cornelissen
+# Copyright © 2024 Bas Cornelissen
+# -------------------------------------------------------------------
+from thread_stress import check_threads
+
+
+def test_threads_match_sequential():
+    """Solmizing in a thread pool gives the same results as solmizing sequentially,
+    and every gamut is constructed only once (see benchmarks/thread_stress.py)."""
+    assert check_threads(threads=4, rounds=2, num_melodies=3, length=20) == []
@@ -10,7 +10,9 @@ def run_solmization(bestOnly: bool, showWeights: bool, style:str, path):
     score = converter.parse(path)
 
     for part in score.parts:
-        solmization = solmize(part, style=style)
+        # The trellis engine only computes the best path, but is much faster
+        engine = "trellis" if bestOnly else "graph"
+        solmization = solmize(part, style=style, engine=engine)
         solmization.annotate(
             # All these are optional:
             # Only annotate the best solmization